@@ -1,12 +1,14 @@
 #!/usr/bin/env bash
 # ----------------------------------------------------------------------------
 # This script prepares the source dataset as follows:
-# 1. It transcribes the Morris Arff dataset to IPAL using the
-#    `transcribe-to-ipal.py` script.
-# 2. It runs the `preprocess-dataset.py` script which preprocesses features of
-#    the dataset and adds cached state.
+# 1. It transcribes the Morris Arff dataset to IPAL.
+# 2. It preprocesses features of the dataset and adds cached state.
 # 3. It splits it into 5 parts of equal size to be used with cross-validation.
 #
+# All steps are run in a single process by the `prepare-dataset.py` script,
+# which combines `transcribe-to-ipal.py`, `preprocess-dataset.py` and
+# `split-dataset.py` without intermediate files.
+#
 # Parameters:
 #     -d    Sets the path to the source dataset (in Arff format) to be used.
 # ----------------------------------------------------------------------------
@@ -34,33 +36,14 @@ if [ -z "${SOURCE_DATASET}" ]; then
     usage
 fi
 
-# --- Transcribe to IPAL -----------------------------------------------------
-echo "Transcribing dataset to IPAL..."
-
-../scripts/transcribe-to-ipal.py \
-    -o dataset.ipal \
-    "${SOURCE_DATASET}"
-
-# --- Prepare dataset --------------------------------------------------------
-echo "Preparing dataset..."
+# --- Transcribe, prepare and split dataset ----------------------------------
+echo "Transcribing, preparing, shuffling and splitting dataset..."
 
-../scripts/preprocess-dataset.py \
-    -i dataset.ipal \
-    -o dataset-processed.ipal
-# first 4 messages are always skipped due to incomplete state
-tail -n +5 dataset-processed.ipal >dataset.ipal
-rm dataset-processed.ipal
-
-# --- Splitting dataset ------------------------------------------------------
-echo "Shuffling and splitting dataset..."
-
-../scripts/split-dataset.py \
-    -i dataset.ipal \
+# the first 4 messages are always skipped due to incomplete state
+../scripts/prepare-dataset.py \
     -n 5 \
     -m sequence-of-four \
-    -o "part-"
-
-rm dataset.ipal
-gzip -f part*.ipal
+    -o "part-" \
+    "${SOURCE_DATASET}"
 
 echo "Done"
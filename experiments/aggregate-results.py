@@ -2,10 +2,21 @@
 """
 This script aggregates the results of all omit attacks and single attacks experiments
 into a single file "results.json" containing all relevant data.
+
+With --progressive, it aggregates the preliminary results of quick-look runs on
+stratified subsamples (see progressive-evaluation.py) into "results-progressive.json"
+instead. For each experiment, the largest sample fraction for which all folds are
+available is used (complete results count as fraction 1). The recall of each attack type
+and category is given with a Wilson score interval over the packets of all folds, and
+cells whose interval is wider than --max-width or which have no packets at all are
+reported as uncertain.
 """
 
+import argparse
+import glob
 import os
-from typing import Dict, List
+import re
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 import json
 
@@ -89,8 +100,243 @@ def load_cross_validation(fold_files: List[str]) -> Dict[str, List[float]]:
     }
 
 
+def wilson_interval(
+    successes: np.ndarray, count: np.ndarray, z: float = 1.96
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Wilson score interval of a proportion, NaN where count is zero.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = successes / count
+        center = (p + z**2 / (2 * count)) / (1 + z**2 / count)
+        half_width = (
+            z
+            / (1 + z**2 / count)
+            * np.sqrt(p * (1 - p) / count + z**2 / (4 * count**2))
+        )
+    return center - half_width, center + half_width
+
+
+def recall_bounds(fold_files: List[str], key: str, size: int) -> Dict[str, List[float]]:
+    """
+    Bounds of the recall of each attack type or category (key "attack_types" or
+    "attack_categories") over the packets of all folds. As in create-statistics.py, the
+    "recall" of the benign class 0 is the fraction of packets labelled normal.
+    """
+    correct = np.zeros(size)
+    count = np.zeros(size)
+    for filename in fold_files:
+        with open(filename, "r") as f:
+            data = json.load(f)[key]
+        for i in range(size):
+            normal = data[f"{i}"]["labelled_normal"]
+            malicious = data[f"{i}"]["labelled_malicious"]
+            correct[i] += normal if i == 0 else malicious
+            count[i] += normal + malicious
+
+    lower, upper = wilson_interval(correct, count)
+    return {"lower": lower.tolist(), "upper": upper.tolist(), "count": count.tolist()}
+
+
+def list_experiments(classifier: str) -> List[Tuple[str, Optional[int], str, str]]:
+    """
+    List the experiments of a classifier as tuples of the result group, the attack type
+    or category (None for the baseline), the experiment folder and the name of the run.
+    """
+    experiments = [("baseline", None, "omit-attacks", f"{classifier}-baseline")]
+    for attack_type in range(1, PACKET_TYPE_COUNT):
+        experiments.append(
+            (
+                "omit-attacks",
+                attack_type,
+                "omit-attacks",
+                f"{classifier}-type-{attack_type:02d}",
+            )
+        )
+        experiments.append(
+            (
+                "single-attacks",
+                attack_type,
+                "single-attacks",
+                f"{classifier}-type-{attack_type:02d}",
+            )
+        )
+    for attack_category in range(1, PACKET_CATEGORY_COUNT):
+        experiments.append(
+            (
+                "omit-categories",
+                attack_category,
+                "omit-attacks",
+                f"{classifier}-cat-{attack_category:02d}",
+            )
+        )
+        experiments.append(
+            (
+                "single-categories",
+                attack_category,
+                "single-attacks",
+                f"{classifier}-cat-{attack_category:02d}",
+            )
+        )
+    return experiments
+
+
+def progressive_fold_files(
+    experiments_folder: str,
+    progressive_folder: str,
+    folder: str,
+    name: str,
+    classifier: str,
+) -> Tuple[Optional[float], List[str]]:
+    """
+    Find the fold files of the largest sample fraction with results for all folds.
+    Returns the fraction and the files or (None, []) if there are no complete results.
+    """
+    complete_files = [
+        os.path.join(
+            experiments_folder,
+            f"{folder}/results/{classifier}/{name}_fold-{fold}.statistics.json",
+        )
+        for fold in range(FOLD_COUNT)
+    ]
+    if all(os.path.exists(filename) for filename in complete_files):
+        return 1.0, complete_files
+
+    fractions = set()
+    pattern = os.path.join(
+        progressive_folder,
+        folder,
+        classifier,
+        f"{name}_fraction-*_fold-0.statistics.json",
+    )
+    for filename in glob.glob(pattern):
+        match = re.search(r"_fraction-([0-9.e-]+)_fold-0\.statistics\.json$", filename)
+        fractions.add(match.group(1))
+
+    for fraction in sorted(fractions, key=float, reverse=True):
+        fold_files = [
+            os.path.join(
+                progressive_folder,
+                folder,
+                classifier,
+                f"{name}_fraction-{fraction}_fold-{fold}.statistics.json",
+            )
+            for fold in range(FOLD_COUNT)
+        ]
+        if all(os.path.exists(filename) for filename in fold_files):
+            return float(fraction), fold_files
+    return None, []
+
+
+def aggregate_progressive(
+    experiments_folder: str, progressive_folder: str, max_width: float
+) -> Dict:
+    data = {}
+    uncertain = []
+
+    for classifier in CLASSIFIERS:
+        data[classifier] = {
+            "baseline": {},
+            "omit-attacks": {},
+            "omit-categories": {},
+            "single-attacks": {},
+            "single-categories": {},
+        }
+
+        for (group, index, folder, name) in list_experiments(classifier):
+            fraction, fold_files = progressive_fold_files(
+                experiments_folder, progressive_folder, folder, name, classifier
+            )
+            if fraction is None:
+                continue
+
+            result = load_cross_validation(fold_files)
+            result["fraction"] = fraction
+            detailed = result["recall"]["detailed"]
+            for (key, column, size) in [
+                ("types", "attack_types", PACKET_TYPE_COUNT),
+                ("categories", "attack_categories", PACKET_CATEGORY_COUNT),
+            ]:
+                bounds = recall_bounds(fold_files, column, size)
+                for i in range(size):
+                    lower, upper = bounds["lower"][i], bounds["upper"][i]
+                    count = int(bounds["count"][i])
+                    detailed[key][i].update(lower=lower, upper=upper)
+                    # cells without packets have no bounds and are uncertain as well
+                    if count == 0 or upper - lower > max_width:
+                        uncertain.append(
+                            {
+                                "classifier": classifier,
+                                "experiment": group,
+                                "index": index,
+                                key: i,
+                                "fraction": fraction,
+                                "count": count,
+                                "width": upper - lower if count else None,
+                            }
+                        )
+
+            if group == "baseline":
+                data[classifier][group] = result
+            else:
+                data[classifier][group][index] = result
+
+    data["max_width"] = max_width
+    data["uncertain"] = uncertain
+    return data
+
+
+def print_progressive_summary(data: Dict):
+    for classifier in CLASSIFIERS:
+        for (group, results) in data[classifier].items():
+            cells = [
+                cell
+                for cell in data["uncertain"]
+                if cell["classifier"] == classifier and cell["experiment"] == group
+            ]
+            runs = (1 if results else 0) if group == "baseline" else len(results)
+            if runs:
+                print(
+                    f"{classifier} {group}: {runs} runs, {len(cells)} uncertain cells"
+                )
+
+
 def main():
+    parser = argparse.ArgumentParser(
+        description="Aggregate the results of all experiments into a single file"
+    )
+    parser.add_argument(
+        "--progressive",
+        action="store_true",
+        help="Aggregate the preliminary results of quick-look runs on subsamples",
+    )
+    parser.add_argument(
+        "--progressive-folder",
+        default=os.path.join(os.path.dirname(__file__), "..", "data", "progressive"),
+        help="Folder holding the quick-look results (default: data/progressive)",
+    )
+    parser.add_argument(
+        "--max-width",
+        default=0.1,
+        type=float,
+        help="Recall cells with a wider confidence interval are reported as uncertain "
+        "(default: 0.1)",
+    )
+    args = parser.parse_args()
+
     experiments_folder = os.path.dirname(__file__)
+
+    if args.progressive:
+        data = aggregate_progressive(
+            experiments_folder, args.progressive_folder, args.max_width
+        )
+        print_progressive_summary(data)
+        with open(
+            os.path.join(os.path.dirname(__file__), "results-progressive.json"), "w"
+        ) as f:
+            json.dump(data, f, indent=4)
+        return
+
     data = {}
 
     for classifier in CLASSIFIERS:
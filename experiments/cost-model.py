@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+This script learns the runtime and memory of the experiments from the logs of finished runs
+(experiments/*/results/*/*.out.gz) to schedule campaigns.
+
+A log records the start of every fold and the end of the run (see run-experiment.sh), the
+size of the train set of each fold as logged by the IDS and, if the run was wrapped in
+\\time like in the Slurm scripts, its elapsed time and peak memory. Folds whose train set
+size is not logged get it from their statistics: every packet of the dataset is either in
+the train set or in the test set of a fold, so the train set holds the packets which are
+not counted in the statistics. This only holds for classifiers whose statistics of all
+logged folds add up to the same dataset size, other folds take the size of the same fold
+of another classifier.
+
+Per classifier, the runtime of a fold is fitted as a power law of the size of its train set
+with a factor per experiment family (a straight line in log-log space), which captures the
+superlinear training of the SVM as well as the different test sets of the families. The
+exponent is only credible if the train set sizes span a wide range. The folds of the
+experiments only span a narrow one (e.g. 173k to 220k packets), over which the exponent is
+dominated by noise and the differences between the families. Hence, if the largest size is
+less than MIN_SIZE_RATIO times the smallest, the runtime of a fold is taken as the median
+of its family instead. The peak memory of a run is fitted as a linear function of its
+largest train set, or taken as the largest observed peak memory if it does not grow with
+the train set. The costs observed per classifier and experiment family and the fitted
+models are printed and written to data/cost-model.json (or --output).
+
+With --slurm, a submission script is generated which submits every run of the selected
+classifiers and families as a job of its own, longest predicted runtime first, so that the
+SVM runs start first instead of determining the end of the campaign. Each job requests the
+memory predicted for it instead of the uniform request of the Slurm scripts.
+"""
+
+import argparse
+import gzip
+import importlib.util
+import json
+import math
+import os
+import re
+import shlex
+from datetime import datetime, timedelta
+import numpy as np
+from tabulate import tabulate
+
+EXPERIMENTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+FOLD_COUNT = 5
+# time zones of the dates in the logs, as hours ahead of UTC
+TIME_ZONES = {"UTC": 0, "GMT": 0, "CET": 1, "CEST": 2}
+TRAIN_SIZE = re.compile(r"training on (?:first )?(\d+)|Train features: (\d+) x")
+# memory requests are the predicted peak memory plus this margin
+MEMORY_MARGIN = 1.25
+# requests of the Slurm scripts, used for classifiers without logged memory
+CPUS_PER_TASK = {"rf": 5, "svm": 5, "blstm": 6}
+DEFAULT_MEMORY_GB = {"rf": 8, "svm": 16, "blstm": 8}
+ENVIRONMENT_PATH = "/opt/kus/miniconda3/envs/ml-and-ids/bin"
+# the runtime is only fitted as a power law if the train set sizes span at least this ratio
+MIN_SIZE_RATIO = 2.0
+
+
+def load_aggregation():
+    """
+    Import aggregate-results.py as module.
+    """
+    path = os.path.join(EXPERIMENTS_FOLDER, "aggregate-results.py")
+    spec = importlib.util.spec_from_file_location("aggregate_results", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_date(text):
+    """
+    Parse the output of date, e.g. "Tue Nov  2 13:55:25 CET 2021", into a naive UTC
+    datetime.
+    """
+    weekday, month, day, clock, zone, year = text.split()
+    date = datetime.strptime(f"{month} {day} {year} {clock}", "%b %d %Y %H:%M:%S")
+    return date - timedelta(hours=TIME_ZONES.get(zone, 0))
+
+
+def parse_duration(text):
+    """
+    Parse an elapsed time of \\time ([hours:]minutes:seconds) into seconds.
+    """
+    return sum(
+        float(value) * 60**i for (i, value) in enumerate(reversed(text.split(":")))
+    )
+
+
+def parse_log(path):
+    """
+    Return the duration and train set size of each fold of a run and its elapsed time and
+    peak memory (in KB) if they were logged. Folds which did not finish are omitted.
+    """
+    starts = []
+    end = None
+    sizes = {}
+    elapsed = None
+    memory = None
+    with gzip.open(path, "rt", errors="replace") as f:
+        for line in f:
+            if line.startswith("Running fold "):
+                starts.append(parse_date(line.split(" - ", 1)[1]))
+            elif line.startswith("All folds completed - "):
+                end = parse_date(line.split(" - ", 1)[1])
+            elif line.startswith("Time elapsed:"):
+                elapsed = parse_duration(line.split()[-1])
+            elif line.startswith("Max memory use:"):
+                memory = int(line.split()[-2])
+            elif starts and len(starts) - 1 not in sizes:
+                match = TRAIN_SIZE.search(line)
+                if match is not None:
+                    sizes[len(starts) - 1] = int(match.group(1) or match.group(2))
+
+    ends = starts[1:] + ([end] if end is not None else [])
+    return {
+        "fold_seconds": [(b - a).total_seconds() for (a, b) in zip(starts, ends)],
+        "train_sizes": [sizes.get(fold) for fold in range(len(ends))],
+        "elapsed": elapsed,
+        "memory": memory,
+    }
+
+
+def test_set_size(folder, classifier, name, fold):
+    """
+    Return the number of packets counted in the statistics of a fold, if available.
+    """
+    path = os.path.join(
+        EXPERIMENTS_FOLDER,
+        folder,
+        "results",
+        classifier,
+        f"{name}_fold-{fold}.statistics.json",
+    )
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        data = json.load(f)
+    return data["TP"] + data["TN"] + data["FP"] + data["FN"]
+
+
+def experiment_key(run):
+    # the train sets of a run do not depend on the classifier
+    return (run["folder"], run["name"].split("-", 1)[1])
+
+
+def collect_runs(classifiers):
+    """
+    Parse the logs of all finished runs of the classifiers and complete the train set
+    sizes which were not logged.
+    """
+    aggregation = load_aggregation()
+    runs = []
+    for classifier in classifiers:
+        for (group, index, folder, name) in aggregation.list_experiments(classifier):
+            path = os.path.join(
+                EXPERIMENTS_FOLDER, folder, "results", classifier, f"{name}.out.gz"
+            )
+            if os.path.exists(path):
+                runs.append(
+                    {
+                        "classifier": classifier,
+                        "group": group,
+                        "index": index,
+                        "folder": folder,
+                        "name": name,
+                        **parse_log(path),
+                    }
+                )
+
+    for classifier in classifiers:
+        own = [run for run in runs if run["classifier"] == classifier]
+        test_sizes = {
+            (id(run), fold): test_set_size(run["folder"], classifier, run["name"], fold)
+            for run in own
+            for fold in range(len(run["train_sizes"]))
+        }
+        totals = {
+            size + test_sizes[(id(run), fold)]
+            for run in own
+            for (fold, size) in enumerate(run["train_sizes"])
+            if size is not None and test_sizes[(id(run), fold)] is not None
+        }
+        if len(totals) != 1:
+            continue
+        (dataset_size,) = totals
+        for run in own:
+            run["train_sizes"] = [
+                (
+                    dataset_size - test_sizes[(id(run), fold)]
+                    if size is None and test_sizes[(id(run), fold)] is not None
+                    else size
+                )
+                for (fold, size) in enumerate(run["train_sizes"])
+            ]
+
+    known = {}
+    for run in runs:
+        for (fold, size) in enumerate(run["train_sizes"]):
+            if size is not None:
+                known.setdefault((*experiment_key(run), fold), size)
+    for run in runs:
+        run["train_sizes"] = [
+            known.get((*experiment_key(run), fold)) if size is None else size
+            for (fold, size) in enumerate(run["train_sizes"])
+        ]
+    return runs
+
+
+def fit_runtime(folds):
+    """
+    Fit log(seconds) = exponent * log(size) + factor of the family to (family, size,
+    seconds) of each fold by least squares. If the sizes span less than MIN_SIZE_RATIO,
+    the exponent is None and the factor is the log of the median seconds of the family.
+    """
+    groups = sorted({group for (group, _, _) in folds})
+    sizes = [size for (_, size, _) in folds]
+    if max(sizes) < MIN_SIZE_RATIO * min(sizes):
+        return {
+            "exponent": None,
+            "factors": {
+                group: math.log(
+                    np.median([seconds for (g, _, seconds) in folds if g == group])
+                )
+                for group in groups
+            },
+        }
+    A = np.array(
+        [
+            [math.log(size) if len({s for (_, s, _) in folds}) > 1 else 0.0]
+            + [group == other for other in groups]
+            for (group, size, _) in folds
+        ],
+        dtype=float,
+    )
+    y = np.array([math.log(seconds) for (_, _, seconds) in folds])
+    coefficients = np.linalg.lstsq(A, y, rcond=None)[0]
+    return {
+        "exponent": float(coefficients[0]),
+        "factors": dict(zip(groups, coefficients[1:].tolist())),
+    }
+
+
+def fit_memory(peaks):
+    """
+    Fit the peak memory = slope * size + intercept to (size, memory) of each run, or a
+    constant maximum if it does not grow with the size.
+    """
+    sizes, memory = zip(*peaks)
+    if len(set(sizes)) > 1:
+        slope, intercept = np.polyfit(sizes, memory, 1)
+        if slope > 0:
+            return [float(slope), float(intercept)]
+    return [0.0, float(max(memory))]
+
+
+def fit_models(runs, classifiers):
+    """
+    Fit the runtime and memory model of each classifier. The runtime model holds the
+    exponent of the power law of a fold and the log factor of each family, the memory
+    model the slope and intercept of the peak memory (KB) of a run. Models without data
+    are None.
+    """
+    models = {}
+    for classifier in classifiers:
+        own = [run for run in runs if run["classifier"] == classifier]
+        folds = [
+            (run["group"], size, seconds)
+            for run in own
+            for (size, seconds) in zip(run["train_sizes"], run["fold_seconds"])
+            if size and seconds > 0
+        ]
+        peaks = [
+            (max(size for size in run["train_sizes"] if size), run["memory"])
+            for run in own
+            if run["memory"] is not None and any(run["train_sizes"])
+        ]
+        models[classifier] = {
+            "runtime": fit_runtime(folds) if folds else None,
+            "memory": fit_memory(peaks) if peaks else None,
+            "folds": len(folds),
+            "runs with memory": len(peaks),
+        }
+    return models
+
+
+def predict_runtime(models, classifier, group, train_sizes):
+    """
+    Predict the runtime of a run in seconds from the train set sizes of its folds. Runs
+    of families without logs get the mean factor of the other families. Without an
+    exponent, every fold takes the median runtime of the family.
+    """
+    model = models[classifier]["runtime"]
+    factors = model["factors"]
+    factor = factors.get(group, np.mean(list(factors.values())))
+    exponent = model["exponent"] or 0.0
+    return sum(math.exp(factor + exponent * math.log(size)) for size in train_sizes)
+
+
+def predict_memory(models, classifier, train_sizes):
+    """
+    Predict the peak memory of a run in KB, None if no memory was logged.
+    """
+    if models[classifier]["memory"] is None:
+        return None
+    slope, intercept = models[classifier]["memory"]
+    return max(slope * max(train_sizes) + intercept, 0)
+
+
+def expected_train_sizes(cost_model, group, folder, name):
+    """
+    Return the train set sizes of the folds of a run as observed for any classifier, or
+    the median sizes of its family.
+    """
+    key = [folder, name.split("-", 1)[1]]
+    family = []
+    for run in cost_model["runs"]:
+        sizes = run["train_sizes"]
+        if len(sizes) != FOLD_COUNT or None in sizes:
+            continue
+        if [run["folder"], run["name"].split("-", 1)[1]] == key:
+            return sizes
+        if run["group"] == group:
+            family.append(sizes)
+    if not family:
+        return None
+    return [float(size) for size in np.median(family, axis=0)]
+
+
+def build_cost_model(classifiers):
+    runs = collect_runs(classifiers)
+    return {"models": fit_models(runs, classifiers), "runs": runs}
+
+
+def print_costs(cost_model):
+    rows = []
+    for (classifier, model) in cost_model["models"].items():
+        groups = {}
+        for run in cost_model["runs"]:
+            if run["classifier"] == classifier:
+                groups.setdefault(run["group"], []).append(run)
+        for (group, runs) in groups.items():
+            sizes = [size for run in runs for size in run["train_sizes"] if size]
+            hours = [
+                sum(run["fold_seconds"]) / 3600
+                for run in runs
+                if len(run["fold_seconds"]) == FOLD_COUNT
+            ]
+            memory = [run["memory"] / 1024**2 for run in runs if run["memory"]]
+            rows.append(
+                [
+                    classifier,
+                    group,
+                    len(runs),
+                    np.mean(sizes) if sizes else None,
+                    np.mean(hours) if hours else None,
+                    max(hours) if hours else None,
+                    max(memory) if memory else None,
+                ]
+            )
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "classifier",
+                "family",
+                "runs",
+                "train set",
+                "mean [h]",
+                "max [h]",
+                "max memory [GB]",
+            ],
+            floatfmt=".1f",
+            missingval="-",
+        )
+    )
+    print("")
+
+    for (classifier, model) in cost_model["models"].items():
+        runtime = "-"
+        if model["runtime"] is not None and model["runtime"]["exponent"] is None:
+            runtime = "median per family (train set sizes too close for a power law)"
+        elif model["runtime"] is not None:
+            runtime = f"~ n^{model['runtime']['exponent']:.2f}"
+        memory = "-"
+        if model["memory"] is not None:
+            slope, intercept = model["memory"]
+            memory = f"{intercept / 1024**2:.2f} GB + {slope / 1024:.3g} MB * n"
+        print(
+            f"{classifier}: fold runtime {runtime} ({model['folds']} folds), "
+            f"peak memory {memory} ({model['runs with memory']} runs)"
+        )
+
+
+def slurm_jobs(cost_model, classifiers, groups):
+    """
+    Return the runs of the classifiers and families with their predicted runtime (s) and
+    memory request (GB), longest predicted runtime first.
+    """
+    aggregation = load_aggregation()
+    jobs = []
+    for classifier in classifiers:
+        for (group, index, folder, name) in aggregation.list_experiments(classifier):
+            if group not in groups:
+                continue
+            sizes = expected_train_sizes(cost_model, group, folder, name)
+            runtime = None
+            memory = None
+            if sizes is not None and cost_model["models"][classifier]["runtime"]:
+                runtime = predict_runtime(
+                    cost_model["models"], classifier, group, sizes
+                )
+                memory = predict_memory(cost_model["models"], classifier, sizes)
+            memory_gb = (
+                DEFAULT_MEMORY_GB[classifier]
+                if memory is None
+                else max(math.ceil(memory * MEMORY_MARGIN / 1024**2), 1)
+            )
+            jobs.append((classifier, group, index, folder, name, runtime, memory_gb))
+    # runs without prediction first, their runtime is unknown
+    jobs.sort(key=lambda job: -math.inf if job[5] is None else -job[5])
+    return jobs
+
+
+def write_slurm_script(path, jobs):
+    lines = [
+        "#!/usr/bin/env zsh",
+        "# Generated by experiments/cost-model.py, submits the runs longest predicted",
+        "# runtime first with the predicted memory",
+        "",
+        f"cd {shlex.quote(EXPERIMENTS_FOLDER)}",
+        "",
+    ]
+    for (classifier, group, index, folder, name, runtime, memory_gb) in jobs:
+        arguments = []
+        if index is not None:
+            arguments = ["-s" if group.endswith("categories") else "-t", str(index)]
+        command = " ".join(
+            [
+                f'export PATH="{ENVIRONMENT_PATH}:$PATH";',
+                '\\time -f "\\nTime elapsed:\\t%E\\nMax memory use:\\t%M KB"',
+                f"./run-experiment.sh -c {classifier}",
+                *arguments,
+                f'-p "../../data/${{SLURM_JOB_ID}}_{name}"',
+            ]
+        )
+        hours = "unknown" if runtime is None else f"{runtime / 3600:.1f} h"
+        lines += [
+            f"# {folder} {name}: {hours}, {memory_gb} GB",
+            f"sbatch --job-name={name} --chdir={folder} "
+            f"--cpus-per-task={CPUS_PER_TASK[classifier]} --mem={memory_gb}G "
+            f"--output=../../data/%j_{name}.out --wrap={shlex.quote(command)}",
+        ]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.chmod(path, 0o755)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Learn the runtime and memory of the experiments from their logs. "
+        "The runtime of a fold is only fitted as a power law of its train set size if "
+        f"the sizes span a factor of {MIN_SIZE_RATIO:g}, otherwise the median runtime of "
+        "its family is used, as the exponents fitted over the narrow range of the "
+        "experiments are not credible"
+    )
+    parser.add_argument(
+        "-c",
+        "--classifiers",
+        nargs="+",
+        default=["rf", "svm", "blstm"],
+        choices=["rf", "svm", "blstm"],
+        help="Classifiers to model (default: all)",
+    )
+    parser.add_argument(
+        "-g",
+        "--groups",
+        nargs="+",
+        default=[
+            "baseline",
+            "omit-attacks",
+            "omit-categories",
+            "single-attacks",
+            "single-categories",
+        ],
+        choices=[
+            "baseline",
+            "omit-attacks",
+            "omit-categories",
+            "single-attacks",
+            "single-categories",
+        ],
+        help="Experiment families submitted with --slurm (default: all)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=os.path.join(EXPERIMENTS_FOLDER, "..", "data", "cost-model.json"),
+        help="Write the cost model to that location (default: data/cost-model.json)",
+    )
+    parser.add_argument(
+        "--slurm",
+        help="Write a script submitting the runs longest predicted runtime first",
+    )
+    args = parser.parse_args()
+
+    cost_model = build_cost_model(args.classifiers)
+    print_costs(cost_model)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(cost_model, f, indent=4)
+
+    if args.slurm is not None:
+        jobs = slurm_jobs(cost_model, args.classifiers, args.groups)
+        write_slurm_script(args.slurm, jobs)
+        print(f"\nWrote {len(jobs)} jobs to {args.slurm}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,10 @@
 # This script runs one omit attacks experiment consisting of 5 folds.
 #
 # Parameters:
-#     -c    Sets the classifier to be used: rf, svm or blstm.
+#     -c    Sets the classifier to be used: rf, svm, svm-approx, sgd or blstm.
+#           svm-approx (the SVM with a kernel approximation) and sgd (a linear
+#           classifier trained out of core) are only implemented by
+#           scripts/run-classifier.py.
 #     -t    Sets one or multiple special anomaly/attack types. Attacks of
 #           this type will be ommitted from training and only be present in
 #           the test set.
@@ -12,6 +15,23 @@
 #           present in the test set.
 #     -p    [Optional] Sets a custom prefix for all created files. Defaults to
 #           the current timestamp.
+#     -b    [Optional] Only keep compact predictions (packet ids and
+#           bit-packed IDS output) instead of the full IDS output.
+#     -f    [Optional] Stream the train and test sets to ipal-iids through
+#           named pipes while they are built instead of writing them to
+#           temporary files. Requires the IDS to read the train set once.
+#     -q    [Optional] Quick-look mode: train and test on a stratified
+#           subsample of the given fraction of each set which keeps every
+#           attack type (see scripts/subsample-dataset.py). The fraction is
+#           added to the names of the created files.
+#     -r    [Optional] Prefix of a finished run of the same experiment, e.g.
+#           with the exact SVM. The deltas of the metrics against its
+#           output are added to the statistics of each fold.
+#     -x    [Optional] Pass the dataset parts and their filters directly to
+#           scripts/run-classifier.py, which shares them with the other jobs
+#           on the node through shared memory (see scripts/cache.py), instead
+#           of building the train and test sets. Requires -b and
+#           run-classifier.py and can not be combined with -f or -q.
 # ----------------------------------------------------------------------------
 
 set -e
@@ -19,12 +39,12 @@ set -o pipefail
 
 # --- Option processing ------------------------------------------------------
 usage() {
-    echo "Usage: $0 -c <rf|svm|blstm> [-t <attack type>] [-s <attack category>] [-p <string>]" 1>&2
+    echo "Usage: $0 -c <rf|svm|svm-approx|sgd|blstm> [-t <attack type>] [-s <attack category>] [-p <string>] [-b] [-f] [-q <fraction>] [-r <reference prefix>] [-x]" 1>&2
     exit 1
 }
 
 PREFIX="../../data/$(date +"%s")"
-while getopts c:t:s:m:p: flag; do
+while getopts c:t:s:m:p:bfq:r:x flag; do
     case "${flag}" in
     # classifier which should be used
     c) CLASSIFIER="${OPTARG}" ;;
@@ -34,6 +54,16 @@ while getopts c:t:s:m:p: flag; do
     s) SPECIAL_CATEGORIES="${SPECIAL_CATEGORIES}${OPTARG} " ;;
     # string prefix for all created files
     p) PREFIX="${OPTARG}" ;;
+    # keep compact predictions instead of the full IDS output
+    b) COMPACT_OUTPUT=1 ;;
+    # stream the train and test sets through named pipes
+    f) FIFO_MODE=1 ;;
+    # train and test on stratified subsamples
+    q) SAMPLE_FRACTION=${OPTARG} ;;
+    # compare the statistics against a finished run
+    r) REFERENCE_PREFIX="${OPTARG}" ;;
+    # pass the dataset parts to run-classifier.py instead of building the sets
+    x) SHARED_PARTS=1 ;;
     *) usage ;;
     esac
 done
@@ -58,6 +88,16 @@ case "${CLASSIFIER}" in
     IDS_CONFIG="../../config/svm-arff.config"
     FILTER_MODE="packet-by-packet"
     ;;
+"svm-approx")
+    IDS_CONFIG="../../config/svm-approx-arff.config"
+    FILTER_MODE="packet-by-packet"
+    METAIDS_CMD="${METAIDS_CMD:-../../scripts/run-classifier.py}"
+    ;;
+"sgd")
+    IDS_CONFIG="../../config/sgd-arff.config"
+    FILTER_MODE="packet-by-packet"
+    METAIDS_CMD="${METAIDS_CMD:-../../scripts/run-classifier.py}"
+    ;;
 "blstm")
     IDS_CONFIG="../../config/blstm-arff.config"
     FILTER_MODE="sequence-of-four"
@@ -75,13 +115,98 @@ echo "FILTER_MODE: $FILTER_MODE"
 echo "SPECIAL_TYPES: $SPECIAL_TYPES"
 echo "SPECIAL_CATEGORIES: $SPECIAL_CATEGORIES"
 echo "OUTPUT_PREFIX: $PREFIX"
+echo "SAMPLE_FRACTION: ${SAMPLE_FRACTION:-1}"
+echo "REFERENCE_PREFIX: ${REFERENCE_PREFIX}"
 echo ""
 
 DATASET_FOLDER="../../dataset"
-FILTER_CMD="../../scripts/filter-dataset.py -m ${FILTER_MODE}"
-METAIDS_CMD="ipal-iids"
+# scripts are run through the unified CLI, which hands them to a resident daemon
+# if ML_AND_IDS_SOCKET is set (see scripts/ml-and-ids.py)
+CLI_CMD="../../scripts/ml-and-ids.py"
+# the sets only hold the fields the features of the IDS config refer to (see
+# Projection in scripts/preprocessing.py)
+FILTER_CMD="${CLI_CMD} filter -m ${FILTER_MODE} --config ${IDS_CONFIG}"
+# can be replaced by ../../scripts/run-classifier.py (out-of-core training for BLSTM)
+METAIDS_CMD="${METAIDS_CMD:-ipal-iids}"
 EXTEND_ALARMS_CMD="ipal-extend-alarms"
 
+if [[ ! -z "${SHARED_PARTS}" ]]; then
+    if [[ -z "${COMPACT_OUTPUT}" ]] || [[ "${METAIDS_CMD}" != *run-classifier.py ]]; then
+        echo "Argument '-x' requires '-b' and run-classifier.py as METAIDS_CMD"
+        usage
+    fi
+    if [[ ! -z "${FIFO_MODE}" ]] || [[ ! -z "${SAMPLE_FRACTION}" ]]; then
+        echo "Argument '-x' can not be combined with '-f' or '-q'"
+        usage
+    fi
+fi
+
+# --- Fold set functions -----------------------------------------------------
+# Both functions write their set to stdout. They use TRAIN_SET_PARTS and
+# TEST_SET_PART of run_one_fold().
+build_train_set() {
+    # Merge all parts meant to go to the train set.
+    # Remove all "special types" from them.
+    for part in "${TRAIN_SET_PARTS[@]}"; do
+        if [[ ! -z "$SPECIAL_TYPES" ]]; then
+            $FILTER_CMD \
+                -i "${DATASET_FOLDER}/${part}" \
+                --except-types $SPECIAL_TYPES
+        elif [[ ! -z "$SPECIAL_CATEGORIES" ]]; then
+            $FILTER_CMD \
+                -i "${DATASET_FOLDER}/${part}" \
+                --except-categories $SPECIAL_CATEGORIES
+        else
+            "${CLI_CMD}" decode --config "${IDS_CONFIG}" -i "${DATASET_FOLDER}/${part}"
+        fi
+    done
+}
+
+build_test_set() {
+    # Move the "special types" of the parts meant to go to the train set to the
+    # test set.
+    for part in "${TRAIN_SET_PARTS[@]}"; do
+        if [[ ! -z "$SPECIAL_TYPES" ]]; then
+            $FILTER_CMD \
+                -i "${DATASET_FOLDER}/${part}" \
+                --only-types $SPECIAL_TYPES
+        elif [[ ! -z "$SPECIAL_CATEGORIES" ]]; then
+            $FILTER_CMD \
+                -i "${DATASET_FOLDER}/${part}" \
+                --only-categories $SPECIAL_CATEGORIES
+        fi
+    done
+
+    "${CLI_CMD}" decode --config "${IDS_CONFIG}" -i "${DATASET_FOLDER}/${TEST_SET_PART}"
+}
+
+# Set the --train.part and --live.part arguments of run-classifier.py with the
+# same parts and filters as build_train_set() and build_test_set() in PART_ARGS.
+build_part_args() {
+    PART_ARGS=()
+    for part in "${TRAIN_SET_PARTS[@]}"; do
+        if [[ ! -z "$SPECIAL_TYPES" ]]; then
+            PART_ARGS+=(--train.part "${DATASET_FOLDER}/${part}" "-m ${FILTER_MODE} --except-types ${SPECIAL_TYPES}")
+            PART_ARGS+=(--live.part "${DATASET_FOLDER}/${part}" "-m ${FILTER_MODE} --only-types ${SPECIAL_TYPES}")
+        elif [[ ! -z "$SPECIAL_CATEGORIES" ]]; then
+            PART_ARGS+=(--train.part "${DATASET_FOLDER}/${part}" "-m ${FILTER_MODE} --except-categories ${SPECIAL_CATEGORIES}")
+            PART_ARGS+=(--live.part "${DATASET_FOLDER}/${part}" "-m ${FILTER_MODE} --only-categories ${SPECIAL_CATEGORIES}")
+        else
+            PART_ARGS+=(--train.part "${DATASET_FOLDER}/${part}")
+        fi
+    done
+    PART_ARGS+=(--live.part "${DATASET_FOLDER}/${TEST_SET_PART}")
+}
+
+# Reduce a set given on stdin to a stratified subsample in quick-look mode.
+subsample_set() {
+    if [[ -z "${SAMPLE_FRACTION}" ]]; then
+        cat
+    else
+        "${CLI_CMD}" subsample -m "${FILTER_MODE}" -r "${SAMPLE_FRACTION}"
+    fi
+}
+
 # --- Main fold function -----------------------------------------------------
 run_one_fold() {
     # --- Initialize ---------------------------------------------------------
@@ -100,60 +225,47 @@ run_one_fold() {
     echo "TEST_SET_PART: ${TEST_SET_PART}"
 
     # Files for a fold get a suffix
-    local FOLD_PREFIX="${PREFIX}_fold-${FOLD_INDEX}"
-    local TRAIN_SET="${FOLD_PREFIX}.dataset-train.ipal"
-    local TEST_SET="${FOLD_PREFIX}.dataset-test.ipal"
+    local FOLD_SUFFIX="_fold-${FOLD_INDEX}"
+    if [[ ! -z "${SAMPLE_FRACTION}" ]]; then
+        FOLD_SUFFIX="_fraction-${SAMPLE_FRACTION}_fold-${FOLD_INDEX}"
+    fi
+    local FOLD_PREFIX="${PREFIX}${FOLD_SUFFIX}"
 
     # --- Filter dataset -----------------------------------------------------
-    rm -f "${TRAIN_SET}" "${TEST_SET}"
-
     if [[ ! -z "$SPECIAL_TYPES" ]]; then
         echo "Filtering dataset based on special types"
-
-        # Prepare the train set: merge all parts meant to go to the train set.
-        # Remove all "special types" from them and move them to the test set.
-        for part in "${TRAIN_SET_PARTS[@]}"; do
-            $FILTER_CMD \
-                -i "${DATASET_FOLDER}/${part}" \
-                --except-types $SPECIAL_TYPES >>"${TRAIN_SET}"
-
-            $FILTER_CMD \
-                -i "${DATASET_FOLDER}/${part}" \
-                --only-types $SPECIAL_TYPES >>"${TEST_SET}"
-        done
     elif [[ ! -z "$SPECIAL_CATEGORIES" ]]; then
         echo "Filtering dataset based on special categories"
-
-        # Prepare the train set: merge all parts meant to go to the train set.
-        # Remove all "special types" from them and move them to the test set.
-        for part in "${TRAIN_SET_PARTS[@]}"; do
-            $FILTER_CMD \
-                -i "${DATASET_FOLDER}/${part}" \
-                --except-categories $SPECIAL_CATEGORIES >>"${TRAIN_SET}"
-
-            $FILTER_CMD \
-                -i "${DATASET_FOLDER}/${part}" \
-                --only-categories $SPECIAL_CATEGORIES >>"${TEST_SET}"
-        done
     else
         echo "Preparing baseline run"
-
-        for part in "${TRAIN_SET_PARTS[@]}"; do
-            zcat "${DATASET_FOLDER}/${part}" >>"${TRAIN_SET}"
-        done
     fi
 
-    # Prepare the test set
-    zcat "${DATASET_FOLDER}/${TEST_SET_PART}" >>"${TEST_SET}"
-
-    # Compress
-    gzip -f "${TRAIN_SET}" "${TEST_SET}"
+    if [[ ! -z "${SHARED_PARTS}" ]]; then
+        local PART_ARGS
+        build_part_args
+    elif [[ -z "${FIFO_MODE}" ]]; then
+        local TRAIN_SET="${FOLD_PREFIX}.dataset-train.ipal.gz"
+        local TEST_SET="${FOLD_PREFIX}.dataset-test.ipal.gz"
+        build_train_set | subsample_set | gzip >"${TRAIN_SET}"
+        build_test_set | subsample_set | gzip >"${TEST_SET}"
+    else
+        # ipal-iids reads the sets while they are built. The writers block until
+        # ipal-iids opens the pipes, so they are killed if it fails.
+        local TRAIN_SET="${FOLD_PREFIX}.dataset-train.ipal"
+        local TEST_SET="${FOLD_PREFIX}.dataset-test.ipal"
+        rm -f "${TRAIN_SET}" "${TEST_SET}"
+        mkfifo "${TRAIN_SET}" "${TEST_SET}"
+        build_train_set | subsample_set >"${TRAIN_SET}" &
+        local TRAIN_PID=$!
+        build_test_set | subsample_set >"${TEST_SET}" &
+        local TEST_PID=$!
+        trap "kill ${TRAIN_PID} ${TEST_PID} 2>/dev/null; rm -f '${TRAIN_SET}' '${TEST_SET}'" EXIT
+    fi
 
     # --- Run classifier -----------------------------------------------------
     echo "Running classifier..."
     local OUTPUT_FILE="${FOLD_PREFIX}.dataset-live-output.ipal.gz"
     local STATS_FILE="${FOLD_PREFIX}.statistics.json"
-    local FILTERED_STATS_FILE="${FOLD_PREFIX}.statistics-filtered.json"
     local CONFIG_FILE="${FOLD_PREFIX}.config"
 
     # MODEL_FILE is used in envsubst and hence needs to be exported
@@ -161,44 +273,75 @@ run_one_fold() {
     # Insert the 'model-file' value into the config file using envsubst
     cat "${IDS_CONFIG}" | envsubst '${MODEL_FILE}' >"${CONFIG_FILE}"
 
-    "${METAIDS_CMD}" \
-        --config "${CONFIG_FILE}" \
-        --train.ipal "${TRAIN_SET}.gz" \
-        --live.ipal "${TEST_SET}.gz" \
-        --output "${OUTPUT_FILE}" \
-        --log info \
-        --retrain
+    if [[ ! -z "${SHARED_PARTS}" ]]; then
+        # run-classifier.py writes the compact predictions itself
+        OUTPUT_FILE="${FOLD_PREFIX}.predictions.npz"
+        "${METAIDS_CMD}" \
+            --config "${CONFIG_FILE}" \
+            "${PART_ARGS[@]}" \
+            --output "${OUTPUT_FILE}"
+    else
+        "${METAIDS_CMD}" \
+            --config "${CONFIG_FILE}" \
+            --train.ipal "${TRAIN_SET}" \
+            --live.ipal "${TEST_SET}" \
+            --output "${OUTPUT_FILE}" \
+            --log info \
+            --retrain
+    fi
 
-    rm -f "${TRAIN_SET}.gz" "${TEST_SET}.gz"
+    if [[ ! -z "${FIFO_MODE}" ]]; then
+        wait "${TRAIN_PID}"
+        wait "${TEST_PID}"
+        trap - EXIT
+    fi
+    if [[ -z "${SHARED_PARTS}" ]]; then
+        rm -f "${TRAIN_SET}" "${TEST_SET}"
+    fi
 
-    # BLSTM requires a special post-processing step to add its output to every packet
-    if [ "${CLASSIFIER}" == "blstm" ]; then
+    # BLSTM requires a special post-processing step to add its output to every packet,
+    # run-classifier.py already assigns the output of a sequence to all of its packets
+    if [ "${CLASSIFIER}" == "blstm" ] && [ "${METAIDS_CMD}" == "ipal-iids" ]; then
         "${EXTEND_ALARMS_CMD}" "${OUTPUT_FILE}"
     fi
 
+    # Replace the full IDS output by compact predictions
+    if [[ ! -z "${COMPACT_OUTPUT}" ]] && [[ -z "${SHARED_PARTS}" ]]; then
+        local PREDICTIONS_FILE="${FOLD_PREFIX}.predictions.npz"
+        "${CLI_CMD}" pack \
+            -i "${OUTPUT_FILE}" \
+            -o "${PREDICTIONS_FILE}"
+        rm -f "${OUTPUT_FILE}"
+        OUTPUT_FILE="${PREDICTIONS_FILE}"
+    fi
+
     # --- Create statistics --------------------------------------------------
+    # Statistics over the _filtered_ test set, meaning the test set with the same filter
+    # applied as during training, are calculated as a view in the same pass.
+    local VIEW_ARGS=()
+    if [[ ! -z "$SPECIAL_TYPES" ]]; then
+        VIEW_ARGS=(-v filtered "-m packet-by-packet --except-types $SPECIAL_TYPES")
+    elif [[ ! -z "$SPECIAL_CATEGORIES" ]]; then
+        VIEW_ARGS=(-v filtered "-m packet-by-packet --except-categories $SPECIAL_CATEGORIES")
+    fi
+
+    # The reference run may have kept the full IDS output or compact predictions
+    local REFERENCE_ARGS=()
+    if [[ ! -z "${REFERENCE_PREFIX}" ]]; then
+        local REFERENCE_FILE="${REFERENCE_PREFIX}${FOLD_SUFFIX}.predictions.npz"
+        if [[ ! -f "${REFERENCE_FILE}" ]]; then
+            REFERENCE_FILE="${REFERENCE_PREFIX}${FOLD_SUFFIX}.dataset-live-output.ipal.gz"
+        fi
+        REFERENCE_ARGS=(--reference "${REFERENCE_FILE}")
+    fi
+
     echo "Calculating statistics..."
-    ../../scripts/create-statistics.py \
+    "${CLI_CMD}" stats \
         -o "${STATS_FILE}" \
-        -i "${OUTPUT_FILE}"
-
-    # Calculate statistics over the _filtered_ test set, meaning the test set with the same filter
-    # applied as during training.
-    # if [[ ! -z "$SPECIAL_TYPES" ]]; then
-    #     ../../scripts/filter-dataset.py \
-    #         -m "packet-by-packet" \
-    #         -i "${OUTPUT_FILE}" \
-    #         --except-types $SPECIAL_TYPES |
-    #         ../../scripts/create-statistics.py \
-    #             -o "${FILTERED_STATS_FILE}"
-    # else
-    #     ../../scripts/filter-dataset.py \
-    #         -m "packet-by-packet" \
-    #         -i "${OUTPUT_FILE}" \
-    #         --except-categories $SPECIAL_CATEGORIES |
-    #         ../../scripts/create-statistics.py \
-    #             -o "${FILTERED_STATS_FILE}"
-    # fi
+        -i "${OUTPUT_FILE}" \
+        -d "${DATASET_FOLDER}"/part-*.ipal.gz \
+        "${VIEW_ARGS[@]}" \
+        "${REFERENCE_ARGS[@]}"
 }
 
 # --- Execute all 5 folds ----------------------------------------------------
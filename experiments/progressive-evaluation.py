@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+This script runs the omit attacks and single attacks experiments progressively to obtain a
+preliminary picture of all results quickly.
+
+In the first round, every experiment is run in quick-look mode (run-experiment.sh -q) on
+stratified subsamples of the smallest fraction. After each round, the results are
+aggregated with confidence bounds (aggregate-results.py --progressive) and only the
+experiments with uncertain recall cells are repeated with the next larger fraction. The
+preliminary heatmaps can be drawn at any time with plotting/recall-heatmaps.py
+--progressive.
+
+Runs whose results already exist at the fraction of a round are skipped, so an interrupted
+evaluation can be resumed by running the script again. With a cost model of the
+experiments (see cost-model.py), the runs of each round are started longest predicted
+runtime first.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+EXPERIMENTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_script(filename):
+    """
+    Import a script of the experiments folder, e.g. aggregate-results.py, as module.
+    """
+    path = os.path.join(EXPERIMENTS_FOLDER, filename)
+    spec = importlib.util.spec_from_file_location(
+        filename[: -len(".py")].replace("-", "_"), path
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def experiment_arguments(group, index):
+    if group == "baseline":
+        return []
+    return ["-s" if group.endswith("categories") else "-t", str(index)]
+
+
+def run_experiment(job):
+    """
+    Run one experiment with all folds in quick-look mode, returns whether it succeeded.
+    """
+    classifier, group, index, folder, prefix, fraction = job
+    with open(f"{prefix}_fraction-{fraction}.out", "w") as log:
+        result = subprocess.run(
+            [
+                "./run-experiment.sh",
+                "-c",
+                classifier,
+                *experiment_arguments(group, index),
+                "-q",
+                fraction,
+                "-b",
+                "-p",
+                prefix,
+            ],
+            cwd=os.path.join(EXPERIMENTS_FOLDER, folder),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    return result.returncode == 0
+
+
+def predicted_runtime(costs, cost_model, job):
+    """
+    Predict the runtime of a quick-look run from the cost model, 0 if it is unknown.
+    """
+    classifier, group, index, folder, prefix, fraction = job
+    sizes = costs.expected_train_sizes(
+        cost_model, group, folder, os.path.basename(prefix)
+    )
+    if sizes is None or cost_model["models"][classifier]["runtime"] is None:
+        return 0
+    return costs.predict_runtime(
+        cost_model["models"],
+        classifier,
+        group,
+        [size * float(fraction) for size in sizes],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run all experiments on growing stratified subsamples"
+    )
+    parser.add_argument(
+        "-c",
+        "--classifiers",
+        nargs="+",
+        default=["rf", "svm", "blstm"],
+        choices=["rf", "svm", "blstm"],
+        help="Classifiers to evaluate (default: all)",
+    )
+    parser.add_argument(
+        "-r",
+        "--fractions",
+        nargs="+",
+        default=[0.02, 0.1, 0.3],
+        type=float,
+        help="Sample fractions of the rounds (default: 0.02 0.1 0.3)",
+    )
+    parser.add_argument(
+        "--max-width",
+        default=0.1,
+        type=float,
+        help="Recall cells with a wider confidence interval are refined in the next "
+        "round (default: 0.1)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="Number of experiments run in parallel",
+    )
+    parser.add_argument(
+        "--progressive-folder",
+        default=os.path.join(EXPERIMENTS_FOLDER, "..", "data", "progressive"),
+        help="Folder for the quick-look results (default: data/progressive)",
+    )
+    parser.add_argument(
+        "--cost-model",
+        help="Cost model written by cost-model.py to start the runs of each round "
+        "longest predicted runtime first (optional)",
+    )
+    args = parser.parse_args()
+
+    aggregation = load_script("aggregate-results.py")
+    costs = load_script("cost-model.py")
+    cost_model = None
+    if args.cost_model is not None:
+        with open(args.cost_model, "r") as f:
+            cost_model = json.load(f)
+    progressive_folder = os.path.abspath(args.progressive_folder)
+
+    # experiments to run in the next round, initially all of them
+    pending = {
+        (classifier, group, index): (folder, name)
+        for classifier in args.classifiers
+        for (group, index, folder, name) in aggregation.list_experiments(classifier)
+    }
+
+    for fraction in sorted(args.fractions):
+        jobs = []
+        for ((classifier, group, index), (folder, name)) in pending.items():
+            available, _ = aggregation.progressive_fold_files(
+                EXPERIMENTS_FOLDER, progressive_folder, folder, name, classifier
+            )
+            if available is not None and available >= fraction:
+                continue
+            prefix = os.path.join(progressive_folder, folder, classifier, name)
+            os.makedirs(os.path.dirname(prefix), exist_ok=True)
+            jobs.append((classifier, group, index, folder, prefix, f"{fraction:g}"))
+
+        if cost_model is not None:
+            jobs.sort(key=lambda job: -predicted_runtime(costs, cost_model, job))
+
+        print(f"Round with fraction {fraction:g}: running {len(jobs)} experiments")
+        with ThreadPoolExecutor(args.jobs) as executor:
+            for (job, success) in zip(jobs, executor.map(run_experiment, jobs)):
+                if not success:
+                    print(f"Failed: {job[4]}_fraction-{job[5]}.out")
+
+        data = aggregation.aggregate_progressive(
+            EXPERIMENTS_FOLDER, progressive_folder, args.max_width
+        )
+        aggregation.print_progressive_summary(data)
+        with open(
+            os.path.join(EXPERIMENTS_FOLDER, "results-progressive.json"), "w"
+        ) as f:
+            json.dump(data, f, indent=4)
+
+        # refine the experiments with uncertain cells only, failed runs are repeated
+        uncertain = {
+            (cell["classifier"], cell["experiment"], cell["index"])
+            for cell in data["uncertain"]
+        }
+        pending = {
+            (classifier, group, index): value
+            for ((classifier, group, index), value) in pending.items()
+            if (classifier, group, index) in uncertain
+            or not data[classifier][group]
+            or (group != "baseline" and index not in data[classifier][group])
+        }
+        if not pending:
+            print("No uncertain cells left")
+            break
+
+
+if __name__ == "__main__":
+    main()
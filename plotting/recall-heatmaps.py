@@ -2,8 +2,14 @@
 """
 This script creates detailed recall heatmaps showing the recall in each individual attack
 or attack category for each experiment.
+
+With --progressive, preliminary heatmaps are created from the quick-look results in
+"results-progressive.json" (see experiments/progressive-evaluation.py) and saved to
+"recall-heatmaps/progressive". Cells whose recall is still uncertain are marked with "?",
+experiments without results yet are left blank.
 """
 
+import argparse
 import numpy as np
 from itertools import product
 import matplotlib.pyplot as plt
@@ -18,7 +24,12 @@ PACKET_CATEGORY_COUNT = 8
 
 
 def plot_relative_heatmap(
-    results: np.ndarray, xlabel: str, ylabel: str, title: str, figsize=(13, 13)
+    results: np.ndarray,
+    xlabel: str,
+    ylabel: str,
+    title: str,
+    figsize=(13, 13),
+    uncertain: np.ndarray = None,
 ):
     ####################################
     # Move some data around
@@ -36,6 +47,11 @@ def plot_relative_heatmap(
     # Reverse y-axis so that baseline is at the top
     heatmap_relative = np.flip(heatmap_relative, axis=0)
 
+    # A change is uncertain if the experiment or the baseline is
+    if uncertain is None:
+        uncertain = np.zeros(results.shape, dtype=bool)
+    uncertain = np.flip(uncertain[1:, :] | uncertain[0, :], axis=0)
+
     ####################################
     # Prepare relative heatmap
     ####################################
@@ -62,11 +78,13 @@ def plot_relative_heatmap(
         range(heatmap_relative.shape[0]), range(heatmap_relative.shape[1])
     ):
         val = heatmap_relative[i, j]
-        if heatmap_relative.shape[0] < 10 or abs(val) > 5:
+        if np.isnan(val):
+            continue
+        if heatmap_relative.shape[0] < 10 or abs(val) > 5 or uncertain[i, j]:
             ax.text(
                 j,
                 i,
-                f"{val:.1f}",
+                f"{val:.1f}?" if uncertain[i, j] else f"{val:.1f}",
                 ha="center",
                 va="center",
                 color=("w" if abs(val) > 5 else "gray"),
@@ -81,7 +99,12 @@ def plot_relative_heatmap(
 
 
 def plot_absolute_heatmap(
-    results: np.ndarray, xlabel: str, ylabel: str, title: str, figsize=(13, 13)
+    results: np.ndarray,
+    xlabel: str,
+    ylabel: str,
+    title: str,
+    figsize=(13, 13),
+    uncertain: np.ndarray = None,
 ):
     ####################################
     # Move some data around
@@ -89,6 +112,9 @@ def plot_absolute_heatmap(
 
     # Reverse y-axis so that baseline is at the top
     results = np.flip(results, axis=0)
+    if uncertain is None:
+        uncertain = np.zeros(results.shape, dtype=bool)
+    uncertain = np.flip(uncertain, axis=0)
 
     # Convert all numbers to percent
     results *= 100
@@ -113,10 +139,12 @@ def plot_absolute_heatmap(
 
     for (i, j) in product(range(results.shape[0]), range(results.shape[1])):
         val = results[i, j]
+        if np.isnan(val):
+            continue
         ax.text(
             j,
             i,
-            f"{val:.1f}",
+            f"{val:.1f}?" if uncertain[i, j] else f"{val:.1f}",
             ha="center",
             va="center",
             color=("k" if val < 50 else "w"),
@@ -131,12 +159,47 @@ def plot_absolute_heatmap(
     return fig
 
 
+def recall_matrix(experiments, key: str, count: int, max_width: float = None):
+    """
+    Create a 2d array of the mean recall of the given experiments (rows) in each attack
+    type or category (columns). Missing experiments yield rows of NaN. If max_width is
+    given, a mask of the cells whose confidence interval is wider is returned as well.
+    """
+    recall = np.full((len(experiments), count), np.nan)
+    uncertain = np.zeros((len(experiments), count), dtype=bool)
+    for (row, experiment) in enumerate(experiments):
+        if not experiment:
+            continue
+        for i in range(count):
+            cell = experiment["recall"]["detailed"][key][str(i)]
+            recall[row, i] = cell["mean"]
+            if max_width is not None:
+                uncertain[row, i] = cell["upper"] - cell["lower"] > max_width
+    return recall, uncertain
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Create recall heatmaps")
+    parser.add_argument(
+        "--progressive",
+        action="store_true",
+        help="Create preliminary heatmaps from the quick-look results",
+    )
+    args = parser.parse_args()
+
+    results_file = "results-progressive.json" if args.progressive else "results.json"
     with open(
-        os.path.join(os.path.dirname(__file__), "../experiments/results.json"), "r"
+        os.path.join(os.path.dirname(__file__), "../experiments", results_file), "r"
     ) as f:
         data = json.load(f)
 
+    output_folder = os.path.join(os.path.dirname(__file__), "recall-heatmaps")
+    max_width = None
+    if args.progressive:
+        output_folder = os.path.join(output_folder, "progressive")
+        os.makedirs(output_folder, exist_ok=True)
+        max_width = data["max_width"]
+
     for classifier in ["rf", "svm", "blstm"]:
         ####################################
         # Omit attacks
@@ -147,18 +210,12 @@ def main():
         omit_attacks_experiments = [
             data[classifier]["baseline"],
             *[
-                data[classifier]["omit-attacks"][str(i)]
+                data[classifier]["omit-attacks"].get(str(i))
                 for i in range(1, PACKET_TYPE_COUNT)
             ],
         ]
-        omit_attacks_recall = np.array(
-            [
-                [
-                    experiment["recall"]["detailed"]["types"][str(i)]["mean"]
-                    for i in range(PACKET_TYPE_COUNT)
-                ]
-                for experiment in omit_attacks_experiments
-            ]
+        omit_attacks_recall, omit_attacks_uncertain = recall_matrix(
+            omit_attacks_experiments, "types", PACKET_TYPE_COUNT, max_width
         )
 
         plot_relative_heatmap(
@@ -166,22 +223,18 @@ def main():
             xlabel="Classified attack",
             ylabel="Omitted attack",
             title="Recall change relative to baseline [%]",
+            uncertain=omit_attacks_uncertain,
         ).savefig(
-            os.path.join(
-                os.path.dirname(__file__),
-                f"recall-heatmaps/omit-attacks_{classifier}_relative.png",
-            )
+            os.path.join(output_folder, f"omit-attacks_{classifier}_relative.png")
         )
         plot_absolute_heatmap(
             omit_attacks_recall,
             xlabel="Classified attack",
             ylabel="Omitted attack",
             title="Absolute recall [%]",
+            uncertain=omit_attacks_uncertain,
         ).savefig(
-            os.path.join(
-                os.path.dirname(__file__),
-                f"recall-heatmaps/omit-attacks_{classifier}_absolute.png",
-            )
+            os.path.join(output_folder, f"omit-attacks_{classifier}_absolute.png")
         )
 
         ####################################
@@ -191,18 +244,12 @@ def main():
         omit_categories_experiments = [
             data[classifier]["baseline"],
             *[
-                data[classifier]["omit-categories"][str(i)]
+                data[classifier]["omit-categories"].get(str(i))
                 for i in range(1, PACKET_CATEGORY_COUNT)
             ],
         ]
-        omit_categories_recall = np.array(
-            [
-                [
-                    experiment["recall"]["detailed"]["categories"][str(i)]["mean"]
-                    for i in range(PACKET_CATEGORY_COUNT)
-                ]
-                for experiment in omit_categories_experiments
-            ]
+        omit_categories_recall, omit_categories_uncertain = recall_matrix(
+            omit_categories_experiments, "categories", PACKET_CATEGORY_COUNT, max_width
         )
 
         plot_relative_heatmap(
@@ -211,11 +258,9 @@ def main():
             ylabel="Omitted attack category",
             title="Recall change relative to baseline [%]",
             figsize=(8, 8),
+            uncertain=omit_categories_uncertain,
         ).savefig(
-            os.path.join(
-                os.path.dirname(__file__),
-                f"recall-heatmaps/omit-categories_{classifier}_relative.png",
-            )
+            os.path.join(output_folder, f"omit-categories_{classifier}_relative.png")
         )
         plot_absolute_heatmap(
             omit_categories_recall,
@@ -223,11 +268,9 @@ def main():
             ylabel="Omitted attack category",
             title="Absolute recall [%]",
             figsize=(8, 8),
+            uncertain=omit_categories_uncertain,
         ).savefig(
-            os.path.join(
-                os.path.dirname(__file__),
-                f"recall-heatmaps/omit-categories_{classifier}_absolute.png",
-            )
+            os.path.join(output_folder, f"omit-categories_{classifier}_absolute.png")
         )
 
         ####################################
@@ -239,18 +282,12 @@ def main():
         single_attacks_experiments = [
             data[classifier]["baseline"],
             *[
-                data[classifier]["single-attacks"][str(i)]
+                data[classifier]["single-attacks"].get(str(i))
                 for i in range(1, PACKET_TYPE_COUNT)
             ],
         ]
-        single_attacks_recall = np.array(
-            [
-                [
-                    experiment["recall"]["detailed"]["types"][str(i)]["mean"]
-                    for i in range(PACKET_TYPE_COUNT)
-                ]
-                for experiment in single_attacks_experiments
-            ]
+        single_attacks_recall, single_attacks_uncertain = recall_matrix(
+            single_attacks_experiments, "types", PACKET_TYPE_COUNT, max_width
         )
 
         plot_absolute_heatmap(
@@ -258,12 +295,8 @@ def main():
             xlabel="Classified attack",
             ylabel="Trained attack",
             title="Absolute recall [%]",
-        ).savefig(
-            os.path.join(
-                os.path.dirname(__file__),
-                f"recall-heatmaps/single-attacks_{classifier}.png",
-            )
-        )
+            uncertain=single_attacks_uncertain,
+        ).savefig(os.path.join(output_folder, f"single-attacks_{classifier}.png"))
 
         ####################################
         # Single categories
@@ -272,18 +305,15 @@ def main():
         single_categories_experiments = [
             data[classifier]["baseline"],
             *[
-                data[classifier]["single-categories"][str(i)]
+                data[classifier]["single-categories"].get(str(i))
                 for i in range(1, PACKET_CATEGORY_COUNT)
             ],
         ]
-        single_categories_recall = np.array(
-            [
-                [
-                    experiment["recall"]["detailed"]["categories"][str(i)]["mean"]
-                    for i in range(PACKET_CATEGORY_COUNT)
-                ]
-                for experiment in single_categories_experiments
-            ]
+        single_categories_recall, single_categories_uncertain = recall_matrix(
+            single_categories_experiments,
+            "categories",
+            PACKET_CATEGORY_COUNT,
+            max_width,
         )
 
         plot_absolute_heatmap(
@@ -292,12 +322,8 @@ def main():
             ylabel="Trained attack category",
             title="Absolute recall [%]",
             figsize=(8, 8),
-        ).savefig(
-            os.path.join(
-                os.path.dirname(__file__),
-                f"recall-heatmaps/single-categories_{classifier}.png",
-            )
-        )
+            uncertain=single_categories_uncertain,
+        ).savefig(os.path.join(output_folder, f"single-categories_{classifier}.png"))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,307 @@
+"""
+Model artifacts whose arrays can be memory-mapped.
+
+A trained model (as pickled by ipal-iids) is exported into a directory holding a small
+"model.json" with the metadata and one .npy file per array:
+- RandomForestClassifier: the nodes of all trees concatenated into flat arrays (feature,
+  threshold, children, normalized leaf values, direction of missing values) and the root
+  node of each tree. Leaves are their own children, so that a sample which reached a leaf
+  stays there.
+- SVC with RBF kernel: the support vectors and dual coefficients
+
+Loading maps the arrays read-only into memory. Hence loading is instant and any number of
+processes using the same artifact share one copy in the page cache. Predictions are
+calculated with NumPy on the mapped arrays. A trained model can also be compiled into the
+same representation in memory (compile_model()), e.g. to classify with the flat forest
+right after training.
+
+The flat forest descends all trees with all samples at once, one level per step, instead
+of traversing the trees one after another. Optionally, blocks of samples are classified in
+parallel threads (NumPy releases the GIL while indexing). As every step is a handful of
+NumPy operations, this beats scikit-learn's traversal for the small batches of live
+traffic, where the per-call overhead of RandomForestClassifier dominates. For large
+batches, scikit-learn's compiled traversal remains faster (see benchmark-forest.py).
+"""
+
+import json
+import joblib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+METADATA_FILE = "model.json"
+# number of samples descending the trees at once
+BLOCK_SIZE = 4096
+# maximum number of kernel values (samples x support vectors) calculated at once
+KERNEL_BLOCK_SIZE = 2**22
+
+
+def load_ipal_model(filepath):
+    """
+    Load a model file written by ipal-iids and return the trained estimator. Models
+    tuned with a grid search are unwrapped to their best estimator.
+    """
+    model = joblib.load(filepath)
+    if isinstance(model, dict):
+        model = model["classifier"]
+    return getattr(model, "best_estimator_", model)
+
+
+def _flat_nodes(feature, threshold, children_left, children_right):
+    """
+    Convert concatenated scikit-learn nodes (leaves marked with child index -1) into the
+    layout of the flat forest: leaves are their own children, compare feature 0 with an
+    infinite threshold and the children of a node are stored next to each other.
+    """
+    leaves = children_left < 0
+    nodes = np.arange(len(feature), dtype=np.int32)
+    # a float32 x satisfies x <= t for a float64 t iff x <= the largest float32 <= t
+    threshold32 = threshold.astype(np.float32)
+    above = threshold32.astype(np.float64) > threshold
+    threshold32[above] = np.nextafter(threshold32[above], np.float32(-np.inf))
+    return {
+        "feature": np.where(leaves, 0, feature).astype(np.int32),
+        "threshold": np.where(leaves, np.inf, threshold32).astype(np.float32),
+        "children": np.stack(
+            [
+                np.where(leaves, nodes, children_left),
+                np.where(leaves, nodes, children_right),
+            ],
+            axis=1,
+        ).astype(np.int32),
+    }
+
+
+def _forest_arrays(forest):
+    """
+    Concatenate the nodes of all trees of a forest with global child indices.
+    """
+    trees = [estimator.tree_ for estimator in forest.estimators_]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+
+    def concatenate_children(children):
+        return np.concatenate(
+            [
+                np.where(
+                    getattr(tree, children) >= 0, getattr(tree, children) + offset, -1
+                )
+                for (tree, offset) in zip(trees, offsets)
+            ]
+        ).astype(np.int32)
+
+    # leaf values are normalized per node like in DecisionTreeClassifier.predict_proba
+    values = np.concatenate([tree.value[:, 0, :] for tree in trees])
+    normalizer = values.sum(axis=1, keepdims=True)
+    normalizer[normalizer == 0.0] = 1.0
+
+    # scikit-learn >= 1.3 sends missing values to a learned side, before they were rejected
+    missing_go_to_left = [
+        getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=np.uint8))
+        for tree in trees
+    ]
+
+    return {
+        "roots": offsets[:-1].astype(np.int32),
+        **_flat_nodes(
+            np.concatenate([tree.feature for tree in trees]),
+            np.concatenate([tree.threshold for tree in trees]),
+            concatenate_children("children_left"),
+            concatenate_children("children_right"),
+        ),
+        "value": values / normalizer,
+        "missing_go_to_left": np.concatenate(missing_go_to_left).astype(bool),
+        "classes": forest.classes_,
+    }
+
+
+def _svm_arrays(svm):
+    assert svm.kernel == "rbf", "Only SVMs with RBF kernel are supported"
+    assert len(svm.classes_) == 2, "Only binary SVMs are supported"
+    support_vectors = np.ascontiguousarray(svm.support_vectors_, dtype=np.float64)
+    return {
+        "support_vectors": support_vectors,
+        "support_vector_norms": (support_vectors**2).sum(axis=1),
+        "dual_coef": svm.dual_coef_[0],
+        "intercept": svm.intercept_,
+        "classes": svm.classes_,
+    }
+
+
+def _model_arrays(estimator):
+    """
+    Return the arrays and the metadata of a trained estimator.
+    """
+    kind = type(estimator).__name__
+    if kind == "RandomForestClassifier":
+        arrays = _forest_arrays(estimator)
+        metadata = {"type": "forest"}
+    elif kind == "SVC":
+        arrays = _svm_arrays(estimator)
+        metadata = {"type": "svm", "gamma": float(estimator._gamma)}
+    else:
+        raise ValueError(f"Unsupported model type {kind}")
+    metadata["features"] = int(estimator.n_features_in_)
+    return arrays, metadata
+
+
+def compile_model(estimator):
+    """
+    Convert a trained estimator into a MappedForest or MappedSVM held in memory.
+    """
+    arrays, metadata = _model_arrays(estimator)
+    arrays = {name: np.ascontiguousarray(array) for (name, array) in arrays.items()}
+    return MODEL_CLASSES[metadata["type"]](arrays, metadata)
+
+
+def export_model(estimator, directory):
+    """
+    Export a trained estimator into an artifact directory.
+    """
+    arrays, metadata = _model_arrays(estimator)
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for (name, array) in arrays.items():
+        np.save(directory / f"{name}.npy", np.ascontiguousarray(array))
+    with open(directory / METADATA_FILE, "w") as f:
+        json.dump({**metadata, "arrays": list(arrays.keys())}, f, indent=2)
+
+
+class MappedForest:
+    def __init__(self, arrays, metadata):
+        if "children" not in arrays:
+            # artifacts exported before the flat layout was introduced
+            arrays = {
+                **arrays,
+                **_flat_nodes(
+                    arrays["feature"],
+                    arrays["threshold"],
+                    arrays["children_left"],
+                    arrays["children_right"],
+                ),
+            }
+        self.__dict__.update(arrays)
+        if "missing_go_to_left" not in arrays:
+            self.missing_go_to_left = np.zeros(len(self.feature), dtype=bool)
+        self.n_features = metadata["features"]
+        self.is_leaf = self.children[:, 0] == np.arange(len(self.feature))
+
+    def predict_proba(self, X, jobs=1):
+        """
+        Average of the leaf values of all trees, identical to
+        RandomForestClassifier.predict_proba() with a single job. With several jobs,
+        blocks of samples are classified in parallel threads.
+        """
+        # like scikit-learn, compare features as float32 with the (rounded) thresholds
+        X = X.toarray(np.float32) if hasattr(X, "toarray") else X
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        blocks = [
+            X[start : start + BLOCK_SIZE] for start in range(0, len(X), BLOCK_SIZE)
+        ]
+        if jobs == 1 or len(blocks) == 1:
+            probas = map(self._predict_block, blocks)
+        else:
+            with ThreadPoolExecutor(jobs) as executor:
+                probas = list(executor.map(self._predict_block, blocks))
+        return np.concatenate([*probas, np.zeros((0, len(self.classes)))])
+
+    def _predict_block(self, X):
+        leaves = self._leaves(X)
+        # sum the trees in order, such that the result equals scikit-learn's bit by bit
+        proba = np.zeros((len(X), len(self.classes)))
+        for tree in range(len(self.roots)):
+            proba += self.value[leaves[:, tree]]
+        proba /= len(self.roots)
+        return proba
+
+    def _leaves(self, X):
+        """
+        Return the leaf of each sample in each tree (samples x trees). All trees are
+        descended at once level by level. While most pairs of a sample and a tree are
+        still descending, all pairs are advanced (leaves stay in place). Afterwards, only
+        the pairs which have not reached a leaf yet are advanced.
+        """
+        n_trees = len(self.roots)
+        # pairs are numbered sample-major, features are looked up in the flattened X
+        nodes = np.tile(self.roots, len(X))
+        offsets = np.repeat(np.arange(len(X), dtype=np.int32) * X.shape[1], n_trees)
+        values = X.ravel()
+        children = self.children.ravel()
+        missing = np.isnan(values).any()
+
+        def step(nodes, offsets):
+            x = values[offsets + self.feature[nodes]]
+            right = x > self.threshold[nodes]
+            if missing:
+                nan = np.flatnonzero(np.isnan(x))
+                right[nan] = ~self.missing_go_to_left[nodes[nan]]
+            return children[2 * nodes + right]
+
+        inner = ~self.is_leaf[nodes]
+        while np.count_nonzero(inner) > len(nodes) // 2:
+            nodes = step(nodes, offsets)
+            inner = ~self.is_leaf[nodes]
+
+        active = np.flatnonzero(inner)
+        current, offsets = nodes[active], offsets[active]
+        while len(active):
+            current = step(current, offsets)
+            nodes[active] = current
+            inner = ~self.is_leaf[current]
+            active, current, offsets = active[inner], current[inner], offsets[inner]
+        return nodes.reshape(len(X), n_trees)
+
+    def predict(self, X, jobs=1):
+        return self.classes[np.argmax(self.predict_proba(X, jobs), axis=1)]
+
+
+class MappedSVM:
+    def __init__(self, arrays, metadata):
+        self.__dict__.update(arrays)
+        self.gamma = metadata["gamma"]
+        self.n_features = metadata["features"]
+
+    def decision_function(self, X):
+        """
+        Decision values of the RBF SVM. The kernel matrix is calculated in blocks of
+        samples of at most KERNEL_BLOCK_SIZE values, such that the memory of a call does
+        not grow with the number of samples and support vectors.
+        """
+        X = X.toarray(np.float64) if hasattr(X, "toarray") else X
+        X = np.asarray(X, dtype=np.float64)
+        rows = max(1, min(BLOCK_SIZE, KERNEL_BLOCK_SIZE // len(self.support_vectors)))
+        decisions = [
+            self._decision_block(X[start : start + rows])
+            for start in range(0, len(X), rows)
+        ]
+        return np.concatenate([*decisions, np.zeros(0)])
+
+    def _decision_block(self, X):
+        # squared distances ||x - sv||^2 = ||x||^2 + ||sv||^2 - 2 x.sv
+        kernel = X @ self.support_vectors.T
+        kernel *= -2
+        kernel += (X**2).sum(axis=1)[:, np.newaxis]
+        kernel += self.support_vector_norms
+        kernel *= -self.gamma
+        np.exp(kernel, out=kernel)
+        return kernel @ self.dual_coef + self.intercept[0]
+
+    def predict(self, X):
+        return self.classes[(self.decision_function(X) > 0).astype(int)]
+
+
+MODEL_CLASSES = {"forest": MappedForest, "svm": MappedSVM}
+
+
+def load_artifact(directory, mmap_mode="r"):
+    """
+    Load an artifact directory. By default, arrays are memory-mapped read-only.
+    """
+    directory = Path(directory)
+    with open(directory / METADATA_FILE) as f:
+        metadata = json.load(f)
+    arrays = {
+        name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode)
+        for name in metadata["arrays"]
+    }
+    return MODEL_CLASSES[metadata["type"]](arrays, metadata)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+This script benchmarks the prediction throughput of a trained RF on a live set: the
+original RandomForestClassifier against the compiled flat forest (see artifacts.py), each
+with a single and with several jobs. The live set is classified in batches of the given
+sizes, from single packets as in live operation up to the whole set as in the experiments.
+The compiled forest must return exactly the same probabilities as the original model with
+a single job (with any number of jobs), which is verified on the way.
+
+The model file can be written by ipal-iids or run-classifier.py, the features are taken
+from the IDS config it was trained with.
+"""
+
+import argparse
+import json
+import pathlib
+import time
+import numpy as np
+from tabulate import tabulate
+from artifacts import load_ipal_model, compile_model
+from features import FeatureExtractor, concatenate
+from preprocessing import CHUNK_SIZE
+from utils import chunked, eprint, open_file, read_packets
+
+
+def read_matrix(input_file, features):
+    extractor = FeatureExtractor(features)
+    with open_file(input_file, "rt") as f:
+        matrices = [
+            extractor.transform(chunk) for chunk in chunked(read_packets(f), CHUNK_SIZE)
+        ]
+    return concatenate(matrices).toarray(np.float32)
+
+
+def best_time(function, repeats):
+    """
+    Return the result of function() and the shortest of its run times in seconds.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the compiled flat forest against the original RF"
+    )
+    parser.add_argument(
+        "-m",
+        "--model-file",
+        required=True,
+        type=pathlib.Path,
+        help="Trained RF (pickled by ipal-iids or run-classifier.py)",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        required=True,
+        type=pathlib.Path,
+        help="IDS config the model was trained with (for the features)",
+    )
+    parser.add_argument(
+        "-i",
+        "--input-file",
+        required=True,
+        type=pathlib.Path,
+        help="Live set (ipal, optionally gzipped)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=4,
+        type=int,
+        help="Number of jobs of the parallel runs (default: 4)",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-sizes",
+        nargs="+",
+        default=[1, 16, 256, 4096, 0],
+        type=int,
+        help="Numbers of samples classified per call, 0 for the whole live set "
+        "(default: 1 16 256 4096 0)",
+    )
+    parser.add_argument(
+        "--max-calls",
+        default=200,
+        type=int,
+        help="Only classify the first samples of the live set which fit into this many "
+        "calls (default: 200)",
+    )
+    parser.add_argument(
+        "-n",
+        "--repeats",
+        default=3,
+        type=int,
+        help="Number of runs per variant, the fastest one is reported (default: 3)",
+    )
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        (ids_config,) = json.load(f).values()
+    X = read_matrix(args.input_file, ids_config["features"])
+    forest = load_ipal_model(args.model_file)
+    assert (
+        type(forest).__name__ == "RandomForestClassifier"
+    ), "Only RandomForestClassifier models can be benchmarked"
+    eprint(f"Live set: {X.shape[0]} x {X.shape[1]}, {len(forest.estimators_)} trees")
+
+    start = time.perf_counter()
+    compiled = compile_model(forest)
+    eprint(f"Compiled in {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    def original(jobs):
+        def predict_proba(X):
+            forest.set_params(n_jobs=jobs)
+            return forest.predict_proba(X)
+
+        return predict_proba
+
+    def flat(jobs):
+        return lambda X: compiled.predict_proba(X, jobs=jobs)
+
+    variants = [
+        (name, jobs, create(jobs))
+        for (name, create) in [("original", original), ("compiled", flat)]
+        for jobs in sorted({1, args.jobs})
+    ]
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        batch_size = batch_size or len(X)
+        batches = [
+            X[start : start + batch_size]
+            for start in range(0, min(len(X), batch_size * args.max_calls), batch_size)
+        ]
+        count = sum(len(batch) for batch in batches)
+        reference = None
+        for (name, jobs, predict_proba) in variants:
+            probas, seconds = best_time(
+                lambda: [predict_proba(batch) for batch in batches], args.repeats
+            )
+            proba = np.concatenate(probas)
+            if reference is None:
+                reference, reference_seconds = proba, seconds
+            # parallel scikit-learn sums the trees in arbitrary order
+            exact = name == "compiled" or jobs == 1
+            assert (
+                np.array_equal(proba, reference)
+                if exact
+                else np.allclose(proba, reference)
+            ), f"Probabilities of {name} with {jobs} jobs differ"
+            mismatches = np.count_nonzero(
+                np.argmax(proba, axis=1) != np.argmax(reference, axis=1)
+            )
+            rows.append(
+                [
+                    batch_size,
+                    name,
+                    jobs,
+                    count,
+                    seconds,
+                    count / seconds,
+                    reference_seconds / seconds,
+                    mismatches,
+                ]
+            )
+
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "batch size",
+                "model",
+                "jobs",
+                "samples",
+                "seconds",
+                "samples/s",
+                "speedup",
+                "mismatches",
+            ],
+            floatfmt=".4g",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
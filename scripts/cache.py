@@ -0,0 +1,278 @@
+"""
+Shared-memory cache of the dataset parts for jobs running concurrently on a node.
+
+All array tasks of a campaign (e.g. slurm/rf-types.sh) read the same dataset parts for each
+of their folds. With the cache, the first job on a node loads a part, i.e., its labels and
+the FeatureMatrix of the features of its IDS config (see features.py), into a named shared
+memory segment. Later jobs attach to the segment and use its arrays read-only instead of
+decompressing and parsing the part again. Hence, neither the memory nor the CPU time spent
+on loading the parts grows with the number of concurrent jobs.
+
+A segment is identified by the part (path and modification time), the features and their
+dtype. Its layout and the process ids of the attached jobs are kept in a manifest next to a
+lock file in CACHE_DIRECTORY (/dev/shm unless ML_AND_IDS_CACHE is set). Jobs detach when
+they exit or are terminated with SIGTERM (e.g. by Slurm at the time limit or scancel) and
+the last one removes the segment. Jobs which died without detaching are removed from the
+manifest by the next job which attaches or detaches. The segment of a part whose jobs all
+died is reused by the next job which attaches to it, the segments of all other parts whose
+jobs all died (e.g. killed with SIGKILL or by the OOM killer) are removed by the next job
+which attaches to any part. A segment without manifest (of a job which died while
+creating it) is replaced.
+"""
+
+import atexit
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import signal
+import threading
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from features import FeatureMatrix, concatenate
+from preprocessing import CHUNK_SIZE
+from utils import chunked, eprint, get_attack_details, open_file, read_packets
+
+CACHE_DIRECTORY = Path(os.environ.get("ML_AND_IDS_CACHE", "/dev/shm"))
+# the arrays in a segment are aligned to cache lines
+ALIGNMENT = 64
+
+# parts attached by this process, keyed by the name of their segment
+_attached = {}
+
+
+class SharedPart:
+    """
+    Packet ids, labels (malicious flags, attack categories and types) and FeatureMatrix of
+    a dataset part whose arrays are views of a shared memory segment.
+    """
+
+    def __init__(self, segment, layout, extractor):
+        self.segment = segment
+        arrays = {}
+        for (key, (offset, dtype, shape)) in layout.items():
+            array = np.ndarray(shape, dtype, buffer=segment.buf, offset=offset)
+            array.flags.writeable = False
+            arrays[key] = array
+        self.ids = arrays["id"]
+        self.malicious = arrays["malicious"]
+        self.categories = arrays["category"]
+        self.types = arrays["type"]
+        self.matrix = FeatureMatrix(
+            len(extractor.features),
+            extractor.continuous_columns,
+            arrays["continuous"],
+            extractor.group_columns,
+            [arrays[f"codes-{g}"] for g in range(len(extractor.group_columns))],
+        )
+
+
+def load_part(part_file, extractor):
+    """
+    Read the arrays of a SharedPart from a dataset part.
+    """
+    matrices = []
+    ids = []
+    malicious = []
+    categories = []
+    types = []
+    with open_file(part_file, "rt") as f:
+        for chunk in chunked(read_packets(f), CHUNK_SIZE):
+            matrices.append(extractor.transform(chunk))
+            for packet in chunk:
+                attack_category, attack_type = get_attack_details(packet)
+                ids.append(packet["id"])
+                malicious.append(packet["malicious"])
+                categories.append(attack_category)
+                types.append(attack_type)
+    X = concatenate(matrices) if matrices else extractor.transform([])
+
+    arrays = {
+        "id": np.array(ids, dtype=np.int64),
+        "malicious": np.array(malicious, dtype=bool),
+        "category": np.array(categories, dtype=np.int8),
+        "type": np.array(types, dtype=np.int8),
+        "continuous": X.continuous,
+    }
+    arrays.update((f"codes-{g}", codes) for (g, codes) in enumerate(X.codes))
+    return arrays
+
+
+def _segment_name(part_file, extractor):
+    part_file = part_file.resolve()
+    key = json.dumps(
+        [
+            str(part_file),
+            part_file.stat().st_mtime_ns,
+            extractor.features,
+            np.dtype(extractor.dtype).str,
+        ]
+    )
+    return "ml-and-ids-" + hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+@contextlib.contextmanager
+def _locked(name, blocking=True):
+    """
+    Hold the lock of a part. Without blocking, BlockingIOError is raised if another job
+    holds it.
+    """
+    with open(CACHE_DIRECTORY / f"{name}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        yield
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_manifest(name):
+    path = CACHE_DIRECTORY / f"{name}.json"
+    if not path.exists():
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_manifest(name, manifest):
+    path = CACHE_DIRECTORY / f"{name}.json"
+    temporary = path.with_name(path.name + ".tmp")
+    with open(temporary, "w") as f:
+        json.dump(manifest, f)
+    os.replace(temporary, path)
+
+
+def _untrack(segment):
+    # the segment outlives this process, so the resource tracker must not remove it
+    # when this process exits
+    resource_tracker.unregister(segment._name, "shared_memory")
+
+
+def _create_segment(name, arrays):
+    layout = {}
+    size = 0
+    for (key, array) in arrays.items():
+        layout[key] = [size, array.dtype.str, list(array.shape)]
+        size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    segment = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+    for (key, array) in arrays.items():
+        offset, dtype, shape = layout[key]
+        np.ndarray(shape, dtype, buffer=segment.buf, offset=offset)[...] = array
+    return segment, {"size": size, "layout": layout, "pids": []}
+
+
+def _remove_dead(reused):
+    """
+    Remove the segments and manifests of the parts whose jobs all died, except for the
+    part named reused, which is about to be attached. Parts whose lock is held, e.g.
+    while another job loads them, are skipped.
+    """
+    for path in CACHE_DIRECTORY.glob("ml-and-ids-*.json"):
+        name = path.name[: -len(".json")]
+        if name == reused or name in _attached:
+            continue
+        with contextlib.suppress(BlockingIOError), _locked(name, blocking=False):
+            manifest = _read_manifest(name)
+            if manifest is None or any(_alive(pid) for pid in manifest["pids"]):
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                segment = shared_memory.SharedMemory(name=name)
+                segment.close()
+                segment.unlink()
+            path.unlink()
+
+
+def _terminate(signum, frame):
+    # exit regularly, such that detach_all() is called
+    raise SystemExit(128 + signum)
+
+
+def _handle_termination():
+    """
+    Detach when terminated with SIGTERM, which terminates without calling the exit
+    handlers otherwise. Handlers installed by the program are kept.
+    """
+    if (
+        threading.current_thread() is threading.main_thread()
+        and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+    ):
+        signal.signal(signal.SIGTERM, _terminate)
+
+
+def attach_part(part_file, extractor):
+    """
+    Return the SharedPart of a dataset part for the features of extractor, loading it
+    into shared memory if no other job on this node did so yet.
+    """
+    name = _segment_name(part_file, extractor)
+    if name in _attached:
+        return _attached[name]
+
+    CACHE_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    if not _attached:
+        _handle_termination()
+        _remove_dead(name)
+    with _locked(name):
+        manifest = _read_manifest(name)
+        segment = None
+        if manifest is not None:
+            with contextlib.suppress(FileNotFoundError):
+                segment = shared_memory.SharedMemory(name=name)
+        if segment is None:
+            # the content of a segment without manifest is incomplete
+            with contextlib.suppress(FileNotFoundError):
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            eprint(f"Loading {part_file} into shared memory")
+            segment, manifest = _create_segment(name, load_part(part_file, extractor))
+        _untrack(segment)
+        manifest["pids"] = [
+            pid for pid in manifest["pids"] if pid != os.getpid() and _alive(pid)
+        ] + [os.getpid()]
+        _write_manifest(name, manifest)
+
+    part = SharedPart(segment, manifest["layout"], extractor)
+    _attached[name] = part
+    return part
+
+
+def detach_all():
+    """
+    Detach from all parts attached by this process. The segments of parts without
+    other attached jobs are removed. Called when the process exits.
+    """
+    while _attached:
+        name, part = _attached.popitem()
+        with _locked(name):
+            manifest = _read_manifest(name)
+            pids = [
+                pid
+                for pid in (manifest["pids"] if manifest is not None else [])
+                if pid != os.getpid() and _alive(pid)
+            ]
+            if pids:
+                manifest["pids"] = pids
+                _write_manifest(name, manifest)
+            else:
+                # unlink() unregisters the segment from the resource tracker again
+                resource_tracker.register(part.segment._name, "shared_memory")
+                with contextlib.suppress(FileNotFoundError):
+                    part.segment.unlink()
+                # the lock file is kept, another job may be waiting for the lock
+                with contextlib.suppress(FileNotFoundError):
+                    (CACHE_DIRECTORY / f"{name}.json").unlink()
+        # views of the segment may still be referenced
+        with contextlib.suppress(BufferError):
+            part.segment.close()
+
+
+atexit.register(detach_all)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+This script converts a model trained by ipal-iids into an artifact directory whose arrays
+are memory-mapped when loaded (see artifacts.py). Evaluation or serving processes using
+the artifact share one copy of the model instead of unpickling a private one each.
+"""
+
+import argparse
+import pathlib
+import time
+from artifacts import load_ipal_model, export_model, load_artifact
+from utils import eprint
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert an ipal-iids model into a memory-mappable artifact"
+    )
+    parser.add_argument(
+        "-i",
+        "--input-file",
+        required=True,
+        type=pathlib.Path,
+        help="Model file written by ipal-iids",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-directory",
+        required=True,
+        type=pathlib.Path,
+        help="Artifact directory",
+    )
+    args = parser.parse_args()
+
+    export_model(load_ipal_model(args.input_file), args.output_directory)
+
+    start = time.perf_counter()
+    load_artifact(args.output_directory)
+    eprint(f"Artifact loads in {(time.perf_counter() - start) * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
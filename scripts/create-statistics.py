@@ -3,17 +3,436 @@
 Based on the IDS' output, this script calculates TP, TN, FP and FN and based on that
 calculates precision, recall and accuracy. Recall is also calculated per individual
 attack and per attack category.
+
+Instead of the IPAL output, compact predictions (see pack-predictions.py) can be used as
+input. Their attack details are then joined from the given dataset parts.
+
+Additional named views apply the same filters as filter-dataset.py to the output. The
+statistics of all views are calculated from a single read of the input. Their filters are
+recorded next to the statistics ("*.views.json").
+
+In rolling mode, recall and precision are additionally calculated per time window and over
+the last windows (see rolling.py). The normalized timestamps of the output are converted
+back to seconds with the normalization parameters of the test set. The output is then
+processed as a stream, of which only the counts per window are kept, which allows
+arbitrarily long outputs in any order.
+
+With a reference output of another IDS on the same live set (e.g. the exact SVM for its
+kernel approximation, see run-classifier.py), the deltas of accuracy, precision and recall
+and of the recall per attack type and category against it are reported as well.
+
+In batch mode, the statistics of all outputs of folds below the given directories
+("*_fold-N.dataset-live-output.ipal.gz" or "*_fold-N.predictions.npz") are written to
+"*_fold-N.statistics.json" next to them, with the views recorded for each of them. The
+views differ between the runs, e.g. the filtered test set of an omit attacks experiment,
+hence outputs with view statistics but without recorded views are refused. The outputs are
+processed in parallel, the largest first, and outputs whose statistics are newer than the
+output (and the dataset parts for compact predictions) are skipped.
 """
 
 import argparse
 import pathlib
 import json
-from utils import open_file, get_attack_details
+import re
+from multiprocessing import Pool
+from utils import (
+    open_file,
+    get_attack_details,
+    read_packets,
+    filter_mask,
+    parse_filter,
+)
+from predictions import load_predictions, join_labels
+from rolling import RollingMetrics, save_series
+from preprocessing import load_parameters
 from tabulate import tabulate
 import json
 import numpy as np
 import sys
 
+# the IDS output of a fold as written by run-experiment.sh and the prefix of its files
+FOLD_OUTPUT = re.compile(
+    r"(.*_fold-\d+)\.(?:dataset-live-output\.ipal(?:\.gz)?|predictions\.npz)"
+)
+
+
+def load_results(input_file, dataset):
+    """
+    Load attack categories, attack types and "ids" flags of all packets either from an
+    IDS IPAL output or from compact predictions joined with the dataset parts.
+    """
+    if input_file is not None and input_file.suffix == ".npz":
+        ids, flags, _ = load_predictions(input_file)
+        categories, types = join_labels(ids, dataset)
+        return categories, types, flags
+
+    categories = []
+    types = []
+    flags = []
+    with open_file(input_file, "rt") if input_file is not None else sys.stdin as file:
+        for data in read_packets(file):
+            attack_category, attack_type = get_attack_details(data)
+            categories.append(attack_category)
+            types.append(attack_type)
+            flags.append(bool(data["ids"]))
+
+    return (
+        np.array(categories, dtype=np.int64),
+        np.array(types, dtype=np.int64),
+        np.array(flags, dtype=bool),
+    )
+
+
+def count_results(values, flags, size):
+    """
+    Create a table with a row [value, undetected count, detected count] for each
+    value in range(size).
+    """
+    assert len(values) == 0 or values.max() < size, "Unexpected attack details"
+    counts = np.bincount(2 * values + flags, minlength=2 * size).reshape(size, 2)
+    return [
+        [i, int(normal), int(malicious)]
+        for (i, (normal, malicious)) in enumerate(counts)
+    ]
+
+
+def stream_results(input_file, rolling, timestamp_parameters):
+    """
+    Count the results of an IDS IPAL output packet by packet while updating the rolling
+    metrics with the timestamps converted back to seconds, without keeping the individual
+    packets. Returns the same tables as count_results().
+    """
+    mean = timestamp_parameters["mean"]
+    std = timestamp_parameters["std"]
+    results_type = [[i, 0, 0] for i in range(36)]
+    results_category = [[i, 0, 0] for i in range(8)]
+    with open_file(input_file, "rt") if input_file is not None else sys.stdin as file:
+        for data in read_packets(file):
+            attack_category, attack_type = get_attack_details(data)
+            detected = bool(data["ids"])
+            results_type[attack_type][1 + detected] += 1
+            results_category[attack_category][1 + detected] += 1
+            rolling.update(data["timestamp"] * std + mean, attack_category, detected)
+
+    rolling.finish()
+    return results_type, results_category
+
+
+def calculate_statistics(results_type, results_category):
+    """
+    Add the recall to the result tables (see count_results()) and calculate the global
+    metrics.
+    """
+    # the tables have rows for each attack type/category
+    # and three columns: "attack type", "undetected count" and "detected count".
+    # note that the first row corresponds to non-attack packets, meaning
+    # "undetected" is actually the correct output.
+    count = sum([row[1] + row[2] for row in results_type])
+
+    # calulate recall for types and categories.
+    # use np.float64 to prevent DivisionByZero errors (return inf instead).
+    with np.errstate(divide="ignore", invalid="ignore"):
+        results_type[0].append(
+            np.float64(results_type[0][1]) / (results_type[0][1] + results_type[0][2])
+        )
+        for type_entry in results_type[1:]:
+            type_entry.append(
+                np.float64(type_entry[2]) / (type_entry[1] + type_entry[2])
+            )
+
+        results_category[0].append(
+            np.float64(results_category[0][1])
+            / (results_category[0][1] + results_category[0][2])
+        )
+        for cat_entry in results_category[1:]:
+            cat_entry.append(np.float64(cat_entry[2]) / (cat_entry[1] + cat_entry[2]))
+
+        # calculate global metrics
+        true_positive = sum([row[2] for row in results_type[1:]])
+        true_negative = results_type[0][1]
+        false_positive = results_type[0][2]
+        false_negative = sum([row[1] for row in results_type[1:]])
+        assert count == (
+            true_positive + true_negative + false_positive + false_negative
+        )
+
+        accuracy = np.float64(true_negative + true_positive) / count
+        precision = np.float64(true_positive) / (true_positive + false_positive)
+        recall = np.float64(true_positive) / (true_positive + false_negative)
+
+    metrics = {
+        "TP": true_positive,
+        "TN": true_negative,
+        "FP": false_positive,
+        "FN": false_negative,
+        "accuracy": accuracy,
+        "precision": precision,
+        "recall": recall,
+    }
+    return results_type, results_category, metrics
+
+
+def compare_statistics(statistics, reference_statistics, agreement):
+    """
+    Calculate the deltas of the global metrics and of the recall per attack type and
+    category against the statistics of a reference output.
+    """
+    results_type, results_category, metrics = statistics
+    reference_type, reference_category, reference_metrics = reference_statistics
+    return {
+        "agreement": agreement,
+        **{
+            key: metrics[key] - reference_metrics[key]
+            for key in ["accuracy", "precision", "recall"]
+        },
+        "attack_types": {
+            i: results_type[i][3] - reference_type[i][3] for i in range(36)
+        },
+        "attack_categories": {
+            i: results_category[i][3] - reference_category[i][3] for i in range(8)
+        },
+    }
+
+
+def print_comparison(statistics, reference_statistics, deltas):
+    print("\n----- Deltas Against Reference -----")
+    print(f"Agreement: {deltas['agreement']:.4f}")
+    for key in ["accuracy", "precision", "recall"]:
+        print(
+            f"Global {key}: {statistics[2][key]:.4f} "
+            f"(reference {reference_statistics[2][key]:.4f}, delta {deltas[key]:+.4f})"
+        )
+    print(
+        tabulate(
+            [
+                [i, row[3], reference_row[3], deltas["attack_types"][i]]
+                for (i, (row, reference_row)) in enumerate(
+                    zip(statistics[0], reference_statistics[0])
+                )
+                if row[1] + row[2] > 0
+            ],
+            headers=["attack type", "recall", "reference recall", "delta"],
+        )
+    )
+
+
+def print_statistics(results_type, results_category, metrics):
+    count = metrics["TP"] + metrics["TN"] + metrics["FP"] + metrics["FN"]
+    print(
+        f"TP: {metrics['TP']}, TN: {metrics['TN']}, FP: {metrics['FP']}, FN: {metrics['FN']}, Count: {count}"
+    )
+    print(f"Global accuracy: {metrics['accuracy']:.4f}")
+    print(f"Global precision: {metrics['precision']:.4f}")
+    print(f"Global recall: {metrics['recall']:.4f}")
+
+    # output tables
+    print("\n----- Attack Type Results -----")
+    print(
+        tabulate(results_type, headers=["attack type", "normal", "malicious", "recall"])
+    )
+
+    print("\n----- Attack Category Results -----")
+    print(
+        tabulate(
+            results_category,
+            headers=["attack category", "normal", "malicious", "recall"],
+        )
+    )
+
+
+def write_statistics(
+    output_file, results_type, results_category, metrics, reference=None
+):
+    # create machine-readable output as json
+    data = {
+        **metrics,
+        "attack_types": {},
+        "attack_categories": {},
+    }
+    if reference is not None:
+        data["reference"] = reference
+
+    for i in range(36):
+        data["attack_types"][i] = {
+            "labelled_normal": results_type[i][1],
+            "labelled_malicious": results_type[i][2],
+            "recall": results_type[i][3],
+        }
+    for i in range(8):
+        data["attack_categories"][i] = {
+            "labelled_normal": results_category[i][1],
+            "labelled_malicious": results_category[i][2],
+            "recall": results_category[i][3],
+        }
+
+    with open_file(output_file, "wt") as file:
+        json.dump(data, file, indent=4, ensure_ascii=False)
+
+
+def report(categories, types, flags, reference_flags, output_file, show=True):
+    """
+    Print the statistics of the results and write them to the output file if given. If
+    the flags of a reference output are given, the deltas against it are added.
+    """
+    statistics = calculate_statistics(
+        count_results(types, flags, 36), count_results(categories, flags, 8)
+    )
+    if show:
+        print_statistics(*statistics)
+
+    deltas = None
+    if reference_flags is not None:
+        reference_statistics = calculate_statistics(
+            count_results(types, reference_flags, 36),
+            count_results(categories, reference_flags, 8),
+        )
+        agreement = np.float64(np.count_nonzero(flags == reference_flags)) / len(flags)
+        deltas = compare_statistics(statistics, reference_statistics, agreement)
+        if show:
+            print_comparison(statistics, reference_statistics, deltas)
+
+    if output_file is not None:
+        write_statistics(output_file, *statistics, reference=deltas)
+
+
+def parse_view(name, filter_string):
+    """
+    Parse the filter of a view, given as filter-dataset.py arguments in one string.
+    """
+    return parse_filter(filter_string, prog=f"view '{name}'")
+
+
+def view_output_file(output_file, name):
+    """
+    Insert the view name into the output file name, e.g. "x.statistics.json" becomes
+    "x.statistics-filtered.json" for the view "filtered".
+    """
+    suffix = (
+        "".join(output_file.suffixes[-2:])
+        if output_file.suffix == ".gz"
+        else output_file.suffix
+    )
+    stem = output_file.name[: len(output_file.name) - len(suffix)]
+    return output_file.with_name(f"{stem}-{name}{suffix}")
+
+
+def views_file(output_file):
+    """
+    Return the file recording the views of the statistics, e.g. "x.views.json" for
+    "x.statistics.json".
+    """
+    name = output_file.name
+    if name.endswith(".statistics.json"):
+        name = name[: -len(".statistics.json")]
+    else:
+        name = output_file.stem
+    return output_file.with_name(f"{name}.views.json")
+
+
+def create_statistics(
+    input_file, output_file, dataset, views, reference_file=None, show=True
+):
+    """
+    Calculate the statistics of an IDS output and of its views, given as pairs of name
+    and filter string, and write them to the output file (and the view output files) if
+    given. The views are recorded next to the output file.
+    """
+    categories, types, flags = load_results(input_file, dataset)
+    reference_flags = None
+    if reference_file is not None:
+        reference_categories, reference_types, reference_flags = load_results(
+            reference_file, dataset
+        )
+        assert np.array_equal(reference_types, types) and np.array_equal(
+            reference_categories, categories
+        ), "The reference output must cover the same packets in the same order"
+
+    report(categories, types, flags, reference_flags, output_file, show)
+
+    if output_file is not None and views:
+        with open(views_file(output_file), "w") as f:
+            json.dump(dict(views), f, indent=4)
+
+    for (name, filter_string) in views:
+        keep = filter_mask(categories, types, parse_view(name, filter_string))
+        view_file = None
+        if output_file is not None:
+            view_file = view_output_file(output_file, name)
+        if show:
+            print(f"\n===== View '{name}' =====")
+        report(
+            categories[keep],
+            types[keep],
+            flags[keep],
+            reference_flags[keep] if reference_flags is not None else None,
+            view_file,
+            show,
+        )
+
+
+def batch_tasks(directories, dataset, force):
+    """
+    Find the IDS outputs of all folds below the directories and return them with their
+    statistics file and their recorded views, largest output first. Outputs whose
+    statistics (including those of the views) are newer than their inputs are omitted
+    unless force is set. The views of outputs with view statistics but without recorded
+    views are None.
+    """
+    tasks = []
+    for directory in directories:
+        for input_file in sorted(directory.rglob("*_fold-*")):
+            match = FOLD_OUTPUT.fullmatch(input_file.name)
+            if match is None or not input_file.is_file():
+                continue
+            output_file = input_file.with_name(f"{match.group(1)}.statistics.json")
+            views = []
+            if views_file(output_file).exists():
+                with open(views_file(output_file), "r") as f:
+                    views = list(json.load(f).items())
+            elif any(output_file.parent.glob(view_output_file(output_file, "*").name)):
+                views = None
+            inputs = [input_file]
+            if input_file.suffix == ".npz":
+                inputs += dataset
+            outputs = [output_file] + [
+                view_output_file(output_file, name) for (name, _) in views or []
+            ]
+            newest = max(f.stat().st_mtime for f in inputs)
+            if not force and all(
+                f.exists() and f.stat().st_mtime > newest for f in outputs
+            ):
+                continue
+            tasks.append((input_file, output_file, dataset, views))
+    tasks.sort(key=lambda task: task[0].stat().st_size, reverse=True)
+    return tasks
+
+
+def _batch_task(task):
+    input_file, output_file, dataset, views = task
+    try:
+        create_statistics(input_file, output_file, dataset, views, show=False)
+    except Exception as e:
+        return input_file, f"{type(e).__name__}: {e}"
+    return input_file, None
+
+
+def run_batch(tasks, jobs):
+    """
+    Process the tasks of batch_tasks() on a pool of processes. Each process takes the
+    next output when it is done with the previous one. Returns the number of failures.
+    """
+    failures = 0
+    with Pool(jobs) as pool:
+        for (count, (input_file, error)) in enumerate(
+            pool.imap_unordered(_batch_task, tasks), start=1
+        ):
+            if error is not None:
+                failures += 1
+                print(f"[{count}/{len(tasks)}] Failed: {input_file} ({error})")
+            else:
+                print(f"[{count}/{len(tasks)}] {input_file}")
+    return failures
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -23,7 +442,31 @@ def main():
         "-i",
         "--input-file",
         type=pathlib.Path,
-        help="Input file (ipal, optionally gzipped) or stdin if omitted",
+        help="Input file (ipal, optionally gzipped, or compact predictions as npz) or "
+        "stdin if omitted",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        nargs="+",
+        type=pathlib.Path,
+        metavar="DIRECTORY",
+        help="Batch mode: write the statistics of the outputs of all folds below the "
+        "directories next to them instead of reading a single input file. The views of "
+        "each output are those recorded with its statistics",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of outputs processed in parallel in batch mode (defaults to 1)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Recalculate all statistics in batch mode, even those newer than their "
+        "output",
     )
     parser.add_argument(
         "-o",
@@ -31,115 +474,131 @@ def main():
         type=pathlib.Path,
         help="Write statistics in machine-readable JSON format to that location (optional)",
     )
+    parser.add_argument(
+        "-d",
+        "--dataset",
+        nargs="*",
+        type=pathlib.Path,
+        help="Dataset parts (ipal, optionally gzipped) to join compact predictions with",
+    )
+    parser.add_argument(
+        "-v",
+        "--view",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("NAME", "FILTER"),
+        help="Additionally calculate statistics over a filtered view of the output. FILTER "
+        "takes the arguments of filter-dataset.py as one string, e.g. "
+        '"-m packet-by-packet --only-types 3 0". With --output-file, the statistics '
+        "are written next to it with the name of the view appended and the views are "
+        "recorded for batch mode (can be repeated)",
+    )
+    parser.add_argument(
+        "-r",
+        "--rolling-output",
+        type=pathlib.Path,
+        help="Additionally calculate the metrics over time windows based on the timestamps "
+        "and write them to that location (npz). The output is processed packet by packet "
+        "and may be in any order, only the counts per window are kept in memory. "
+        "Requires --parameters-file (optional)",
+    )
+    parser.add_argument(
+        "-p",
+        "--parameters-file",
+        type=pathlib.Path,
+        help="Normalization parameters (or checkpoint) of the test set to convert its "
+        "timestamps back to seconds for the rolling metrics",
+    )
+    parser.add_argument(
+        "-w",
+        "--window-length",
+        type=float,
+        default=1.0,
+        help="Length of the time windows in seconds (defaults to 1)",
+    )
+    parser.add_argument(
+        "--window-count",
+        type=int,
+        default=60,
+        help="Number of windows to calculate the rolling metrics over (defaults to 60)",
+    )
+    parser.add_argument(
+        "--reference",
+        type=pathlib.Path,
+        help="Output of a reference IDS on the same live set (ipal, optionally gzipped, "
+        "or compact predictions as npz), e.g. of the exact SVM for an approximated one. "
+        "The deltas of the metrics against it are reported as well (optional)",
+    )
     args = parser.parse_args()
 
-    with open_file(
-        args.input_file, "rt"
-    ) if args.input_file is not None else sys.stdin as file:
-        # create a table with rows for each attack category
-        # and three columns: "attack type", "undetected count" and "detected count".
-        # note that the first row corresponds to non-attack packets, meaning
-        # "undetected" is actually the correct output.
-        results_type = [[i, 0, 0] for i in range(36)]
-        results_category = [[i, 0, 0] for i in range(8)]
-
-        lines = [line for line in file.readlines() if line.strip()]
-        count = len(lines)
-
-        for l in lines:
-            data = json.loads(l)
-
-            attack_category, attack_type = get_attack_details(data)
-
-            results_category[attack_category][2 if data["ids"] else 1] += 1
-            results_type[attack_type][2 if data["ids"] else 1] += 1
-
-        # calulate recall for types and categories.
-        # use np.float64 to prevent DivisionByZero errors (return inf instead).
-        with np.errstate(divide="ignore", invalid="ignore"):
-            results_type[0].append(
-                np.float64(results_type[0][1])
-                / (results_type[0][1] + results_type[0][2])
-            )
-            for type_entry in results_type[1:]:
-                type_entry.append(
-                    np.float64(type_entry[2]) / (type_entry[1] + type_entry[2])
-                )
-
-            results_category[0].append(
-                np.float64(results_category[0][1])
-                / (results_category[0][1] + results_category[0][2])
-            )
-            for cat_entry in results_category[1:]:
-                cat_entry.append(
-                    np.float64(cat_entry[2]) / (cat_entry[1] + cat_entry[2])
-                )
-
-            # calculate global metrics
-            true_positive = sum([row[2] for row in results_type[1:]])
-            true_negative = results_type[0][1]
-            false_positive = results_type[0][2]
-            false_negative = sum([row[1] for row in results_type[1:]])
-            assert count == (
-                true_positive + true_negative + false_positive + false_negative
-            )
-
-            accuracy = np.float64(true_negative + true_positive) / count
-            precision = np.float64(true_positive) / (true_positive + false_positive)
-            recall = np.float64(true_positive) / (true_positive + false_negative)
-
-        print(
-            f"TP: {true_positive}, TN: {true_negative}, FP: {false_positive}, FN: {false_negative}, Count: {count}"
+    if args.batch is not None and (
+        args.input_file is not None
+        or args.output_file is not None
+        or args.view
+        or args.rolling_output is not None
+        or args.reference is not None
+    ):
+        parser.error(
+            "batch mode derives input and output files and the views of each output and "
+            "supports no rolling metrics or reference"
         )
-        print(f"Global accuracy: {accuracy:.4f}")
-        print(f"Global precision: {precision:.4f}")
-        print(f"Global recall: {recall:.4f}")
 
-        # output tables
-        print("\n----- Attack Type Results -----")
-        print(
-            tabulate(
-                results_type, headers=["attack type", "normal", "malicious", "recall"]
-            )
+    compact = any(
+        f is not None and f.suffix == ".npz" for f in [args.input_file, args.reference]
+    )
+    if compact and not args.dataset:
+        parser.error("compact predictions require the dataset parts (--dataset)")
+    if args.rolling_output is not None and (
+        args.view or args.reference is not None or compact
+    ):
+        parser.error(
+            "rolling metrics require an IPAL output with timestamps and no views or "
+            "reference"
+        )
+    if (args.rolling_output is None) != (args.parameters_file is None):
+        parser.error(
+            "rolling metrics require the normalization parameters of the test set "
+            "(--parameters-file) to convert its timestamps to seconds, which are used "
+            "for nothing else"
         )
 
-        print("\n----- Attack Category Results -----")
-        print(
-            tabulate(
-                results_category,
-                headers=["attack category", "normal", "malicious", "recall"],
+    # parse the filters once to report errors before reading the input
+    for (name, filter_string) in args.view:
+        parse_view(name, filter_string)
+
+    if args.batch is not None:
+        tasks = batch_tasks(args.batch, args.dataset or [], args.force)
+        if not args.dataset and any(task[0].suffix == ".npz" for task in tasks):
+            parser.error("compact predictions require the dataset parts (--dataset)")
+        unknown = [task[1] for task in tasks if task[3] is None]
+        if unknown:
+            parser.error(
+                f"{len(unknown)} outputs have view statistics, but their views are not "
+                f"recorded (e.g. {views_file(unknown[0])}), recalculate them without "
+                "batch mode"
             )
-        )
+        print(f"Calculating the statistics of {len(tasks)} outputs")
+        if run_batch(tasks, args.jobs):
+            sys.exit(1)
+        return
 
-    if args.output_file is not None:
-        # create machine-readable output as json
-        data = {
-            "TP": true_positive,
-            "TN": true_negative,
-            "FP": false_positive,
-            "FN": false_negative,
-            "accuracy": accuracy,
-            "precision": precision,
-            "recall": recall,
-            "attack_types": {},
-            "attack_categories": {},
-        }
+    if args.rolling_output is not None:
+        norm_parameters, _ = load_parameters(args.parameters_file)
+        rolling = RollingMetrics(args.window_length, args.window_count)
+        statistics = calculate_statistics(
+            *stream_results(args.input_file, rolling, norm_parameters["timestamp"])
+        )
+        save_series(args.rolling_output, rolling)
+        print(f"Rolling windows: {len(rolling.window_starts)}\n")
+        print_statistics(*statistics)
+        if args.output_file is not None:
+            write_statistics(args.output_file, *statistics)
+        return
 
-        for i in range(36):
-            data["attack_types"][i] = {
-                "labelled_normal": results_type[i][1],
-                "labelled_malicious": results_type[i][2],
-                "recall": results_type[i][3],
-            }
-        for i in range(8):
-            data["attack_categories"][i] = {
-                "labelled_normal": results_category[i][1],
-                "labelled_malicious": results_category[i][2],
-                "recall": results_category[i][3],
-            }
-
-        with open_file(args.output_file, "wt") as file:
-            json.dump(data, file, indent=4, ensure_ascii=False)
+    create_statistics(
+        args.input_file, args.output_file, args.dataset, args.view, args.reference
+    )
 
 
 if __name__ == "__main__":
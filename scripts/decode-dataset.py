@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+This script converts a preprocessed dataset in the compact encoding (see encoding.py) back
+to the full format, e.g. for ipal-iids. Datasets in the full format are copied unchanged.
+
+With --config, only the fields which the features of the given IDS configs refer to are
+written (see Projection in preprocessing.py), e.g. while building the sets of a fold.
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+from utils import open_file, read_packets
+from encoding import full_lines
+from preprocessing import load_projection
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Decode a compact IPAL dataset into the full format"
+    )
+    parser.add_argument(
+        "-i",
+        "--input-file",
+        type=pathlib.Path,
+        help="Input file (ipal, optionally gzipped) or stdin if omitted",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-file",
+        type=pathlib.Path,
+        help="Output file (ipal, optionally gzipped) or stdout if omitted",
+    )
+    parser.add_argument(
+        "--config",
+        nargs="+",
+        type=pathlib.Path,
+        help="Only keep the fields which the features of these IDS configs refer to "
+        "(optional)",
+    )
+    args = parser.parse_args()
+
+    projection = load_projection(args.config)
+
+    with open_file(
+        args.input_file, "rt"
+    ) if args.input_file is not None else sys.stdin as f_in, (
+        open_file(args.output_file, "wt")
+        if args.output_file is not None
+        else sys.stdout
+    ) as f_out:
+        if projection is None:
+            f_out.writelines(full_lines(f_in))
+            return
+        for packet in read_packets(f_in):
+            f_out.write(json.dumps(projection.apply(packet)))
+            f_out.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Compact encoding of preprocessed IPAL packets.
+
+In the full format written by preprocess-dataset.py, every packet holds the complete cached
+state and one boolean key per value of each categorical field (see categoricalize_args in
+preprocessing.py), in the packet itself, in its data and in its state. Hence, most of each
+line repeats the previous line. The compact format omits all one-hot keys, which follow
+from the categorical value, and the state entries which follow from the data of the packet
+itself ("keep-last"). The remaining state is written as follows:
+- keyframes hold all other state entries and the values of the categorical fields
+  ("categories")
+- all other packets only hold the other state entries which changed since the previous
+  packet ("state-delta"), which is usually empty
+
+A keyframe is written for every packet whose id is a multiple of KEYFRAME_INTERVAL and
+whenever the previous packet is not its predecessor in the dataset. As the dataset parts
+consist of sequences of four consecutive packets, each sequence starts with a keyframe and
+can be moved or removed as a whole, e.g. by split-dataset.py or subsample-dataset.py.
+Removing single packets requires decoding first, which is why filter-dataset.py always
+writes the full format.
+
+decode_packets() reconstructs the full packets, which are equal to the packets of the full
+format (except for the order of their keys). read_packets() in utils.py decodes compact
+packets transparently.
+"""
+
+import json
+from itertools import chain
+
+# number of packets per keyframe, i.e., the length of the sequences of the dataset parts
+KEYFRAME_INTERVAL = 4
+
+
+def is_compact(packet):
+    return "categories" in packet or "state-delta" in packet
+
+
+def _same(a, b):
+    # True == 1 in Python, but not in JSON
+    return type(a) is type(b) and a == b
+
+
+def _prefixed(packet):
+    """
+    Return the state entries set by the data of a packet ("keep-last").
+    """
+    return {f"{packet['src']}:{key}": value for (key, value) in packet["data"].items()}
+
+
+def _difference(state, expected):
+    """
+    Return the entries of state which are missing in or differ from expected.
+    """
+    return {
+        key: value
+        for (key, value) in state.items()
+        if key not in expected or not _same(expected[key], value)
+    }
+
+
+class CompactEncoder:
+    """
+    Encodes successive full packets in the compact format. categories maps each
+    categorical field to its values in the order of the one-hot keys.
+    """
+
+    def __init__(self, categories):
+        self.categories = {arg: list(values) for (arg, values) in categories.items()}
+        self.top_flags = {
+            f"{arg}_{value}"
+            for (arg, values) in self.categories.items()
+            if not arg.startswith("data;")
+            for value in values
+        }
+        self.data_flags = {
+            f"{arg[5:]}_{value}"
+            for (arg, values) in self.categories.items()
+            if arg.startswith("data;")
+            for value in values
+        }
+        self.state = None
+        self.previous_id = None
+
+    def encode(self, packet):
+        """
+        Return the compact version of a full packet.
+        """
+        state = {
+            key: value
+            for (key, value) in packet["state"].items()
+            if key.partition(":")[2] not in self.data_flags
+        }
+        data = _prefixed(packet)
+        keyframe = (
+            packet["id"] % KEYFRAME_INTERVAL == 0
+            or self.previous_id != packet["id"] - 1
+            # the state never loses entries within the dataset
+            or any(key not in state for key in self.state)
+        )
+
+        compact = {
+            key: value
+            for (key, value) in packet.items()
+            if key not in self.top_flags and key not in ["state", "id"]
+        }
+        compact["data"] = {
+            key: value
+            for (key, value) in packet["data"].items()
+            if key not in self.data_flags
+        }
+        if keyframe:
+            compact["categories"] = self.categories
+            compact["state"] = _difference(state, data)
+        else:
+            compact["state-delta"] = _difference(state, {**self.state, **data})
+        compact["id"] = packet["id"]
+
+        self.state = state
+        self.previous_id = packet["id"]
+        return compact
+
+
+def _one_hot(container, name, values):
+    """
+    Add the one-hot keys of the categorical field name to container if it is present.
+    Values without one-hot keys (unseen during fit) set all of them to False.
+    """
+    value = container.get(name)
+    if value is not None:
+        container.update((f"{name}_{v}", v == value) for v in values)
+
+
+def decode_packets(packets):
+    """
+    Yield the full version of each packet. Packets in the full format are passed
+    through unchanged.
+    """
+    state = None
+    categories = None
+    previous_id = None
+    for packet in packets:
+        if not is_compact(packet):
+            state = None
+            yield packet
+            continue
+
+        if "categories" in packet:
+            categories = packet.pop("categories")
+            state = {**packet.pop("state"), **_prefixed(packet)}
+        else:
+            assert state is not None and previous_id == packet["id"] - 1, (
+                f"Packet {packet['id']} is delta-encoded but does not follow its "
+                "predecessor. Compact datasets can only be split into whole sequences."
+            )
+            state = {**state, **_prefixed(packet), **packet.pop("state-delta")}
+        previous_id = packet["id"]
+
+        packet_id = packet.pop("id")
+        for (arg, values) in categories.items():
+            if arg.startswith("data;"):
+                _one_hot(packet["data"], arg[5:], values)
+            else:
+                _one_hot(packet, arg, values)
+        full_state = dict(state)
+        for (arg, values) in categories.items():
+            if not arg.startswith("data;"):
+                continue
+            for key in state:
+                src, _, name = key.partition(":")
+                if name == arg[5:] and state[key] is not None:
+                    full_state.update(
+                        (f"{src}:{name}_{v}", v == state[key]) for v in values
+                    )
+        packet["state"] = full_state
+        packet["id"] = packet_id
+        yield packet
+
+
+def full_lines(lines):
+    """
+    Yield the non-empty lines of a dataset in the full format. Datasets in the full
+    format are passed through without parsing them, compact ones are decoded.
+    """
+    lines = (line for line in lines if line.strip())
+    first = next(lines, None)
+    if first is None:
+        return
+    lines = chain([first], lines)
+    if not is_compact(json.loads(first)):
+        yield from lines
+        return
+    for packet in decode_packets(json.loads(line) for line in lines):
+        yield json.dumps(packet) + "\n"
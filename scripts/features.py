@@ -0,0 +1,215 @@
+"""
+Feature matrices of IPAL packets for the features listed in an IDS config.
+
+Most features of the RF and SVM configs are one-hot flags of the categorical fields (see
+categoricalize_args in preprocessing.py), e.g. "type_3" or "state;4:system mode_1". Of each
+such group at most one flag is set, so a FeatureMatrix stores the index of the set flag per
+packet (or -1) instead of the flags. The remaining, continuous features are stored as
+float32 (or float64 if requested). The matrix is expanded lazily into a dense array or a
+CSR matrix with the columns in the order of the config.
+"""
+
+import re
+import numpy as np
+import scipy.sparse
+from preprocessing import categoricalize_args
+
+# one-hot flags are named "<categorical field>_<value>"
+_ONE_HOT_PATTERN = re.compile(r"^(.*)_(-?\d+)$")
+_CATEGORICAL_NAMES = {arg.split(";")[-1] for arg in categoricalize_args}
+
+
+def lookup(packet, feature):
+    """
+    Return the value of a feature of a packet or None if it is not present. Features
+    prefixed with "state;" or "data;" refer to the entries of the corresponding dicts.
+    """
+    if feature.startswith("state;"):
+        return packet["state"].get(feature[6:])
+    if feature.startswith("data;"):
+        return packet["data"].get(feature[5:])
+    return packet.get(feature)
+
+
+def one_hot_groups(features):
+    """
+    Group the one-hot flags among features by their categorical field. Returns a dict
+    mapping the field (including the "state;<src>:" or "data;" prefix) to the column
+    indices of its flags.
+    """
+    groups = {}
+    for (column, feature) in enumerate(features):
+        match = _ONE_HOT_PATTERN.match(feature)
+        if match is None:
+            continue
+        field = match.group(1)
+        if re.split(r"[;:]", field)[-1] in _CATEGORICAL_NAMES:
+            groups.setdefault(field, []).append(column)
+    return groups
+
+
+class FeatureMatrix:
+    """
+    Feature matrix with continuous columns and one-hot groups stored as category indices
+    (int8 or int16, -1 if no flag of a group is set).
+    """
+
+    def __init__(self, n_columns, continuous_columns, continuous, group_columns, codes):
+        self.n_columns = n_columns
+        self.continuous_columns = continuous_columns
+        self.continuous = continuous
+        self.group_columns = group_columns
+        self.codes = codes
+
+    @property
+    def shape(self):
+        return (len(self.continuous), self.n_columns)
+
+    def __len__(self):
+        return len(self.continuous)
+
+    @property
+    def nbytes(self):
+        return self.continuous.nbytes + sum(codes.nbytes for codes in self.codes)
+
+    def take(self, rows):
+        return FeatureMatrix(
+            self.n_columns,
+            self.continuous_columns,
+            self.continuous[rows],
+            self.group_columns,
+            [codes[rows] for codes in self.codes],
+        )
+
+    def toarray(self, dtype=np.float32):
+        """
+        Expand into a dense array.
+        """
+        dense = np.zeros(self.shape, dtype=dtype)
+        dense[:, self.continuous_columns] = self.continuous
+        for (columns, codes) in zip(self.group_columns, self.codes):
+            present = np.flatnonzero(codes >= 0)
+            dense[present, columns[codes[present]]] = 1
+        return dense
+
+    def tocsr(self, dtype=np.float32):
+        """
+        Expand into a CSR matrix holding the nonzero continuous values and the set flags.
+        """
+        rows, columns = np.nonzero(self.continuous)
+        data = [self.continuous[rows, columns]]
+        rows = [rows]
+        columns = [self.continuous_columns[columns]]
+        for (group_columns, codes) in zip(self.group_columns, self.codes):
+            present = np.flatnonzero(codes >= 0)
+            rows.append(present)
+            columns.append(group_columns[codes[present]])
+            data.append(np.ones(len(present), dtype=self.continuous.dtype))
+        return scipy.sparse.csr_matrix(
+            (
+                np.concatenate(data).astype(dtype),
+                (np.concatenate(rows), np.concatenate(columns)),
+            ),
+            shape=self.shape,
+        )
+
+    def missing(self, columns):
+        """
+        Return for each row whether the given columns are missing (rows x columns), i.e.,
+        whether a continuous value is NaN or no flag of a one-hot group is set.
+        """
+        flags = np.zeros((len(self), len(columns)), dtype=bool)
+        for (index, column) in enumerate(columns):
+            position = np.flatnonzero(self.continuous_columns == column)
+            if len(position):
+                flags[:, index] = np.isnan(self.continuous[:, position[0]])
+                continue
+            for (group_columns, codes) in zip(self.group_columns, self.codes):
+                if column in group_columns:
+                    flags[:, index] = codes < 0
+        return flags
+
+    def complete(self):
+        """
+        Return for each row whether all of its continuous values are present. Absent
+        one-hot flags are unset flags and never missing.
+        """
+        return ~np.isnan(self.continuous).any(axis=1)
+
+    def blocks(self, size, dtype=np.float32):
+        """
+        Yield the matrix as successive dense blocks of at most size rows, such that
+        only one block is expanded at a time.
+        """
+        for start in range(0, len(self), size):
+            yield self.take(slice(start, start + size)).toarray(dtype)
+
+
+def concatenate(matrices):
+    first = matrices[0]
+    return FeatureMatrix(
+        first.n_columns,
+        first.continuous_columns,
+        np.concatenate([m.continuous for m in matrices]),
+        first.group_columns,
+        [
+            np.concatenate([m.codes[g] for m in matrices])
+            for g in range(len(first.codes))
+        ],
+    )
+
+
+class FeatureExtractor:
+    """
+    Extracts the FeatureMatrix of the given features from chunks of packets. Missing
+    continuous values become NaN. Unless a config allows them ("allow-none"), packets with
+    missing values are skipped like ipal-iids does (see FeatureMatrix.complete()).
+    """
+
+    def __init__(self, features, dtype=np.float32):
+        self.features = features
+        self.dtype = dtype
+        groups = one_hot_groups(features)
+        grouped = {column for columns in groups.values() for column in columns}
+        self.continuous_columns = np.array(
+            [c for c in range(len(features)) if c not in grouped], dtype=np.intp
+        )
+        self.group_columns = [
+            np.array(columns, dtype=np.intp) for columns in groups.values()
+        ]
+
+    def transform(self, packets):
+        continuous = np.array(
+            [
+                [lookup(p, self.features[c]) for c in self.continuous_columns]
+                for p in packets
+            ],
+            dtype=self.dtype,
+        ).reshape(len(packets), len(self.continuous_columns))
+
+        codes = []
+        for columns in self.group_columns:
+            group_codes = np.full(
+                len(packets), -1, dtype=np.int8 if len(columns) < 128 else np.int16
+            )
+            for (index, column) in enumerate(columns):
+                feature = self.features[column]
+                flags = np.fromiter(
+                    (bool(lookup(p, feature)) for p in packets),
+                    dtype=bool,
+                    count=len(packets),
+                )
+                conflicts = flags & (group_codes >= 0)
+                assert (
+                    not conflicts.any()
+                ), f"Several flags set in the group of {feature}"
+                group_codes[flags] = index
+            codes.append(group_codes)
+
+        return FeatureMatrix(
+            len(self.features),
+            self.continuous_columns,
+            continuous,
+            self.group_columns,
+            codes,
+        )
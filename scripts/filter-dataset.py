@@ -4,13 +4,52 @@ This script filters a dataset in IPAL format. Filtering is done based on the ent
 in the 'attack-details' field of the dataset.
 
 The filter is specified using command line parameters.
+
+A dataset in the compact encoding (see encoding.py) is written in the full format, such that
+single packets can be removed and the result can be read by ipal-iids. With --config, only
+the fields which the features of the given IDS configs refer to are written (see Projection
+in preprocessing.py).
+
+Compact predictions (see pack-predictions.py) can be filtered as well. Their attack details
+are joined from the given dataset parts and the result is written as compact predictions.
 """
 
 import argparse
 import pathlib
 import json
 import sys
-from utils import chunks, eprint, open_file, get_attack_details
+import numpy as np
+from utils import (
+    chunked,
+    eprint,
+    open_file,
+    get_attack_details,
+    add_filter_arguments,
+    filter_mask,
+)
+from predictions import load_predictions, save_predictions, join_labels
+from encoding import full_lines
+from preprocessing import load_projection
+
+
+def filter_predictions(args):
+    """
+    Filter compact predictions, returns the number of filtered and total sequences.
+    """
+    ids, flags, scores = load_predictions(args.input_file)
+    categories, types = join_labels(ids, args.dataset)
+    keep = filter_mask(categories, types, args)
+
+    save_predictions(
+        args.output_file,
+        ids[keep],
+        flags[keep],
+        scores[keep] if scores is not None else None,
+    )
+    sequence_len = 4 if args.mode == "sequence-of-four" else 1
+    sequence_index = np.arange(len(ids)) // sequence_len
+    removed = len(np.unique(sequence_index[~keep]))
+    return removed, (len(ids) + sequence_len - 1) // sequence_len
 
 
 def main():
@@ -21,7 +60,8 @@ def main():
         "-i",
         "--input-file",
         type=pathlib.Path,
-        help="Input file (ipal, optionally gzipped) or stdin if omitted",
+        help="Input file (ipal, optionally gzipped, or compact predictions as npz) or "
+        "stdin if omitted",
     )
     parser.add_argument(
         "-o",
@@ -29,65 +69,57 @@ def main():
         type=pathlib.Path,
         help="Output file (ipal, optionally gzipped) or stdout if omitted",
     )
+    add_filter_arguments(parser)
     parser.add_argument(
-        "-m",
-        "--mode",
-        required=True,
-        choices=["packet-by-packet", "sequence-of-four"],
-        help="Should each packet be considered individually or should each sequence of four packets be considered one unit",
-    )
-    types_group = parser.add_mutually_exclusive_group()
-    types_group.add_argument(
-        "--except-types",
+        "-d",
+        "--dataset",
         nargs="*",
-        type=int,
-        help="Specify attack types to filter out (block list)",
-    )
-    types_group.add_argument(
-        "--only-types",
-        nargs="*",
-        type=int,
-        help="Specify the only attack types to keep (allow list)",
-    )
-    categories_group = parser.add_mutually_exclusive_group()
-    categories_group.add_argument(
-        "--except-categories",
-        nargs="*",
-        type=int,
-        help="Specify attack categories to filter out (block list)",
+        type=pathlib.Path,
+        help="Dataset parts (ipal, optionally gzipped) to join compact predictions with",
     )
-    categories_group.add_argument(
-        "--only-categories",
-        nargs="*",
-        type=int,
-        help="Specify the only attack categories to keep (allow list)",
+    parser.add_argument(
+        "--config",
+        nargs="+",
+        type=pathlib.Path,
+        help="Only keep the fields which the features of these IDS configs refer to "
+        "(optional)",
     )
     args = parser.parse_args()
 
+    sequence_len = 4 if args.mode == "sequence-of-four" else 1
+
+    if args.input_file is not None and args.input_file.suffix == ".npz":
+        if not args.dataset or args.output_file is None:
+            parser.error(
+                "compact predictions require the dataset parts (--dataset) "
+                "and an output file"
+            )
+        filtered, total = filter_predictions(args)
+        eprint(
+            f"Removed {(filtered/total*100):.2f}% ({filtered}/{total}) of total sequences"
+        )
+        return
+
     # Keep track of stats
     filtered = 0
     total = 0
+    projection = load_projection(args.config)
 
-    # Load data
+    # Stream data, sequences are read one at a time
     with open_file(
         args.input_file, "rt"
-    ) if args.input_file is not None else sys.stdin as f:
-        # skip empty lines
-        lines = [line for line in f.readlines() if line.strip()]
-
-    sequence_len = 4 if args.mode == "sequence-of-four" else 1
-    sequences = chunks(lines, sequence_len)
-
-    with (
+    ) if args.input_file is not None else sys.stdin as f_in, (
         open_file(args.output_file, "wt")
         if args.output_file is not None
         else sys.stdout
     ) as f:
+        # skip empty lines
+        sequences = chunked(full_lines(f_in), sequence_len)
         for sequence in sequences:
             remove = False
+            packets = [json.loads(entry) for entry in sequence]
 
-            for entry in sequence:
-                data = json.loads(entry)
+            for data in packets:
 
                 attack_category, attack_type = get_attack_details(data)
 
@@ -112,8 +144,12 @@ def main():
                 filtered += 1
             else:
                 # copy packets of sequence over
-                for entry in sequence:
-                    f.write(entry)
+                if projection is None:
+                    f.writelines(sequence)
+                    continue
+                for data in packets:
+                    f.write(json.dumps(projection.apply(data)))
+                    f.write("\n")
 
     eprint(
         f"Removed {(filtered/total*100):.2f}% ({filtered}/{total}) of total sequences"
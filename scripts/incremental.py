@@ -0,0 +1,261 @@
+"""
+Out-of-core training of classifiers whose train set does not fit into memory.
+
+The train set is streamed from its file in chunks of CHUNK_SIZE packets, which are
+converted into FeatureMatrix chunks (see features.py) and discarded after the classifier
+was updated with them. Hence, the memory is bounded by the chunk size, independent of the
+size of the train set. A first streaming pass counts the packets, which is needed for
+"trainon". Balanced class weights are based on the packets actually trained on, which are
+counted in another pass if "trainon" or missing features exclude some of them. Each
+further epoch reads the file again, so the train set must be a regular file and not a
+named pipe. A train set which is already in memory, e.g. assembled from the shared memory
+cache (see cache.py), is processed in the same chunks.
+
+Two classifiers are trained this way:
+- "SGD": a linear classifier (SGDClassifier, e.g. a linear SVM with the hinge loss) which
+  is updated with partial_fit() on each chunk
+- "BLSTM": the BLSTM of the BLSTM config, trained with mini-batches on the non-overlapping
+  sequences of each chunk
+
+Packets are shuffled within each chunk only. Unless the config sets "allow-none", the SGD
+skips packets with missing features like ipal-iids does, while the BLSTM replaces them and
+indicates them as features.
+"""
+
+import math
+import numpy as np
+from utils import eprint, open_file, chunked, read_packets
+from preprocessing import CHUNK_SIZE
+
+# IDS types trained out of core
+INCREMENTAL_TYPES = ["SGD", "BLSTM"]
+
+
+def count_labels(input_file):
+    """
+    Count the packets and the malicious packets of a train set in a streaming pass.
+    """
+    count = 0
+    malicious = 0
+    with open_file(input_file, "rt") as f:
+        for packet in read_packets(f):
+            count += 1
+            malicious += bool(packet["malicious"])
+    return count, malicious
+
+
+def stream_chunks(input_file, extractor, limit):
+    """
+    Yield the FeatureMatrix and labels of successive chunks of the first limit packets
+    of a train set.
+    """
+    with open_file(input_file, "rt") as f:
+        for chunk in chunked(read_packets(f), CHUNK_SIZE):
+            chunk = chunk[:limit]
+            if not chunk:
+                return
+            limit -= len(chunk)
+            yield (
+                extractor.transform(chunk),
+                np.array([p["malicious"] for p in chunk], dtype=bool),
+            )
+
+
+def matrix_chunks(X, y, limit):
+    """
+    Yield successive chunks of the first limit rows of a FeatureMatrix and labels held
+    in memory, like stream_chunks().
+    """
+    for start in range(0, min(limit, len(y)), CHUNK_SIZE):
+        rows = slice(start, min(start + CHUNK_SIZE, limit))
+        yield X.take(rows), y[rows]
+
+
+def count_trained_labels(chunks, allow_none):
+    """
+    Count the packets and the malicious packets which are actually trained on in a pass
+    over the chunks, i.e., without packets with missing features unless allow_none.
+    """
+    count = 0
+    malicious = 0
+    for (X, y) in chunks:
+        if not allow_none:
+            y = y[X.complete()]
+        count += len(y)
+        malicious += int(np.count_nonzero(y))
+    return count, malicious
+
+
+def balanced_weights(count, malicious):
+    """
+    Class weights like class_weight="balanced", which partial_fit() does not support.
+    """
+    return {
+        False: count / (2 * max(count - malicious, 1)),
+        True: count / (2 * max(malicious, 1)),
+    }
+
+
+class SequenceClassifier:
+    """
+    BLSTM classifying non-overlapping sequences of sequence_length packets. The output of
+    a sequence is assigned to all of its packets. The features listed by an
+    "indicate-none" preprocessor are extended by a flag whether they are missing, missing
+    values are replaced by 0.
+    """
+
+    def __init__(self, parameters, features, preprocessors, model=None):
+        import tensorflow as tf
+
+        self.sequence_length = parameters.get("sequence_length", 4)
+        assert (
+            parameters.get("step", self.sequence_length) == self.sequence_length
+        ), "Only non-overlapping sequences (step = sequence_length) are supported"
+        assert (
+            CHUNK_SIZE % self.sequence_length == 0
+        ), "Sequences must not cross chunk boundaries"
+        self.batch_size = parameters.get("batch_size", 32)
+        self.indicated = [
+            features.index(feature)
+            for preprocessor in preprocessors
+            if preprocessor["method"] == "indicate-none"
+            for feature in preprocessor["features"]
+        ]
+        self.classes_ = np.array([False, True])
+        if model is not None:
+            self.model = model
+            return
+
+        self.model = tf.keras.Sequential(
+            [
+                tf.keras.layers.Bidirectional(
+                    tf.keras.layers.LSTM(parameters.get("hidden_layer_size", 64)),
+                    input_shape=(
+                        self.sequence_length,
+                        len(features) + len(self.indicated),
+                    ),
+                ),
+                tf.keras.layers.Dropout(parameters.get("dropout", 0.0)),
+                tf.keras.layers.Dense(1, activation="sigmoid"),
+            ]
+        )
+        self.model.compile(
+            optimizer=tf.keras.optimizers.Adam(parameters.get("learning_rate", 1e-3)),
+            loss="binary_crossentropy",
+        )
+
+    def sequences(self, X):
+        """
+        Convert a FeatureMatrix into sequences (sequences x sequence_length x features).
+        The last sequence is padded by repeating its last packet.
+        """
+        dense = X.toarray(np.float32)
+        dense = np.concatenate(
+            [np.nan_to_num(dense), X.missing(self.indicated).astype(np.float32)], axis=1
+        )
+        padding = -len(dense) % self.sequence_length
+        if padding:
+            dense = np.concatenate([dense, np.repeat(dense[-1:], padding, axis=0)])
+        return dense.reshape(-1, self.sequence_length, dense.shape[1])
+
+    def partial_fit(self, X, y):
+        """
+        Train one pass of mini-batches over the sequences of a chunk. A sequence is
+        malicious if any of its packets is.
+        """
+        padding = -len(y) % self.sequence_length
+        labels = np.concatenate([y, np.repeat(y[-1:], padding)])
+        labels = labels.reshape(-1, self.sequence_length).any(axis=1)
+        self.model.fit(
+            self.sequences(X),
+            labels.astype(np.float32),
+            batch_size=self.batch_size,
+            epochs=1,
+            shuffle=True,
+            verbose=0,
+        )
+
+    def predict_proba(self, X):
+        scores = self.model.predict(self.sequences(X), verbose=0)[:, 0]
+        scores = np.repeat(scores.astype(np.float64), self.sequence_length)[: len(X)]
+        return np.stack([1 - scores, scores], axis=1)
+
+    def predict(self, X):
+        return self.predict_proba(X)[:, 1] > 0.5
+
+    def save(self, filepath):
+        self.model.save(filepath)
+
+    @classmethod
+    def load(cls, filepath, parameters, features, preprocessors):
+        """
+        Load a BLSTM saved by save() for the config it was trained with.
+        """
+        import tensorflow as tf
+
+        return cls(
+            parameters,
+            features,
+            preprocessors,
+            model=tf.keras.models.load_model(filepath),
+        )
+
+
+def train_incremental(
+    ids_config, parameters, train_file, extractor, matrix, train_set=None
+):
+    """
+    Train the classifier of an SGD or BLSTM config out of core. matrix converts a
+    FeatureMatrix chunk into the input of SGDClassifier.partial_fit(). If a train set
+    which is already in memory (FeatureMatrix and labels) is given, it is used in
+    chunks instead of train_file.
+    """
+    kind = ids_config["_type"]
+    epochs = ids_config.get("epochs", 1)
+    seed = parameters.get("random_state")
+
+    if train_set is None:
+        count, malicious = count_labels(train_file)
+        chunks = lambda limit: stream_chunks(train_file, extractor, limit)
+    else:
+        count, malicious = len(train_set[1]), int(np.count_nonzero(train_set[1]))
+        chunks = lambda limit: matrix_chunks(*train_set, limit)
+    limit = math.ceil(ids_config.get("trainon", 1.0) * count)
+    eprint(f"Train set: {count} packets ({malicious} malicious), training on {limit}")
+    allow_none = ids_config.get("allow-none", False)
+
+    if kind == "SGD":
+        from sklearn.linear_model import SGDClassifier
+
+        if parameters.get("class_weight") == "balanced":
+            # the weights are based on the packets actually trained on, which requires
+            # another pass unless all packets are
+            if limit < count or not allow_none:
+                count, malicious = count_trained_labels(chunks(limit), allow_none)
+            parameters = {
+                **parameters,
+                "class_weight": balanced_weights(count, malicious),
+            }
+        classifier = SGDClassifier(**parameters)
+    elif kind == "BLSTM":
+        classifier = SequenceClassifier(
+            parameters, ids_config["features"], ids_config.get("preprocessors", [])
+        )
+    else:
+        raise ValueError(f"Unsupported IDS type {kind} for out-of-core training")
+
+    rng = np.random.default_rng(seed)
+    for epoch in range(epochs):
+        for (X, y) in chunks(limit):
+            if kind == "SGD":
+                rows = rng.permutation(len(y))
+                if not allow_none:
+                    rows = rows[X.complete()[rows]]
+                classifier.partial_fit(
+                    matrix(X.take(rows)), y[rows], classes=np.array([False, True])
+                )
+            else:
+                # keep the sequences intact, they are shuffled by the BLSTM
+                classifier.partial_fit(X, y)
+        eprint(f"Epoch {epoch + 1}/{epochs} done")
+    return classifier
@@ -0,0 +1,75 @@
+"""
+Latency histogram with logarithmically spaced buckets.
+
+Recording a latency is O(1) and the memory footprint is independent of the number of
+recorded latencies, which makes the histogram suitable for long-running live pipelines.
+"""
+
+from math import log2, floor
+from tabulate import tabulate
+
+# number of buckets per power of two, i.e., bucket bounds grow by a factor 2^(1/4)
+SUBBUCKETS = 4
+
+
+class LatencyHistogram:
+    def __init__(self):
+        # counts[i] is the number of latencies in [2^(i/SUBBUCKETS), 2^((i+1)/SUBBUCKETS)) µs
+        self.counts = []
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def record(self, seconds):
+        microseconds = seconds * 1e6
+        index = floor(SUBBUCKETS * log2(microseconds)) if microseconds > 1 else 0
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """
+        Return an upper bound in seconds for the q-th percentile (0 <= q <= 100). The
+        bound is off by at most one bucket width.
+        """
+        if self.count == 0:
+            return float("nan")
+        threshold = q / 100 * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return min(2 ** ((index + 1) / SUBBUCKETS) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        if self.count == 0:
+            return "no latencies recorded"
+        return (
+            f"count: {self.count}, "
+            f"mean: {self.total / self.count * 1e3:.3f} ms, "
+            f"min: {self.min * 1e3:.3f} ms, "
+            f"p50: {self.percentile(50) * 1e3:.3f} ms, "
+            f"p99: {self.percentile(99) * 1e3:.3f} ms, "
+            f"p99.9: {self.percentile(99.9) * 1e3:.3f} ms, "
+            f"max: {self.max * 1e3:.3f} ms"
+        )
+
+    def table(self):
+        """
+        Return the histogram as table with one row per power of two.
+        """
+        rows = []
+        for start in range(0, len(self.counts), SUBBUCKETS):
+            count = sum(self.counts[start : start + SUBBUCKETS])
+            if count:
+                lower = 2 ** (start // SUBBUCKETS) if start else 0
+                upper = 2 ** (start // SUBBUCKETS + 1)
+                rows.append([f"{lower} - {upper}", count, count / self.count])
+        return tabulate(rows, headers=["latency [µs]", "count", "fraction"])
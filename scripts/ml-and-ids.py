@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Single entry point for the scripts of this repository, e.g.:
+
+    ml-and-ids.py filter -m packet-by-packet -i part-0.ipal.gz --except-types 3
+
+Each subcommand runs the main() of the corresponding script, whose module (and hence NumPy,
+tabulate, ...) is only imported when the subcommand is run.
+
+To avoid the interpreter and import startup for each invocation, a resident daemon can be
+started on a Unix socket:
+
+    ml-and-ids.py daemon -s /tmp/ml-and-ids.sock --preload ../dataset/part-*.ipal.gz &
+    export ML_AND_IDS_SOCKET=/tmp/ml-and-ids.sock
+
+The daemon imports all subcommands once and optionally keeps the given dataset parts in
+memory. While ML_AND_IDS_SOCKET is set, this script only acts as thin client: it passes its
+arguments, working directory and stdin/stdout/stderr to the daemon, which runs the
+subcommand in a forked (and hence already warm) process. If the socket does not exist, the
+subcommand runs locally.
+"""
+
+import array
+import json
+import os
+import signal
+import socket
+import sys
+import importlib.util
+
+SCRIPTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+COMMANDS = {
+    "transcribe": "transcribe-to-ipal.py",
+    "preprocess": "preprocess-dataset.py",
+    "prepare": "prepare-dataset.py",
+    "split": "split-dataset.py",
+    "filter": "filter-dataset.py",
+    "subsample": "subsample-dataset.py",
+    "decode": "decode-dataset.py",
+    "stats": "create-statistics.py",
+    "pack": "pack-predictions.py",
+    "aggregate": os.path.join("..", "experiments", "aggregate-results.py"),
+}
+SOCKET_VARIABLE = "ML_AND_IDS_SOCKET"
+
+_modules = {}
+
+
+def load_command(command):
+    """
+    Import the script of a subcommand as module without running it.
+    """
+    if command not in _modules:
+        path = os.path.join(SCRIPTS_FOLDER, COMMANDS[command])
+        name = os.path.basename(path)[:-3].replace("-", "_")
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[command] = module
+    return _modules[command]
+
+
+def run_command(command, args):
+    """
+    Run a subcommand in this process and return its exit code.
+    """
+    sys.argv = [f"{os.path.basename(sys.argv[0])} {command}", *args]
+    try:
+        load_command(command).main()
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    return 0
+
+
+def run_remote(socket_path, command, args):
+    """
+    Run a subcommand in the daemon listening on socket_path and return its exit code.
+    """
+    request = json.dumps({"command": command, "args": args, "cwd": os.getcwd()})
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        # pass stdin, stdout and stderr along with the request
+        connection.sendmsg(
+            [request.encode()],
+            [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [0, 1, 2]))],
+        )
+        connection.shutdown(socket.SHUT_WR)
+        response = connection.recv(16)
+    # an empty response means that the worker died
+    return int(response) if response else 1
+
+
+def _handle(connection):
+    """
+    Run the request of a client in a forked worker process.
+    """
+    fds = array.array("i")
+    message, ancdata, _, _ = connection.recvmsg(
+        65536, socket.CMSG_SPACE(3 * fds.itemsize)
+    )
+    chunks = [message]
+    while chunk := connection.recv(65536):
+        chunks.append(chunk)
+    request = json.loads(b"".join(chunks))
+    for (level, kind, data) in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - (len(data) % fds.itemsize)])
+
+    # take over the client's stdin, stdout and stderr and working directory
+    for (target, fd) in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(request["cwd"])
+
+    try:
+        code = run_command(request["command"], request["args"])
+    except BaseException:
+        import traceback
+
+        traceback.print_exc()
+        code = 1
+    finally:
+        # scripts may close stdout when done with it
+        for stream in [sys.stdout, sys.stderr]:
+            if not stream.closed:
+                stream.flush()
+    connection.sendall(str(code).encode())
+    return code
+
+
+def serve(socket_path, preload):
+    # workers are forked from this process and hence start with everything imported
+    for command in COMMANDS:
+        load_command(command)
+    if preload:
+        from utils import preload_files
+        from predictions import load_labels
+
+        preload_files(preload)
+        load_labels(preload)
+        print(f"Preloaded {len(preload)} dataset parts", file=sys.stderr)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    # finished workers are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Listening on {socket_path}", file=sys.stderr)
+
+    try:
+        while True:
+            connection, _ = server.accept()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            if os.fork() == 0:
+                code = 1
+                try:
+                    server.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    code = _handle(connection)
+                finally:
+                    os._exit(code)
+            connection.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+def main():
+    usage = (
+        f"Usage: {os.path.basename(sys.argv[0])} <command> [<args>]\n"
+        f"Commands: {', '.join(COMMANDS)}, daemon\n"
+        f"Run '<command> -h' for the arguments of a command.\n"
+        f"\n"
+        f"daemon -s <socket> [--preload <dataset part> ...]\n"
+        f"    Run subcommands of clients with {SOCKET_VARIABLE}=<socket> in warm processes"
+    )
+    if len(sys.argv) < 2 or sys.argv[1] not in [*COMMANDS, "daemon"]:
+        print(usage, file=sys.stderr)
+        sys.exit(0 if len(sys.argv) > 1 and sys.argv[1] in ["-h", "--help"] else 2)
+    command, args = sys.argv[1], sys.argv[2:]
+
+    if command == "daemon":
+        import argparse
+
+        parser = argparse.ArgumentParser(
+            prog=f"{os.path.basename(sys.argv[0])} daemon",
+            description="Run subcommands for clients in warm processes",
+        )
+        parser.add_argument(
+            "-s", "--socket", required=True, help="Path of the Unix socket to listen on"
+        )
+        parser.add_argument(
+            "--preload",
+            nargs="*",
+            default=[],
+            help="Dataset parts (ipal, optionally gzipped) to keep in memory",
+        )
+        daemon_args = parser.parse_args(args)
+        serve(daemon_args.socket, daemon_args.preload)
+        return
+
+    socket_path = os.environ.get(SOCKET_VARIABLE)
+    if socket_path and os.path.exists(socket_path):
+        sys.exit(run_remote(socket_path, command, args))
+    sys.exit(run_command(command, args))
+
+
+if __name__ == "__main__":
+    main()
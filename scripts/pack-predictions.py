@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+This script converts the IPAL output of an IDS into compact predictions: the packet ids,
+the bit-packed "ids" flags and optionally the scores. The attack details are joined back
+from the dataset parts when creating statistics or filtering (see predictions.py).
+"""
+
+import argparse
+import pathlib
+import sys
+from utils import open_file, read_packets
+from predictions import pack_predictions, save_predictions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Store the predictions of an IDS IPAL output in compact form"
+    )
+    parser.add_argument(
+        "-i",
+        "--input-file",
+        type=pathlib.Path,
+        help="Input file (ipal, optionally gzipped) or stdin if omitted",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-file",
+        required=True,
+        type=pathlib.Path,
+        help="Output file (npz)",
+    )
+    parser.add_argument(
+        "--scores",
+        action="store_true",
+        help="Also store the scores of the IDS",
+    )
+    args = parser.parse_args()
+
+    with open_file(
+        args.input_file, "rt"
+    ) if args.input_file is not None else sys.stdin as f:
+        ids, flags, scores = pack_predictions(read_packets(f), args.scores)
+
+    save_predictions(args.output_file, ids, flags, scores)
+
+
+if __name__ == "__main__":
+    main()
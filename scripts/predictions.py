@@ -0,0 +1,143 @@
+"""
+Compact storage of IDS predictions.
+
+Instead of a full copy of the test set with an added "ids" field, only the ids of the
+packets (as a range if they are consecutive), the bit-packed "ids" flags and optionally
+the scores are stored in a NumPy .npz archive. The attack details needed for statistics
+and filtering are joined back from the dataset parts via the "id" field.
+"""
+
+import json
+import os
+import numpy as np
+from pathlib import Path
+from utils import open_file, get_attack_details
+
+
+def pack_predictions(packets, with_scores=False):
+    """
+    Extract ids, "ids" flags and (optionally) scores from IPAL packets of an IDS output.
+    """
+    ids = []
+    flags = []
+    scores = []
+    for p in packets:
+        ids.append(p["id"])
+        flags.append(p["ids"])
+        if with_scores:
+            # ipal-iids stores the score of each IDS in a dict, we only use one IDS
+            scores.append(next(iter(p["scores"].values())) if p.get("scores") else 0)
+
+    return (
+        np.array(ids, dtype=np.int64),
+        np.array(flags, dtype=bool),
+        np.array(scores, dtype=np.float32) if with_scores else None,
+    )
+
+
+def save_predictions(filepath, ids, flags, scores=None):
+    data = {"count": len(flags), "ids": np.packbits(flags)}
+
+    # store consecutive ids as range
+    if len(ids) > 0 and np.array_equal(ids, np.arange(ids[0], ids[0] + len(ids))):
+        data["id_range"] = np.array([ids[0], ids[0] + len(ids)])
+    else:
+        data["id"] = ids.astype(np.uint32)
+
+    if scores is not None:
+        data["scores"] = scores
+
+    with open(filepath, "wb") as f:
+        np.savez_compressed(f, **data)
+
+
+def load_predictions(filepath):
+    """
+    Load predictions saved with save_predictions(). Returns ids, flags and scores
+    (None if not stored).
+    """
+    with np.load(filepath) as data:
+        count = int(data["count"])
+        flags = np.unpackbits(data["ids"], count=count).astype(bool)
+        if "id_range" in data:
+            ids = np.arange(*data["id_range"])
+        else:
+            ids = data["id"].astype(np.int64)
+        scores = data["scores"] if "scores" in data else None
+    return ids, flags, scores
+
+
+# labels of dataset parts loaded in this process, keyed by path and modification time
+_labels = {}
+
+
+def _part_labels(part_file):
+    """
+    Return ids, attack categories and attack types of a dataset part. They are cached
+    next to the part in "<part>.labels.npz" and in memory.
+    """
+    key = (part_file.resolve(), part_file.stat().st_mtime)
+    if key not in _labels:
+        _labels[key] = _load_part_labels(part_file)
+    return _labels[key]
+
+
+def _load_part_labels(part_file):
+    cache_file = part_file.with_name(part_file.name + ".labels.npz")
+    if cache_file.exists() and cache_file.stat().st_mtime >= part_file.stat().st_mtime:
+        with np.load(cache_file) as data:
+            return data["id"], data["category"], data["type"]
+
+    ids = []
+    categories = []
+    types = []
+    with open_file(part_file, "rt") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            packet = json.loads(line)
+            attack_category, attack_type = get_attack_details(packet)
+            ids.append(packet["id"])
+            categories.append(attack_category)
+            types.append(attack_type)
+
+    labels = (
+        np.array(ids, dtype=np.int64),
+        np.array(categories, dtype=np.int8),
+        np.array(types, dtype=np.int8),
+    )
+    # concurrent jobs may read the cache while it is written, so it is replaced atomically
+    temporary = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    with open(temporary, "wb") as f:
+        np.savez(f, id=labels[0], category=labels[1], type=labels[2])
+    os.replace(temporary, cache_file)
+    return labels
+
+
+def load_labels(dataset_files):
+    """
+    Load the attack categories and types of all packets in the given dataset parts.
+    Returns two arrays indexed by packet id, -1 marks ids not in the dataset.
+    """
+    part_labels = [_part_labels(Path(f)) for f in dataset_files]
+    size = max(
+        (int(ids.max()) + 1 for (ids, _, _) in part_labels if len(ids)), default=0
+    )
+
+    categories = np.full(size, -1, dtype=np.int8)
+    types = np.full(size, -1, dtype=np.int8)
+    for (ids, part_categories, part_types) in part_labels:
+        categories[ids] = part_categories
+        types[ids] = part_types
+    return categories, types
+
+
+def join_labels(ids, dataset_files):
+    """
+    Look up the attack categories and types of the packets with the given ids.
+    """
+    categories, types = load_labels(dataset_files)
+    assert len(ids) == 0 or (
+        ids.max() < len(categories) and (categories[ids] >= 0).all()
+    ), "Predictions contain packet ids which are not part of the given dataset"
+    return categories[ids].astype(np.int64), types[ids].astype(np.int64)
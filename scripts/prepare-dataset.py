@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+This script prepares the source dataset in a single process. It combines the following
+steps, which otherwise pass the dataset between separate scripts through intermediate files:
+1. Transcribing the Arff dataset to IPAL (see transcribe-to-ipal.py)
+2. Preprocessing features and adding cached state (see preprocess-dataset.py)
+3. Skipping the first packets with incomplete state
+4. Shuffling and splitting it into parts of equal size (see split-dataset.py)
+
+The parts are written gzip-compressed. For the same seed, their content is identical to the
+result of running the individual scripts. With --encoding compact, the parts are written in
+the compact encoding (see encoding.py), in which each sequence of four starts with a
+keyframe. With --config, the parts only hold the fields which the features of the given IDS
+configs refer to (see Projection in preprocessing.py).
+"""
+
+import argparse
+import numpy as np
+from pathlib import Path
+from utils import open_file, chunks, random_partition
+from transcription import read_arff_columns
+from preprocessing import (
+    CHUNK_SIZE,
+    ValueCollector,
+    transform_chunk,
+    serialize_with_state,
+    save_parameters,
+    load_projection,
+)
+from encoding import CompactEncoder, KEYFRAME_INTERVAL
+
+# the first 4 packets are always skipped due to incomplete state
+SKIPPED_PACKETS = 4
+
+
+def preprocessed_lines(
+    packet_chunks, norm_parameters, cat_parameters, encoder=None, projection=None
+):
+    cached_state = {}
+    offset = 0
+
+    for chunk in packet_chunks:
+        transform_chunk(chunk, norm_parameters, cat_parameters, projection=projection)
+        for line in serialize_with_state(
+            chunk, cached_state, offset, encoder, projection
+        ):
+            yield line + "\n"
+        offset += len(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transcribe, preprocess and split MorrisDS4 dataset in one pass"
+    )
+    parser.add_argument(
+        "input_file",
+        type=Path,
+        help="Input arff file in plain text or gzip format",
+    )
+    parser.add_argument(
+        "-d",
+        "--output-directory",
+        type=Path,
+        default=Path.cwd(),
+        help="Output folder (defaults to working directory)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-prefix",
+        type=str,
+        default="part-",
+        help="Prefix for names of output files (defaults to 'part-')",
+    )
+    parser.add_argument(
+        "-n",
+        "--part-count",
+        default=5,
+        type=int,
+        help="Number of parts the dataset should be split into (defaults to 5)",
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        default="sequence-of-four",
+        choices=["packet-by-packet", "sequence-of-four"],
+        help="Which splitting mode should be used (defaults to sequence-of-four)",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        help="Seed for shuffling to make the split reproducible (optional)",
+    )
+    parser.add_argument(
+        "-p",
+        "--parameters-file",
+        type=Path,
+        help="Save the normalization and categorical parameters to this file (optional)",
+    )
+    parser.add_argument(
+        "-e",
+        "--encoding",
+        default="full",
+        choices=["full", "compact"],
+        help="Encoding of the parts (see encoding.py, defaults to full)",
+    )
+    parser.add_argument(
+        "--config",
+        nargs="+",
+        type=Path,
+        help="Only keep the fields which the features of these IDS configs refer to "
+        "(optional)",
+    )
+    args = parser.parse_args()
+
+    if args.encoding == "compact" and args.mode != "sequence-of-four":
+        parser.error("--encoding compact requires mode sequence-of-four")
+
+    if args.seed is not None:
+        np.random.seed(args.seed)
+
+    # transcribe and collect the values for normalizing and categoricalizing
+    packets = []
+    collector = ValueCollector()
+    with open_file(args.input_file, "rt") as f_in:
+        for block in read_arff_columns(f_in, CHUNK_SIZE):
+            chunk = block.to_packets()
+            collector.update(chunk)
+            packets.extend(chunk)
+
+    norm_parameters, cat_parameters = collector.parameters()
+    if args.parameters_file is not None:
+        save_parameters(args.parameters_file, norm_parameters, cat_parameters)
+
+    # preprocess, skip packets with incomplete state and keep the serialized packets
+    encoder = CompactEncoder(cat_parameters) if args.encoding == "compact" else None
+    lines = list(
+        preprocessed_lines(
+            chunks(packets, CHUNK_SIZE),
+            norm_parameters,
+            cat_parameters,
+            encoder,
+            load_projection(args.config),
+        )
+    )
+    # keep the sequences aligned with the keyframes
+    assert SKIPPED_PACKETS % KEYFRAME_INTERVAL == 0
+    del lines[:SKIPPED_PACKETS]
+    del packets
+
+    # create chunks depending on mode and split
+    sequence_len = 4 if args.mode == "sequence-of-four" else 1
+    sequences = list(chunks(lines, sequence_len))
+    parts = random_partition(len(sequences), args.part_count)
+
+    print(f"Part lengths: {','.join([str(len(part)) for part in parts])}")
+
+    for i, part in enumerate(parts):
+        with open_file(
+            args.output_directory / f"{args.output_prefix}{i}.ipal.gz", "wt"
+        ) as f:
+            for seq_index in part:
+                f.writelines(sequences[seq_index])
+
+
+if __name__ == "__main__":
+    main()
@@ -5,46 +5,232 @@ This script prepares a dataset in IPAL format. This includes the following activ
 - Performing categorical preprocessing on some data fields (essentially one-hot encoding)
 - Adding system state to every packet using the "keep-last" method
 - Adding an "id" field to each packet which corresponds to its position in the original dataset
+
+The normalization and categorical parameters are computed from the input itself by default
+(mode "fit-transform"), which requires two passes over the whole input. Alternatively, they
+can be computed and saved to a parameters file once (mode "fit") and then applied to other
+inputs in a single streaming pass (mode "transform").
+
+With --checkpoint-file, a checkpoint of the output is saved in addition (see
+save_checkpoint() in preprocessing.py). New packets can then be appended to the output with
+mode "append", which continues the ids and the cached state and applies the parameters of
+the checkpoint. Hence, the cost of an append only depends on the new packets. The parameters
+are not changed by appending; the checkpoint accumulates the statistics of the new packets
+and reports how far the parameters of the whole dataset have drifted. Re-normalizing the
+whole dataset has to be requested explicitly by running mode "transform" with --refit on the
+complete input, which takes a single streaming pass using the accumulated parameters.
+
+With --jobs, an uncompressed input file is split into contiguous chunks which are processed
+in parallel. The output is identical to the serial run.
+
+With --encoding compact, the output omits the one-hot keys and only holds the changes of
+the state between keyframes (see encoding.py), which makes it several times smaller. The
+scripts of this repository read both encodings, decode-dataset.py converts compact files
+back to the full format. Appending keeps the encoding of the checkpoint.
+
+With --config, only the fields which the features of the given IDS configs refer to are
+transformed and written, along with the labels, the id and the timestamp (see Projection in
+preprocessing.py). E.g. the RF and SVM configs only read the state of src 4 and a few
+top-level fields. Appending keeps the projection of the checkpoint.
 """
 
 import argparse
 import pathlib
-import json
-import numpy as np
 import sys
-from utils import open_file
-from itertools import chain
+from utils import eprint, open_file, chunks, chunked, read_packets
+from preprocessing import (
+    CHUNK_SIZE,
+    ValueCollector,
+    transform_chunk,
+    serialize_with_state,
+    save_parameters,
+    load_parameters,
+    save_checkpoint,
+    load_checkpoint,
+    merge_moments,
+    refit_parameters,
+    ParallelPreprocessor,
+    Projection,
+    load_projection,
+)
+from encoding import CompactEncoder
+
+
+def write_transformed(
+    packet_chunks,
+    f_out,
+    norm_parameters,
+    cat_parameters,
+    unknown,
+    cached_state=None,
+    first_id=0,
+    collector=None,
+    encoding="full",
+    projection=None,
+):
+    """
+    Transform and write the packets, given as successive chunks, to f_out.
+
+    The packets are written as continuation of packets whose cached state and next id
+    are given. If a collector is given, the values of the packets are collected before
+    transforming them. Returns the cached state after the last packet and the id of the
+    last packet.
+    """
+    cached_state = dict(cached_state or {})
+    offset = first_id
+    encoder = CompactEncoder(cat_parameters) if encoding == "compact" else None
+
+    for chunk in packet_chunks:
+        if collector is not None:
+            collector.update(chunk)
+        transform_chunk(
+            chunk, norm_parameters, cat_parameters, unknown, projection=projection
+        )
+
+        # copy packets over
+        for line in serialize_with_state(
+            chunk, cached_state, offset, encoder, projection
+        ):
+            f_out.write(line)
+            f_out.write("\n")
+
+        offset += len(chunk)
+
+    return cached_state, offset - 1
 
 
-# the keys of the arguments to be normalized
-normalize_args = [
-    "data;PID Setpoint",
-    "data;PID Gain",
-    "data;PID Reset",
-    "data;PID Deadband",
-    "data;PID Cycle Time",
-    "data;PID Rate",
-    # We do not normalize pressure in accordance with the original dataset
-    # "data;Scaled Gas Pressure",
-    "crc",
-    "length",
-    "timestamp",
-]
-categoricalize_args = ["type", "data;system mode"]
+def create_checkpoint(
+    norm_parameters,
+    cat_parameters,
+    collector,
+    cached_state,
+    last_id,
+    encoding,
+    projection,
+):
+    return {
+        "norm_parameters": norm_parameters,
+        "cat_parameters": cat_parameters,
+        "moments": collector.moments(),
+        "cat_values": collector.cat_values,
+        "cached_state": cached_state,
+        "last_id": last_id,
+        "encoding": encoding,
+        "features": projection.features if projection is not None else None,
+    }
 
 
-def getkey(data, key):
-    if key.startswith("data;"):
-        return data["data"][key[5:]] if key[5:] in data["data"] else None
-    else:
-        return data[key] if key in data else None
+def update_checkpoint(checkpoint, collector, cached_state, last_id):
+    """
+    Add the values of the appended packets to the checkpoint and report how far the
+    parameters of the whole dataset have drifted from the applied ones.
+    """
+    checkpoint["moments"] = merge_moments(checkpoint["moments"], collector.moments())
+    for (arg, values) in collector.cat_values.items():
+        checkpoint["cat_values"][arg].update(values)
+    checkpoint["cached_state"] = cached_state
+    eprint(
+        f"Appended {last_id - checkpoint['last_id']} packets "
+        f"(ids {checkpoint['last_id'] + 1} to {last_id})"
+    )
+    checkpoint["last_id"] = last_id
+
+    norm_parameters, cat_parameters = refit_parameters(checkpoint)
+    shifts = {
+        arg: abs(p["mean"] - checkpoint["norm_parameters"][arg]["mean"])
+        / checkpoint["norm_parameters"][arg]["std"]
+        for (arg, p) in norm_parameters.items()
+        if checkpoint["norm_parameters"][arg]["std"] > 0
+    }
+    unseen = {
+        arg: [val for val in values if val not in checkpoint["cat_parameters"][arg]]
+        for (arg, values) in cat_parameters.items()
+    }
+    if shifts:
+        arg = max(shifts, key=shifts.get)
+        eprint(f"Largest drift of a normalized mean: {shifts[arg]:.3g} stds ({arg})")
+    for (arg, values) in unseen.items():
+        if values:
+            eprint(f"Categorical values without one-hot keys for '{arg}': {values}")
+
+
+def parameters_for(args):
+    """
+    Load the parameters of mode "transform", refitted if requested.
+    """
+    if args.refit:
+        return refit_parameters(load_checkpoint(args.parameters_file))
+    return load_parameters(args.parameters_file)
+
+
+def checkpoint_projection(checkpoint):
+    if checkpoint["features"] is None:
+        return None
+    return Projection(checkpoint["features"])
+
 
+def run_parallel(args):
+    with ParallelPreprocessor(args.input_file, args.jobs) as preprocessor:
+        checkpoint = None
+        projection = load_projection(args.config)
+        cached_state, first_id = None, 0
+        if args.mode == "append":
+            checkpoint = load_checkpoint(args.checkpoint_file)
+            norm_parameters = checkpoint["norm_parameters"]
+            cat_parameters = checkpoint["cat_parameters"]
+            cached_state = checkpoint["cached_state"]
+            first_id = checkpoint["last_id"] + 1
+            args.encoding = checkpoint["encoding"]
+            projection = checkpoint_projection(checkpoint)
+        elif args.mode == "transform":
+            norm_parameters, cat_parameters = parameters_for(args)
+        else:
+            collector = preprocessor.collect()
+            norm_parameters, cat_parameters = collector.parameters()
+            if args.parameters_file is not None:
+                save_parameters(args.parameters_file, norm_parameters, cat_parameters)
+            if args.mode == "fit":
+                return
+        if args.checkpoint_file is not None and args.mode != "fit-transform":
+            collector = preprocessor.collect()
 
-def setkey(data, key, value):
-    if key.startswith("data;"):
-        data["data"][key[5:]] = value
-    else:
-        data[key] = value
+        # the chunks are compressed by the workers
+        compress = args.output_file is not None and args.output_file.suffix == ".gz"
+        with (
+            open(args.output_file, "ab" if args.mode == "append" else "wb")
+            if args.output_file is not None
+            else sys.stdout.buffer
+        ) as f_out:
+            for data in preprocessor.transform(
+                norm_parameters,
+                cat_parameters,
+                args.unknown_categories,
+                compress,
+                cached_state,
+                first_id,
+                args.encoding,
+                projection,
+            ):
+                f_out.write(data)
+
+        if checkpoint is not None:
+            update_checkpoint(
+                checkpoint, collector, preprocessor.cached_state, preprocessor.last_id
+            )
+            save_checkpoint(args.checkpoint_file, checkpoint)
+        elif args.checkpoint_file is not None:
+            save_checkpoint(
+                args.checkpoint_file,
+                create_checkpoint(
+                    norm_parameters,
+                    cat_parameters,
+                    collector,
+                    preprocessor.cached_state,
+                    preprocessor.last_id,
+                    args.encoding,
+                    projection,
+                ),
+            )
 
 
 def main():
@@ -54,89 +240,204 @@ def main():
     parser.add_argument(
         "-i",
         "--input-file",
-        required=True,
         type=pathlib.Path,
         help="Input file (ipal, optionally gzipped) or stdin if omitted",
     )
     parser.add_argument(
         "-o",
         "--output-file",
-        required=True,
         type=pathlib.Path,
         help="Output file (ipal, optionally gzipped) or stdout if omitted",
     )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        default="fit-transform",
+        choices=["fit-transform", "fit", "transform", "append"],
+        help="Compute the parameters from the input and apply them (default), only "
+        "compute and save them, apply previously saved parameters or append the input "
+        "to the output described by a checkpoint",
+    )
+    parser.add_argument(
+        "-p",
+        "--parameters-file",
+        type=pathlib.Path,
+        help="Parameters file (json) to save the parameters to (fit, fit-transform) "
+        "or load them from (transform)",
+    )
+    parser.add_argument(
+        "-c",
+        "--checkpoint-file",
+        type=pathlib.Path,
+        help="Checkpoint file (json) to save after writing the output (fit-transform, "
+        "transform) or to continue from and update (append)",
+    )
+    parser.add_argument(
+        "--refit",
+        action="store_true",
+        help="In mode transform, re-normalize with the parameters accumulated in the "
+        "checkpoint given as --parameters-file, which includes all appended packets",
+    )
+    parser.add_argument(
+        "--unknown-categories",
+        default="ignore",
+        choices=["ignore", "error"],
+        help="How to handle categorical values not seen during fit: set all of their "
+        "one-hot keys to false (default) or abort",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="Number of parallel processes (requires an uncompressed input file)",
+    )
+    parser.add_argument(
+        "-e",
+        "--encoding",
+        default="full",
+        choices=["full", "compact"],
+        help="Write the complete state and one-hot keys into every packet (default) or "
+        "only the changes of the state and the categorical values (see encoding.py). "
+        "Mode append keeps the encoding of the checkpoint",
+    )
+    parser.add_argument(
+        "--config",
+        nargs="+",
+        type=pathlib.Path,
+        help="Only keep the fields which the features of these IDS configs refer to "
+        "(optional). Mode append keeps the projection of the checkpoint",
+    )
     args = parser.parse_args()
 
+    if args.mode in ["fit", "transform"] and args.parameters_file is None:
+        parser.error(f"--parameters-file is required in mode '{args.mode}'")
+    if args.mode == "append" and args.checkpoint_file is None:
+        parser.error("--checkpoint-file is required in mode 'append'")
+    if args.mode == "fit" and args.checkpoint_file is not None:
+        parser.error("--checkpoint-file requires an output")
+    if args.refit and args.mode != "transform":
+        parser.error("--refit is only supported in mode 'transform'")
+    if args.config and args.mode in ["fit", "append"]:
+        parser.error(f"--config is not supported in mode '{args.mode}'")
+
+    if args.jobs > 1:
+        if args.input_file is None or args.input_file.suffix == ".gz":
+            parser.error("--jobs requires an uncompressed input file")
+        run_parallel(args)
+        return
+
+    if args.mode == "fit":
+        # a single pass suffices to collect the values
+        collector = ValueCollector()
+        with (
+            open_file(args.input_file, "rt")
+            if args.input_file is not None
+            else sys.stdin
+        ) as f_in:
+            for chunk in chunked(read_packets(f_in), CHUNK_SIZE):
+                collector.update(chunk)
+
+        save_parameters(args.parameters_file, *collector.parameters())
+        return
+
     # Open file handles
     f_in = (
         open_file(args.input_file, "rt") if args.input_file is not None else sys.stdin
     )
     f_out = (
-        open_file(args.output_file, "wt")
+        open_file(args.output_file, "at" if args.mode == "append" else "wt")
         if args.output_file is not None
         else sys.stdout
     )
 
     with f_in, f_out:
+        if args.mode in ["transform", "append"]:
+            if args.mode == "append":
+                checkpoint = load_checkpoint(args.checkpoint_file)
+                norm_parameters = checkpoint["norm_parameters"]
+                cat_parameters = checkpoint["cat_parameters"]
+                cached_state = checkpoint["cached_state"]
+                first_id = checkpoint["last_id"] + 1
+                args.encoding = checkpoint["encoding"]
+                projection = checkpoint_projection(checkpoint)
+            else:
+                norm_parameters, cat_parameters = parameters_for(args)
+                cached_state, first_id = None, 0
+                projection = load_projection(args.config)
+            collector = ValueCollector() if args.checkpoint_file is not None else None
+
+            # single streaming pass
+            cached_state, last_id = write_transformed(
+                chunked(read_packets(f_in), CHUNK_SIZE),
+                f_out,
+                norm_parameters,
+                cat_parameters,
+                args.unknown_categories,
+                cached_state,
+                first_id,
+                collector,
+                args.encoding,
+                projection,
+            )
+
+            if args.mode == "append":
+                update_checkpoint(checkpoint, collector, cached_state, last_id)
+                save_checkpoint(args.checkpoint_file, checkpoint)
+            elif collector is not None:
+                save_checkpoint(
+                    args.checkpoint_file,
+                    create_checkpoint(
+                        norm_parameters,
+                        cat_parameters,
+                        collector,
+                        cached_state,
+                        last_id,
+                        args.encoding,
+                        projection,
+                    ),
+                )
+            return
+
         # skip empty lines
-        packets = [json.loads(line) for line in f_in.readlines() if line.strip()]
-
-        # save all values for each arg for normalizing and categoricalizing
-        keys_to_save = list(chain(normalize_args, categoricalize_args))
-        values = {arg: [] for arg in keys_to_save}
-
-        # first pass to populate the values array
-        for p in packets:
-            for arg in keys_to_save:
-                val = getkey(p, arg)
-                if val is not None:
-                    values[arg].append(val)
-
-        # calculate means and stds
-        norm_parameters = {
-            arg: {"mean": np.mean(values[arg]), "std": np.std(values[arg])}
-            for arg in normalize_args
-        }
-        cat_parameters = {
-            arg: {val: f"{arg}_{val}" for val in list(set(values[arg]))}
-            for arg in categoricalize_args
-        }
-
-        # second pass to add state and complete normalization
-        cached_state = {}
-
-        for i, p in enumerate(packets):
-            # apply normalization
-            for arg in normalize_args:
-                val = getkey(p, arg)
-                if val is not None:
-                    setkey(
-                        p,
-                        arg,
-                        (val - norm_parameters[arg]["mean"])
-                        / norm_parameters[arg]["std"],
-                    )
-
-            # apply categoricalization
-            for arg in categoricalize_args:
-                val = getkey(p, arg)
-                # only add the keys if the data-arg is present
-                if val is not None:
-                    keys = cat_parameters[arg]
-                    for (value, strkey) in cat_parameters[arg].items():
-                        setkey(p, strkey, value == val)
-
-            # apply state caching
-            for (key, value) in p["data"].items():
-                cached_state[f"{p['src']}:{key}"] = value
-            p["state"] = cached_state
-
-            # add index as id
-            p["id"] = i
-
-            # copy packet over
-            f_out.write(json.dumps(p))
-            f_out.write("\n")
+        packets = list(read_packets(f_in))
+
+        # first pass to collect the values of each arg for normalizing and
+        # categoricalizing
+        collector = ValueCollector()
+        for chunk in chunks(packets, CHUNK_SIZE):
+            collector.update(chunk)
+
+        # calculate means, stds and categorical values
+        norm_parameters, cat_parameters = collector.parameters()
+        if args.parameters_file is not None:
+            save_parameters(args.parameters_file, norm_parameters, cat_parameters)
+
+        # second pass to complete normalization and add state
+        projection = load_projection(args.config)
+        cached_state, last_id = write_transformed(
+            chunks(packets, CHUNK_SIZE),
+            f_out,
+            norm_parameters,
+            cat_parameters,
+            args.unknown_categories,
+            encoding=args.encoding,
+            projection=projection,
+        )
+
+        if args.checkpoint_file is not None:
+            save_checkpoint(
+                args.checkpoint_file,
+                create_checkpoint(
+                    norm_parameters,
+                    cat_parameters,
+                    collector,
+                    cached_state,
+                    last_id,
+                    args.encoding,
+                    projection,
+                ),
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,628 @@
+"""
+Shared preprocessing logic for the MorrisDS4 dataset in IPAL format.
+
+Normalization and categorical preprocessing are applied column-wise: for each chunk of
+packets, the values of a field are gathered into a NumPy array together with a mask
+marking the packets in which the field is present (i.e., not None). The transformed
+columns are then written back into the packets.
+"""
+
+import gzip
+import json
+import os
+import re
+import numpy as np
+from multiprocessing import Pool
+from utils import eprint
+from encoding import CompactEncoder
+
+# the keys of the arguments to be normalized
+normalize_args = [
+    "data;PID Setpoint",
+    "data;PID Gain",
+    "data;PID Reset",
+    "data;PID Deadband",
+    "data;PID Cycle Time",
+    "data;PID Rate",
+    # We do not normalize pressure in accordance with the original dataset
+    # "data;Scaled Gas Pressure",
+    "crc",
+    "length",
+    "timestamp",
+]
+categoricalize_args = ["type", "data;system mode"]
+
+# top-level fields kept by every projection: the labels, the id and the timestamp, which
+# is read by ipal-iids
+projected_fields = ["timestamp", "malicious", "attack-details", "id"]
+
+# number of packets which are transformed at once
+CHUNK_SIZE = 65536
+
+
+def getkey(data, key):
+    if key.startswith("data;"):
+        return data["data"][key[5:]] if key[5:] in data["data"] else None
+    else:
+        return data[key] if key in data else None
+
+
+def setkey(data, key, value):
+    if key.startswith("data;"):
+        data["data"][key[5:]] = value
+    else:
+        data[key] = value
+
+
+def _containers(packets, key):
+    """
+    Return the dicts of packets holding the given key and the name of the key inside
+    of them.
+    """
+    if key.startswith("data;"):
+        return [p["data"] for p in packets], key[5:]
+    else:
+        return packets, key
+
+
+def extract_column(packets, key):
+    """
+    Gather the values of key in packets.
+
+    Returns the list of present values and a boolean mask over packets which marks
+    the packets in which the value is present.
+    """
+    containers, name = _containers(packets, key)
+    values = [c.get(name) for c in containers]
+    mask = np.fromiter((v is not None for v in values), dtype=bool, count=len(values))
+    return [v for v in values if v is not None], mask
+
+
+class Projection:
+    """
+    The fields of the packets which the features of IDS configs refer to. Projecting a
+    packet keeps only these fields (and projected_fields) of the packet, its data and its
+    state. Of one-hot flags, the categorical value is kept as well.
+    """
+
+    def __init__(self, features):
+        self.features = sorted(set(features))
+        self.fields = set(projected_fields)
+        self.data = set()
+        self.state = set()
+        categorical = {arg.split(";")[-1] for arg in categoricalize_args}
+        for feature in self.features:
+            if feature.startswith("state;"):
+                keys, name = self.state, feature[6:]
+            elif feature.startswith("data;"):
+                keys, name = self.data, feature[5:]
+            else:
+                keys, name = self.fields, feature
+            keys.add(name)
+            match = re.match(r"^(.*)_(-?\d+)$", name)
+            if match is not None and match.group(1).split(":")[-1] in categorical:
+                keys.add(match.group(1))
+        # the data fields the projected state entries are cached from
+        self.state_names = {key.partition(":")[2] for key in self.state}
+
+    def needs(self, arg):
+        """
+        Return whether the projection contains a normalized or categorical field.
+        """
+        if arg.startswith("data;"):
+            return arg[5:] in self.data or arg[5:] in self.state_names
+        return arg in self.fields
+
+    def apply(self, packet, state=True):
+        """
+        Return the projection of a packet. Its state is taken as it is if state is
+        False, e.g. if it was cached from projected entries only.
+        """
+        projected = {}
+        for (key, value) in packet.items():
+            if key == "data":
+                projected[key] = {k: v for (k, v) in value.items() if k in self.data}
+            elif key == "state" and state:
+                projected[key] = {k: v for (k, v) in value.items() if k in self.state}
+            elif key in self.fields or key == "state":
+                projected[key] = value
+        return projected
+
+
+def load_projection(config_files):
+    """
+    Return the Projection of the features of the given IDS configs or None if no
+    config is given.
+    """
+    if not config_files:
+        return None
+    features = []
+    for config_file in config_files:
+        with open(config_file, "r") as f:
+            for ids_config in json.load(f).values():
+                features.extend(ids_config["features"])
+    return Projection(features)
+
+
+class ValueCollector:
+    """
+    Collects the values of all normalized and categorical fields chunk by chunk. This
+    corresponds to the first pass over the dataset.
+
+    Collectors of consecutive chunks of a dataset can be merged, which results in the
+    same parameters as collecting all values with one collector.
+    """
+
+    def __init__(self):
+        self.norm_values = {arg: [] for arg in normalize_args}
+        # categorical values in the order of their first occurrence
+        self.cat_values = {arg: {} for arg in categoricalize_args}
+        self.packet_count = 0
+
+    def update(self, packets):
+        for arg in normalize_args:
+            present, _ = extract_column(packets, arg)
+            if present:
+                self.norm_values[arg].append(np.array(present))
+        for arg in categoricalize_args:
+            present, _ = extract_column(packets, arg)
+            self.cat_values[arg].update(dict.fromkeys(present))
+        self.packet_count += len(packets)
+
+    def merge(self, other):
+        """
+        Add the values collected by other, which must stem from the chunk following
+        the chunks collected so far.
+        """
+        for arg in normalize_args:
+            self.norm_values[arg].extend(other.norm_values[arg])
+        for arg in categoricalize_args:
+            self.cat_values[arg].update(other.cat_values[arg])
+        self.packet_count += other.packet_count
+
+    def parameters(self):
+        """
+        Calculate the normalization and categorical parameters from the collected
+        values.
+        """
+        norm_parameters = {}
+        for arg in normalize_args:
+            values = (
+                np.concatenate(self.norm_values[arg]) if self.norm_values[arg] else []
+            )
+            norm_parameters[arg] = {"mean": np.mean(values), "std": np.std(values)}
+
+        return norm_parameters, _cat_parameters(self.cat_values)
+
+    def moments(self):
+        """
+        Summarize the collected values of each normalized field by their count, mean
+        and sum of squared deviations from the mean (see merge_moments()).
+        """
+        moments = {}
+        for arg in normalize_args:
+            values = (
+                np.concatenate(self.norm_values[arg]) if self.norm_values[arg] else []
+            )
+            mean = float(np.mean(values)) if len(values) else 0.0
+            moments[arg] = {
+                "count": len(values),
+                "mean": mean,
+                "m2": float(np.sum((np.asarray(values) - mean) ** 2)),
+            }
+        return moments
+
+
+def _cat_parameters(cat_values):
+    cat_parameters = {}
+    for arg in categoricalize_args:
+        # adding the values one by one in the order of their first occurrence
+        # yields the same iteration order as a set created from all values
+        values = set()
+        for val in cat_values[arg]:
+            values.add(val)
+        cat_parameters[arg] = {val: f"{arg}_{val}" for val in list(values)}
+    return cat_parameters
+
+
+def merge_moments(a, b):
+    """
+    Combine the moments of two sets of values into the moments of their union
+    (Chan et al.), which is numerically stable unlike accumulating sums of squares.
+    """
+    merged = {}
+    for arg in normalize_args:
+        count = a[arg]["count"] + b[arg]["count"]
+        if count == 0:
+            merged[arg] = dict(a[arg])
+            continue
+        delta = b[arg]["mean"] - a[arg]["mean"]
+        merged[arg] = {
+            "count": count,
+            "mean": a[arg]["mean"] + delta * b[arg]["count"] / count,
+            "m2": a[arg]["m2"]
+            + b[arg]["m2"]
+            + delta**2 * a[arg]["count"] * b[arg]["count"] / count,
+        }
+    return merged
+
+
+def save_parameters(filepath, norm_parameters, cat_parameters):
+    """
+    Save the normalization and categorical parameters to a JSON file such that they
+    can be applied to other datasets later on.
+
+    The categorical values are stored as lists to preserve their order, which
+    determines the order of the one-hot keys in the output.
+    """
+    data = {
+        "norm_parameters": {
+            arg: {"mean": float(p["mean"]), "std": float(p["std"])}
+            for arg, p in norm_parameters.items()
+        },
+        "cat_parameters": {
+            arg: list(values.keys()) for arg, values in cat_parameters.items()
+        },
+    }
+    with open(filepath, "w") as f:
+        json.dump(data, f, indent=4)
+
+
+def load_parameters(filepath):
+    """
+    Load parameters saved with save_parameters().
+    """
+    with open(filepath, "r") as f:
+        data = json.load(f)
+
+    assert set(data["norm_parameters"]) == set(normalize_args) and set(
+        data["cat_parameters"]
+    ) == set(categoricalize_args), "Parameters file does not match preprocessed keys"
+
+    norm_parameters = data["norm_parameters"]
+    cat_parameters = {
+        arg: {val: f"{arg}_{val}" for val in values}
+        for arg, values in data["cat_parameters"].items()
+    }
+    return norm_parameters, cat_parameters
+
+
+def save_checkpoint(filepath, checkpoint):
+    """
+    Save a checkpoint of a preprocessed dataset, which allows to append new packets
+    to it later on without processing the existing packets again. It consists of:
+    - the parameters applied to the dataset (in the format of save_parameters(), such
+      that the checkpoint can be used as parameters file as well)
+    - the moments of the normalized fields and the categorical values of all packets
+    - the cached state after the last packet and the id of the last packet
+    - the encoding of the dataset ("full" or "compact", see encoding.py)
+    - the features of the Projection of the dataset (None if not projected)
+
+    The file is replaced atomically such that an interrupted append leaves the
+    previous checkpoint intact.
+    """
+    data = {
+        "norm_parameters": {
+            arg: {"mean": float(p["mean"]), "std": float(p["std"])}
+            for arg, p in checkpoint["norm_parameters"].items()
+        },
+        "cat_parameters": {
+            arg: list(values.keys())
+            for arg, values in checkpoint["cat_parameters"].items()
+        },
+        "moments": checkpoint["moments"],
+        "cat_values": {
+            arg: list(values) for arg, values in checkpoint["cat_values"].items()
+        },
+        "cached_state": checkpoint["cached_state"],
+        "last_id": checkpoint["last_id"],
+        "encoding": checkpoint["encoding"],
+        "features": checkpoint["features"],
+    }
+    temporary = filepath.with_name(filepath.name + ".tmp")
+    with open(temporary, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(temporary, filepath)
+
+
+def load_checkpoint(filepath):
+    """
+    Load a checkpoint saved with save_checkpoint().
+    """
+    norm_parameters, cat_parameters = load_parameters(filepath)
+    with open(filepath, "r") as f:
+        data = json.load(f)
+    assert "moments" in data, f"{filepath} is a parameters file, not a checkpoint"
+
+    return {
+        "norm_parameters": norm_parameters,
+        "cat_parameters": cat_parameters,
+        "moments": data["moments"],
+        "cat_values": {
+            arg: dict.fromkeys(values) for arg, values in data["cat_values"].items()
+        },
+        "cached_state": data["cached_state"],
+        "last_id": data["last_id"],
+        # checkpoints of datasets written before the compact encoding
+        "encoding": data.get("encoding", "full"),
+        "features": data.get("features"),
+    }
+
+
+def refit_parameters(checkpoint):
+    """
+    Calculate the parameters of all packets covered by a checkpoint, including the
+    ones appended after the parameters were fitted.
+    """
+    norm_parameters = {}
+    for arg in normalize_args:
+        moments = checkpoint["moments"][arg]
+        if moments["count"] == 0:
+            norm_parameters[arg] = {"mean": np.nan, "std": np.nan}
+            continue
+        norm_parameters[arg] = {
+            "mean": moments["mean"],
+            "std": np.sqrt(moments["m2"] / moments["count"]),
+        }
+    return norm_parameters, _cat_parameters(checkpoint["cat_values"])
+
+
+def transform_chunk(
+    packets,
+    norm_parameters,
+    cat_parameters,
+    unknown="ignore",
+    verbose=True,
+    projection=None,
+):
+    """
+    Apply normalization and categorical preprocessing to a chunk of packets in place.
+    With a projection, only the fields it contains are transformed.
+
+    Categorical values not contained in cat_parameters can only occur if the
+    parameters were fitted on a different dataset. With unknown="ignore", all one-hot
+    keys of such a value are set to False (and reported if verbose is set). With
+    unknown="error", an error is raised.
+    """
+    # apply normalization
+    for arg in normalize_args:
+        if projection is not None and not projection.needs(arg):
+            continue
+        present, mask = extract_column(packets, arg)
+        if not present:
+            continue
+        normalized = (
+            (np.array(present) - norm_parameters[arg]["mean"])
+            / norm_parameters[arg]["std"]
+        ).tolist()
+        containers, name = _containers(packets, arg)
+        for index, value in zip(np.flatnonzero(mask).tolist(), normalized):
+            containers[index][name] = value
+
+    # apply categoricalization
+    for arg in categoricalize_args:
+        if projection is not None and not projection.needs(arg):
+            continue
+        present, mask = extract_column(packets, arg)
+        # only add the keys if the data-arg is present
+        if not present:
+            continue
+        lookup = {value: i for i, value in enumerate(cat_parameters[arg])}
+        names = [_containers([], strkey)[1] for strkey in cat_parameters[arg].values()]
+        codes = np.fromiter(
+            (lookup.get(v, -1) for v in present), dtype=np.intp, count=len(present)
+        )
+        known = codes >= 0
+        if not known.all():
+            unseen = sorted(set(np.array(present, dtype=object)[~known].tolist()))
+            if unknown == "error":
+                raise ValueError(f"Unseen values for '{arg}': {unseen}")
+            if verbose:
+                eprint(
+                    f"Ignoring {np.count_nonzero(~known)} unseen values for '{arg}': {unseen}"
+                )
+        one_hot = np.zeros((len(present), len(names)), dtype=bool)
+        one_hot[np.flatnonzero(known), codes[known]] = True
+        containers, _ = _containers(packets, arg)
+        for index, row in zip(np.flatnonzero(mask).tolist(), one_hot.tolist()):
+            containers[index].update(zip(names, row))
+
+
+def serialize_with_state(
+    packets, cached_state, first_id, encoder=None, projection=None
+):
+    """
+    Add the cached system state ("keep-last") and the id to each packet and yield the
+    serialized packets, projected by the given Projection and encoded by the given
+    CompactEncoder (see encoding.py) if any.
+
+    cached_state is updated in place such that it can be passed to the next chunk.
+    """
+    for i, p in enumerate(packets, start=first_id):
+        # apply state caching
+        _cache_state(p, cached_state, projection)
+        p["state"] = cached_state
+
+        # add index as id
+        p["id"] = i
+
+        if projection is not None:
+            # only projected entries are cached
+            p = projection.apply(p, state=False)
+        yield json.dumps(p if encoder is None else encoder.encode(p))
+
+
+def _cache_state(packet, cached_state, projection):
+    for (key, value) in packet["data"].items():
+        key = f"{packet['src']}:{key}"
+        if projection is None or key in projection.state:
+            cached_state[key] = value
+
+
+# --- Chunk-parallel preprocessing --------------------------------------------
+#
+# The dataset is split into contiguous chunks which are processed in three parallel
+# phases. The results only depend on the following data passed between the phases, so
+# they are identical to processing the dataset serially:
+# 1. Each chunk collects its values. They are merged in order to obtain the parameters
+#    and the number of packets per chunk, from which the id of its first packet follows.
+# 2. Each chunk computes the last value of each state entry it sets ("last value
+#    seen"), in the order of the first occurrence of the entries. A prefix scan over
+#    these summaries yields the cached state at the start of every chunk.
+# 3. Each chunk is transformed and serialized starting from its cached state.
+
+
+def split_file(filepath, count):
+    """
+    Split an uncompressed file into at most count contiguous byte ranges of roughly
+    equal size, each starting at the beginning of a line.
+    """
+    size = filepath.stat().st_size
+    boundaries = [0]
+    with open(filepath, "rb") as f:
+        for k in range(1, count):
+            f.seek(max(size * k // count, boundaries[-1]))
+            # move to the start of the next line
+            f.readline()
+            boundaries.append(min(f.tell(), size))
+    boundaries.append(size)
+    return [
+        (start, end) for (start, end) in zip(boundaries, boundaries[1:]) if end > start
+    ]
+
+
+def read_chunk(filepath, byte_range):
+    start, end = byte_range
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # skip empty lines
+    return [json.loads(line) for line in data.split(b"\n") if line.strip()]
+
+
+def _collect(task):
+    filepath, byte_range = task
+    collector = ValueCollector()
+    collector.update(read_chunk(filepath, byte_range))
+    return collector
+
+
+def _summarize(task):
+    filepath, byte_range, norm_parameters, cat_parameters, unknown, projection = task
+    packets = read_chunk(filepath, byte_range)
+    transform_chunk(
+        packets, norm_parameters, cat_parameters, unknown, projection=projection
+    )
+
+    summary = {}
+    for p in packets:
+        _cache_state(p, summary, projection)
+    return summary, len(packets)
+
+
+def _serialize(task):
+    (
+        filepath,
+        byte_range,
+        norm_parameters,
+        cat_parameters,
+        unknown,
+        projection,
+        cached_state,
+        first_id,
+        compress,
+        encoding,
+    ) = task
+    packets = read_chunk(filepath, byte_range)
+    # unseen values have already been reported while summarizing
+    transform_chunk(
+        packets,
+        norm_parameters,
+        cat_parameters,
+        unknown,
+        verbose=False,
+        projection=projection,
+    )
+
+    encoder = CompactEncoder(cat_parameters) if encoding == "compact" else None
+    data = "".join(
+        line + "\n"
+        for line in serialize_with_state(
+            packets, cached_state, first_id, encoder, projection
+        )
+    ).encode()
+    # concatenated gzip members form a valid gzip file
+    return gzip.compress(data) if compress else data
+
+
+class ParallelPreprocessor:
+    """
+    Preprocesses an uncompressed IPAL file in contiguous chunks on a pool of jobs
+    processes.
+    """
+
+    def __init__(self, filepath, jobs):
+        self.filepath = filepath
+        # use more chunks than jobs to balance the load
+        self.byte_ranges = split_file(filepath, 4 * jobs)
+        self.pool = Pool(jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.pool.terminate()
+
+    def collect(self):
+        """
+        Collect the values of all chunks (phase 1).
+        """
+        collector = ValueCollector()
+        tasks = [(self.filepath, r) for r in self.byte_ranges]
+        for chunk_collector in self.pool.imap(_collect, tasks):
+            collector.merge(chunk_collector)
+        return collector
+
+    def transform(
+        self,
+        norm_parameters,
+        cat_parameters,
+        unknown,
+        compress,
+        cached_state=None,
+        first_id=0,
+        encoding="full",
+        projection=None,
+    ):
+        """
+        Transform and serialize all chunks (phases 2 and 3). Yields the (optionally
+        gzip-compressed) output of each chunk in order. In the compact encoding, each
+        chunk starts with a keyframe. With a projection, only its fields are kept.
+
+        The file is processed as continuation of packets whose cached state and next
+        id are given. Afterwards, the cached state after the last packet and the id of
+        the last packet are available as attributes cached_state and last_id.
+        """
+        tasks = [
+            (self.filepath, r, norm_parameters, cat_parameters, unknown, projection)
+            for r in self.byte_ranges
+        ]
+        summaries = self.pool.map(_summarize, tasks)
+
+        # prefix scan for the cached state and the id at the start of each chunk
+        cached_states = []
+        first_ids = []
+        cached_state = dict(cached_state or {})
+        for summary, packet_count in summaries:
+            cached_states.append(dict(cached_state))
+            first_ids.append(first_id)
+            cached_state.update(summary)
+            first_id += packet_count
+        self.cached_state = cached_state
+        self.last_id = first_id - 1
+
+        tasks = [
+            task + (state, first_id, compress, encoding)
+            for (task, state, first_id) in zip(tasks, cached_states, first_ids)
+        ]
+        yield from self.pool.imap(_serialize, tasks)
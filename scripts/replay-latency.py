@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+This script measures the per-packet decision latency of trained classifiers by replaying
+a test set (e.g. a dataset part) at the pace of its recorded timestamps. The sequences of
+the dataset parts are shuffled, so the packets are replayed in the order of their
+timestamps. As a part holds a fifth of the traffic, replaying it with a speedup of 5
+corresponds to the traffic of the plant.
+
+Each packet arrives as an IPAL line at its scheduled time, i.e., its timestamp relative to
+the first packet divided by the speedup. It is parsed, its features are extracted as in
+the config of the classifier and the classifier decides on it. The latency of a packet is
+the time from its arrival until the decision, so it includes the time a packet waits
+while the classifier is still busy with earlier packets. The BLSTM decides on sequences
+of sequence_length packets, hence its packets are buffered until their sequence is
+complete and the latency includes the time until the last packet of the sequence arrived.
+
+The timestamps of preprocessed datasets are normalized, so the normalization parameters
+(or a checkpoint, see preprocess-dataset.py) are required to convert them back to seconds.
+With a speedup of 0, packets are replayed as fast as possible, which measures the service
+time and needs no parameters. Models are restricted to a single job, as the decisions on
+single packets are not worth dispatching to several threads and the measurement should
+not depend on the number of jobs a model was trained with.
+
+Per classifier, the percentiles of the latency, the sustained throughput (packets per
+second of processing time) and the offered rate of the replay are reported. A classifier
+keeps up with the traffic if its throughput exceeds the offered rate.
+"""
+
+import argparse
+import json
+import pathlib
+import time
+import numpy as np
+from tabulate import tabulate
+from artifacts import load_ipal_model, load_artifact
+from features import FeatureExtractor
+from incremental import SequenceClassifier
+from preprocessing import load_parameters
+from utils import eprint, open_file
+from encoding import full_lines
+
+
+def load_model(config_file, model_file):
+    """
+    Load a trained model for the IDS config it was trained with and restrict it to a
+    single job. Returns the name of the IDS, its config and the model.
+    """
+    with open(config_file, "r") as f:
+        ((name, ids_config),) = json.load(f).items()
+    if ids_config["_type"] == "BLSTM":
+        parameters = {
+            key: value[0] if isinstance(value, list) and len(value) == 1 else value
+            for (key, value) in ids_config.items()
+        }
+        model = SequenceClassifier.load(
+            model_file,
+            parameters,
+            ids_config["features"],
+            ids_config.get("preprocessors", []),
+        )
+    elif model_file.is_dir():
+        model = load_artifact(model_file)
+    else:
+        model = load_ipal_model(model_file)
+    if hasattr(model, "get_params"):
+        # e.g. RandomForestClassifier(n_jobs=5) as trained by the experiments
+        model.set_params(
+            **{key: 1 for key in model.get_params() if key.split("__")[-1] == "n_jobs"}
+        )
+    return name, ids_config, model
+
+
+def replay(lines, timestamps, extractor, model, speedup):
+    """
+    Replay the packets and return the latency and the service time of each packet and
+    the total processing time.
+    """
+    sequence_length = getattr(model, "sequence_length", 1)
+    latencies = np.empty(len(lines))
+    service = np.empty(len(lines))
+    busy = 0.0
+    buffer = []
+
+    start = time.perf_counter()
+    for (index, (line, timestamp)) in enumerate(zip(lines, timestamps)):
+        if speedup > 0:
+            arrival = start + (timestamp - timestamps[0]) / speedup
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            arrival = time.perf_counter()
+
+        # processing starts when the packet arrived and the previous one is done
+        begin = time.perf_counter()
+        buffer.append((index, arrival, json.loads(line)))
+        if len(buffer) == sequence_length or index == len(lines) - 1:
+            X = extractor.transform([packet for (_, _, packet) in buffer])
+            if sequence_length > 1:
+                model.predict(X)
+            elif X.complete().all():
+                # packets with missing features are skipped like ipal-iids does
+                model.predict(X.toarray(np.float64))
+            decision = time.perf_counter()
+            for (buffered, buffered_arrival, _) in buffer:
+                latencies[buffered] = decision - buffered_arrival
+            buffer = []
+        else:
+            decision = time.perf_counter()
+        service[index] = decision - begin
+        busy += decision - begin
+
+    return latencies, service, busy
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the per-packet latency of IDSs on a timestamp-paced replay"
+    )
+    parser.add_argument(
+        "-i",
+        "--input-file",
+        required=True,
+        type=pathlib.Path,
+        help="Test set to replay (ipal, optionally gzipped)",
+    )
+    parser.add_argument(
+        "-m",
+        "--model",
+        nargs=2,
+        action="append",
+        required=True,
+        type=pathlib.Path,
+        metavar=("CONFIG", "MODEL"),
+        help="IDS config and the model trained with it: a model file of ipal-iids or "
+        "run-classifier.py or an artifact directory (see convert-model.py). Can be "
+        "repeated",
+    )
+    parser.add_argument(
+        "-p",
+        "--parameters-file",
+        type=pathlib.Path,
+        help="Normalization parameters of the test set to convert its timestamps back "
+        "to seconds (required unless the speedup is 0)",
+    )
+    parser.add_argument(
+        "-s",
+        "--speedup",
+        default=1.0,
+        type=float,
+        help="Replay the packets this many times faster than recorded, 0 for as fast "
+        "as possible (default: 1)",
+    )
+    parser.add_argument(
+        "-n",
+        "--count",
+        type=int,
+        help="Only replay the first packets of the test set (optional)",
+    )
+    parser.add_argument(
+        "-w",
+        "--warmup",
+        default=100,
+        type=int,
+        help="Number of packets classified before the replay starts (default: 100)",
+    )
+    args = parser.parse_args()
+
+    if args.parameters_file is None and args.speedup != 0:
+        parser.error(
+            "the timestamps are normalized, replaying them at their pace requires the "
+            "normalization parameters of the test set (--parameters-file)"
+        )
+
+    with open_file(args.input_file, "rt") as f:
+        lines = list(full_lines(f))
+    timestamps = np.array([json.loads(line)["timestamp"] for line in lines])
+    order = np.argsort(timestamps, kind="stable")[: args.count]
+    lines = [lines[i] for i in order.tolist()]
+    timestamps = timestamps[order]
+    if args.parameters_file is not None:
+        norm_parameters, _ = load_parameters(args.parameters_file)
+        timestamps = (
+            timestamps * norm_parameters["timestamp"]["std"]
+            + norm_parameters["timestamp"]["mean"]
+        )
+    duration = (timestamps[-1] - timestamps[0]) / args.speedup if args.speedup else 0
+    eprint(f"Replaying {len(lines)} packets over {duration:.1f}s per classifier")
+
+    rows = []
+    for (config_file, model_file) in args.model:
+        name, ids_config, model = load_model(config_file, model_file)
+        extractor = FeatureExtractor(ids_config["features"], np.float64)
+        # the first decisions are slower, e.g. while caches are filled
+        warmup = lines[: args.warmup]
+        replay(warmup, np.zeros(len(warmup)), extractor, model, 0)
+
+        latencies, service, busy = replay(
+            lines, timestamps, extractor, model, args.speedup
+        )
+        throughput = len(lines) / busy
+        offered = len(lines) / duration if duration > 0 else None
+        rows.append(
+            [
+                name,
+                len(lines),
+                *(np.percentile(latencies, [50, 99, 99.9]) * 1e3),
+                latencies.max() * 1e3,
+                service.mean() * 1e3,
+                throughput,
+                offered,
+                "-" if offered is None else ("yes" if throughput > offered else "no"),
+            ]
+        )
+
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "IDS",
+                "packets",
+                "p50 [ms]",
+                "p99 [ms]",
+                "p99.9 [ms]",
+                "max [ms]",
+                "service [ms]",
+                "throughput [1/s]",
+                "offered [1/s]",
+                "keeps up",
+            ],
+            floatfmt=".4g",
+            missingval="-",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
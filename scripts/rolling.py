@@ -0,0 +1,111 @@
+"""
+Detection counts over a sliding time window.
+
+Packets are assigned to fixed-length windows by their timestamp in seconds. As the test
+sets are shuffled by sequence, the packets arrive in arbitrary order. Hence, the counts of
+each window are accumulated in a dict keyed by the window, which takes O(1) per packet and
+memory proportional to the number of windows, independent of the number of packets. After
+the last packet, the windows are sorted and for every window, its own counts and the
+rolling counts over the last window_count windows are recorded as a series.
+"""
+
+from math import floor
+import numpy as np
+
+# number of attack categories, category 0 denotes non-attack packets
+CATEGORY_COUNT = 8
+
+
+class RollingMetrics:
+    def __init__(self, window_length, window_count):
+        self.window_length = window_length
+        self.window_count = window_count
+
+        # windows[window][2 * category + detected] counts the packets of a window
+        self.windows = {}
+
+        self.window_starts = np.empty(0, dtype=np.float64)
+        self.window_counts = np.empty((0, CATEGORY_COUNT, 2), dtype=np.uint32)
+        self.rolling_counts = np.empty((0, CATEGORY_COUNT, 2), dtype=np.uint32)
+
+    def update(self, timestamp, category, detected):
+        window = floor(timestamp / self.window_length)
+        counts = self.windows.get(window)
+        if counts is None:
+            counts = self.windows[window] = [0] * (2 * CATEGORY_COUNT)
+        counts[2 * category + bool(detected)] += 1
+
+    def finish(self):
+        """
+        Calculate the series of the counted windows. Call once after the last packet.
+        """
+        windows = np.array(sorted(self.windows), dtype=np.int64)
+        counts = np.array(
+            [self.windows[window] for window in windows.tolist()], dtype=np.int64
+        ).reshape(-1, CATEGORY_COUNT, 2)
+        self.windows = {}
+
+        # the rolling counts of a window are the sum over the windows in
+        # (window - window_count, window], skipped windows are empty
+        cumulative = np.zeros((len(windows) + 1, CATEGORY_COUNT, 2), dtype=np.int64)
+        np.cumsum(counts, axis=0, out=cumulative[1:])
+        first = np.searchsorted(windows, windows - self.window_count + 1)
+
+        self.window_starts = windows * self.window_length
+        self.window_counts = counts.astype(np.uint32)
+        self.rolling_counts = (cumulative[1:] - cumulative[first]).astype(np.uint32)
+
+    def series(self):
+        """
+        Return the calculated windows as arrays: start time, counts with shape
+        (windows, categories, [undetected, detected]) and the same for the rolling
+        counts. Windows without any packet are omitted.
+        """
+        return self.window_starts, self.window_counts, self.rolling_counts
+
+
+def detection_metrics(counts):
+    """
+    Calculate recall per category (for category 0, the fraction of correctly undetected
+    packets) and global recall and precision from counts with shape
+    (..., categories, [undetected, detected]).
+    """
+    counts = counts.astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        category_recall = np.empty(counts.shape[:-1])
+        category_recall[..., 0] = counts[..., 0, 0] / counts[..., 0, :].sum(axis=-1)
+        category_recall[..., 1:] = counts[..., 1:, 1] / counts[..., 1:, :].sum(axis=-1)
+
+        true_positive = counts[..., 1:, 1].sum(axis=-1)
+        false_negative = counts[..., 1:, 0].sum(axis=-1)
+        false_positive = counts[..., 0, 1]
+        recall = true_positive / (true_positive + false_negative)
+        precision = true_positive / (true_positive + false_positive)
+    return category_recall, recall, precision
+
+
+def save_series(filepath, metrics):
+    """
+    Save the series of a RollingMetrics together with the derived metrics as npz.
+    """
+    window_starts, counts, rolling_counts = metrics.series()
+    category_recall, recall, precision = detection_metrics(counts)
+    rolling_category_recall, rolling_recall, rolling_precision = detection_metrics(
+        rolling_counts
+    )
+
+    with open(filepath, "wb") as f:
+        np.savez_compressed(
+            f,
+            window_length=metrics.window_length,
+            window_count=metrics.window_count,
+            window_start=window_starts,
+            counts=counts,
+            rolling_counts=rolling_counts,
+            category_recall=category_recall.astype(np.float32),
+            recall=recall.astype(np.float32),
+            precision=precision.astype(np.float32),
+            rolling_category_recall=rolling_category_recall.astype(np.float32),
+            rolling_recall=rolling_recall.astype(np.float32),
+            rolling_precision=rolling_precision.astype(np.float32),
+        )
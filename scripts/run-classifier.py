@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+This script trains the classifier of an RF, SVM, SGD or BLSTM config on a train set and
+classifies a live set, i.e., it covers what ipal-iids is used for in the experiments. Its
+arguments are a subset of the ones of ipal-iids such that it can be used in its place:
+
+    METAIDS_CMD=../../scripts/run-classifier.py ./run-experiment.sh -c rf
+
+The features are held in a FeatureMatrix (see features.py) whose one-hot groups are stored
+as category indices. The "feature-matrix" entry of the config (or --feature-matrix)
+selects how it is passed to the classifier:
+- "dense" (default): continuous features are kept as float64 and the matrix is expanded
+  to a dense float64 array like ipal-iids does
+- "sparse": continuous features are stored as float32. For training, the matrix is
+  expanded to a float32 CSR matrix for the SVM. The RF is trained on a dense float32
+  expansion instead, as scikit-learn copies its input to float32 anyway and grows
+  different trees on sparse input. Predictions are calculated on dense blocks which are
+  expanded one at a time.
+
+For the SVM, the "approximation" entry of the config selects a fast path which maps the
+features with a kernel approximation of the configured RBF kernel and trains a linear SVM
+(same C and class weights) on top instead of an exact SVC:
+- "rff": random Fourier features (RBFSampler)
+- "nystroem": Nystroem approximation based on a random subset of the train set
+Its dimension is set by "approximation-components" (default 1000). The linear SVM is solved
+in the primal with the squared hinge loss, which converges quickly even for large C, so
+training scales linearly with the train set. The deltas against the exact SVC can be reported with
+create-statistics.py --reference.
+
+SGD and BLSTM configs are trained out of core (see incremental.py): the train set is
+streamed from its file in chunks and never held in memory as a whole, which allows train
+sets larger than the memory. The number of passes is set by "epochs".
+
+The output is the live set with the "ids", "alerts" and "scores" fields added, or compact
+predictions if the output file ends with ".npz" (see predictions.py).
+
+Packets with missing continuous features are skipped like ipal-iids does unless the config
+sets "allow-none": they are left out of the train set and are not alerted on with a score
+of 0 in the live set. The BLSTM config allows them and indicates them as features.
+
+Instead of train and live set files, the sets can be assembled from dataset parts with
+--train.part and --live.part, each optionally filtered like filter-dataset.py does. The
+labels and features of the parts are shared with concurrent jobs on the same node through
+the shared memory cache (see cache.py), so a part is only parsed once per node. The output
+of such a live set can only be written as compact predictions.
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import pathlib
+import time
+import joblib
+import numpy as np
+from utils import (
+    eprint,
+    open_file,
+    chunked,
+    read_packets,
+    parse_filter,
+    filter_mask,
+)
+from preprocessing import CHUNK_SIZE
+from features import FeatureExtractor, concatenate
+from incremental import INCREMENTAL_TYPES, train_incremental
+from predictions import save_predictions
+from cache import attach_part
+
+# entries of an IDS config which are no hyperparameters of the classifier
+CONFIG_ENTRIES = [
+    "_type",
+    "model-file",
+    "features",
+    "preprocessors",
+    "trainon",
+    "scoring",
+    "jobs",
+    "verbose",
+    "allow-none",
+    "feature-matrix",
+    "approximation",
+    "approximation-components",
+    "epochs",
+    # option of the BLSTM of ipal-iids, which does not affect the model. run-classifier.py
+    # always assigns the output of a sequence to all of its packets (see incremental.py)
+    "adjust",
+]
+# number of rows expanded at once for predictions
+BLOCK_SIZE = 65536
+# default dimension of the kernel approximations of the SVM
+APPROXIMATION_COMPONENTS = 1000
+
+
+def load_config(config_file):
+    """
+    Load an IDS config with a single IDS. Returns its name and its entries.
+    """
+    with open(config_file, "r") as f:
+        config = json.load(f)
+    assert len(config) == 1, "Only configs with a single IDS are supported"
+    return next(iter(config.items()))
+
+
+def hyperparameters(ids_config):
+    """
+    Return the hyperparameters of the classifier. Lists must hold a single value, grids
+    are searched with tune-config.py instead.
+    """
+    parameters = {}
+    for key, value in ids_config.items():
+        if key in CONFIG_ENTRIES:
+            continue
+        if isinstance(value, list):
+            assert len(value) == 1, f"'{key}' has multiple values, use tune-config.py"
+            value = value[0]
+        parameters[key] = value
+    return parameters
+
+
+def approximate_svm(parameters, method, components):
+    """
+    Create a pipeline of a kernel approximation matched to the RBF kernel of the SVC
+    hyperparameters and a linear SVM with the same C and class weights. Unlimited
+    iterations (max_iter -1) are capped at 1000.
+    """
+    from sklearn.kernel_approximation import Nystroem, RBFSampler
+    from sklearn.pipeline import make_pipeline
+    from sklearn.svm import LinearSVC
+
+    assert parameters.get("kernel", "rbf") == "rbf", "Only RBF kernels are approximated"
+    gamma = parameters["gamma"]
+    assert not isinstance(gamma, str), "gamma must be numeric to be approximated"
+    random_state = parameters.get("random_state")
+    if method == "nystroem":
+        mapping = Nystroem(
+            kernel="rbf",
+            gamma=gamma,
+            n_components=components,
+            random_state=random_state,
+        )
+    elif method == "rff":
+        mapping = RBFSampler(
+            gamma=gamma, n_components=components, random_state=random_state
+        )
+    else:
+        raise ValueError(f"Unsupported kernel approximation {method}")
+
+    max_iter = parameters.get("max_iter", -1)
+    return make_pipeline(
+        mapping,
+        LinearSVC(
+            dual=False,
+            C=parameters.get("C", 1.0),
+            tol=parameters.get("tol", 1e-3),
+            class_weight=parameters.get("class_weight"),
+            max_iter=max_iter if max_iter > 0 else 1000,
+            random_state=random_state,
+        ),
+    )
+
+
+def create_classifier(ids_config):
+    kind = ids_config["_type"]
+    if kind == "RandomForest":
+        from sklearn.ensemble import RandomForestClassifier
+
+        return RandomForestClassifier(
+            **hyperparameters(ids_config), n_jobs=ids_config.get("jobs")
+        )
+    if kind == "SVM":
+        if ids_config.get("approximation"):
+            return approximate_svm(
+                hyperparameters(ids_config),
+                ids_config["approximation"],
+                ids_config.get("approximation-components", APPROXIMATION_COMPONENTS),
+            )
+        from sklearn.svm import SVC
+
+        return SVC(**hyperparameters(ids_config))
+    raise ValueError(f"Unsupported IDS type {kind}")
+
+
+def read_features(input_file, extractor):
+    """
+    Read the packets of a train set into a FeatureMatrix and their labels.
+    """
+    matrices = []
+    labels = []
+    with open_file(input_file, "rt") as f:
+        for chunk in chunked(read_packets(f), CHUNK_SIZE):
+            matrices.append(extractor.transform(chunk))
+            labels.append(np.array([p["malicious"] for p in chunk], dtype=bool))
+    return concatenate(matrices), np.concatenate(labels)
+
+
+def read_parts(parts, extractor):
+    """
+    Assemble a set from dataset parts, each given as its file and optionally a filter
+    (filter-dataset.py arguments in one string). Returns the FeatureMatrix, the labels
+    and the packet ids of the set.
+    """
+    matrices = []
+    labels = []
+    ids = []
+    for (part_file, *filter_string) in parts:
+        part = attach_part(pathlib.Path(part_file), extractor)
+        if filter_string:
+            filter_args = parse_filter(filter_string[0], prog=part_file)
+            rows = np.flatnonzero(filter_mask(part.categories, part.types, filter_args))
+        else:
+            rows = slice(None)
+        matrices.append(part.matrix.take(rows))
+        labels.append(part.malicious[rows])
+        ids.append(part.ids[rows])
+    return concatenate(matrices), np.concatenate(labels), np.concatenate(ids)
+
+
+def training_matrix(classifier, X, mode):
+    if mode == "dense":
+        return X.toarray(np.float64)
+    if hasattr(classifier, "estimators_") or hasattr(classifier, "n_estimators"):
+        return X.toarray(np.float32)
+    return X.tocsr()
+
+
+def predict(classifier, X, mode, allow_none=False):
+    """
+    Return the predictions and scores for a FeatureMatrix. Without allow_none, rows with
+    missing features are not alerted on and get a score of 0.
+    """
+    if not allow_none:
+        complete = X.complete()
+        if not complete.all():
+            flags = np.zeros(len(X), dtype=bool)
+            scores = np.zeros(len(X))
+            rows = np.flatnonzero(complete)
+            if len(rows):
+                flags[rows], scores[rows] = predict(
+                    classifier, X.take(rows), mode, True
+                )
+            return flags, scores
+
+    if hasattr(classifier, "sequences"):
+        # BLSTMs convert the FeatureMatrix into sequences themselves
+        blocks = [X]
+    elif mode == "dense":
+        blocks = [X.toarray(np.float64)]
+    else:
+        blocks = X.blocks(BLOCK_SIZE, np.float32)
+
+    flags = []
+    scores = []
+    for block in blocks:
+        # SVC only provides probabilities if trained with them
+        if hasattr(classifier, "decision_function"):
+            score = classifier.decision_function(block)
+            flags.append(classifier.classes_[(score > 0).astype(int)])
+            scores.append(score)
+        else:
+            proba = classifier.predict_proba(block)
+            flags.append(classifier.classes_[np.argmax(proba, axis=1)])
+            scores.append(proba[:, list(classifier.classes_).index(True)])
+    return np.concatenate(flags).astype(bool), np.concatenate(scores)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train an RF, SVM, SGD or BLSTM IDS and classify a live set"
+    )
+    parser.add_argument("--config", required=True, type=pathlib.Path, help="IDS config")
+    train_group = parser.add_mutually_exclusive_group(required=True)
+    train_group.add_argument(
+        "--train.ipal",
+        dest="train_file",
+        type=pathlib.Path,
+        help="Train set (ipal, optionally gzipped)",
+    )
+    train_group.add_argument(
+        "--train.part",
+        dest="train_parts",
+        nargs="+",
+        action="append",
+        metavar=("PART", "FILTER"),
+        help="Dataset part of the train set and optionally a filter given as "
+        "filter-dataset.py arguments in one string, loaded through the shared memory "
+        "cache (can be repeated)",
+    )
+    live_group = parser.add_mutually_exclusive_group(required=True)
+    live_group.add_argument(
+        "--live.ipal",
+        dest="live_file",
+        type=pathlib.Path,
+        help="Live set (ipal, optionally gzipped)",
+    )
+    live_group.add_argument(
+        "--live.part",
+        dest="live_parts",
+        nargs="+",
+        action="append",
+        metavar=("PART", "FILTER"),
+        help="Dataset part of the live set and optionally a filter, like --train.part "
+        "(can be repeated, requires compact predictions as output)",
+    )
+    parser.add_argument(
+        "--output",
+        required=True,
+        type=pathlib.Path,
+        help="Output file (ipal, optionally gzipped, or compact predictions as npz)",
+    )
+    parser.add_argument(
+        "--feature-matrix",
+        choices=["dense", "sparse"],
+        help="How the features are passed to the classifier (overrides the config)",
+    )
+    # accepted for compatibility with ipal-iids, the classifier is always trained
+    parser.add_argument("--retrain", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--log", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    for parts in [args.train_parts, args.live_parts]:
+        if any(len(part) > 2 for part in parts or []):
+            parser.error("a part takes at most one filter string")
+    compact = args.output.suffix == ".npz"
+    if args.live_parts and not compact:
+        parser.error("--live.part requires compact predictions (.npz) as output")
+
+    name, ids_config = load_config(args.config)
+    mode = args.feature_matrix or ids_config.get("feature-matrix", "dense")
+    allow_none = ids_config.get("allow-none", False)
+    extractor = FeatureExtractor(
+        ids_config["features"], np.float64 if mode == "dense" else np.float32
+    )
+
+    # --- Train --------------------------------------------------------------
+    start = time.perf_counter()
+    if ids_config["_type"] in INCREMENTAL_TYPES:
+        if args.train_file is not None and args.train_file.is_fifo():
+            parser.error("out-of-core training reads the train set several times")
+        classifier = train_incremental(
+            ids_config,
+            hyperparameters(ids_config),
+            args.train_file,
+            extractor,
+            lambda X: training_matrix(None, X, mode),
+            read_parts(args.train_parts, extractor)[:2] if args.train_parts else None,
+        )
+    else:
+        if args.train_parts:
+            X, y, _ = read_parts(args.train_parts, extractor)
+        else:
+            X, y = read_features(args.train_file, extractor)
+        train_count = math.ceil(ids_config.get("trainon", 1.0) * len(y))
+        X, y = X.take(slice(0, train_count)), y[:train_count]
+        if not allow_none:
+            complete = X.complete()
+            if not complete.all():
+                eprint(
+                    f"Skipping {len(y) - complete.sum()} packets with missing features"
+                )
+                X, y = X.take(complete), y[complete]
+        eprint(
+            f"Train features: {X.shape[0]} x {X.shape[1]}, {X.nbytes / 1e6:.1f} MB "
+            f"(dense float64: {X.shape[0] * X.shape[1] * 8 / 1e6:.1f} MB)"
+        )
+
+        classifier = create_classifier(ids_config)
+        classifier.fit(training_matrix(classifier, X, mode), y)
+        del X
+    eprint(f"Training took {time.perf_counter() - start:.1f}s")
+
+    model_file = ids_config.get("model-file")
+    if model_file and "${" not in model_file:
+        if hasattr(classifier, "save"):
+            classifier.save(model_file)
+        else:
+            joblib.dump(classifier, model_file)
+
+    # --- Classify -----------------------------------------------------------
+    ids = []
+    flags = []
+    scores = []
+    if args.live_parts:
+        X, _, live_ids = read_parts(args.live_parts, extractor)
+        for offset in range(0, len(X), CHUNK_SIZE):
+            rows = slice(offset, offset + CHUNK_SIZE)
+            chunk_flags, chunk_scores = predict(
+                classifier, X.take(rows), mode, allow_none
+            )
+            ids.append(live_ids[rows])
+            flags.append(chunk_flags)
+            scores.append(chunk_scores.astype(np.float32))
+    else:
+        with open_file(args.live_file, "rt") as f_in, (
+            contextlib.nullcontext() if compact else open_file(args.output, "wt")
+        ) as f_out:
+            for chunk in chunked(read_packets(f_in), CHUNK_SIZE):
+                chunk_flags, chunk_scores = predict(
+                    classifier, extractor.transform(chunk), mode, allow_none
+                )
+                if compact:
+                    ids.append(np.array([p["id"] for p in chunk], dtype=np.int64))
+                    flags.append(chunk_flags)
+                    scores.append(chunk_scores.astype(np.float32))
+                    continue
+                for (p, flag, score) in zip(
+                    chunk, chunk_flags.tolist(), chunk_scores.tolist()
+                ):
+                    p["ids"] = flag
+                    p["alerts"] = {name: flag}
+                    p["scores"] = {name: score}
+                    f_out.write(json.dumps(p))
+                    f_out.write("\n")
+
+    if compact:
+        save_predictions(
+            args.output,
+            np.concatenate(ids) if ids else np.empty(0, dtype=np.int64),
+            np.concatenate(flags) if flags else np.empty(0, dtype=bool),
+            np.concatenate(scores) if scores else None,
+        )
+
+
+if __name__ == "__main__":
+    main()
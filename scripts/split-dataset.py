@@ -7,15 +7,17 @@ The split is done in one of two modes:
 - sequence-of-four: considers sequences of 4 consecutive packets. Those sequences are distributed among the parts.
                     Required for BLSTM.
 
-The dataset is shuffled before splitting.
+The dataset is shuffled before splitting. In the compact encoding (see encoding.py), the
+sequences of four start with a keyframe and are moved as they are, whereas single packets
+are decoded into the full format.
 """
 
 import numpy as np
 import argparse
 from pathlib import Path
 import sys
-from utils import open_file, chunks
-from math import floor
+from utils import open_file, chunks, random_partition
+from encoding import full_lines
 
 
 def main():
@@ -54,32 +56,35 @@ def main():
         choices=["packet-by-packet", "sequence-of-four"],
         help="Which splitting mode should be used",
     )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        help="Seed for shuffling to make the split reproducible (optional)",
+    )
     args = parser.parse_args()
 
+    if args.seed is not None:
+        np.random.seed(args.seed)
+
     with open_file(
         args.input_file, "rt"
     ) if args.input_file is not None else sys.stdin as f:
         # skip empty lines
-        lines = [line for line in f.readlines() if line.strip()]
+        lines = [
+            line
+            for line in (f if args.mode == "sequence-of-four" else full_lines(f))
+            if line.strip()
+        ]
 
     # create chunks depending on mode
     sequence_len = 4 if args.mode == "sequence-of-four" else 1
     sequences = list(chunks(lines, sequence_len))
 
-    # random permutation of sequence indices
-    seq_permutation = np.random.permutation(len(sequences))
-
-    # partition the permutation into the parts
-    part_length = len(sequences) / args.part_count
-    parts = [
-        seq_permutation[floor(i * part_length) : floor((i + 1) * part_length)]
-        for i in range(args.part_count)
-    ]
+    # random partition of sequence indices
+    parts = random_partition(len(sequences), args.part_count)
 
     print(f"Part lengths: {','.join([str(len(part)) for part in parts])}")
-    assert sum([len(part) for part in parts]) == len(
-        sequences
-    ), "Not all sequences are assigned to parts. Numerical problem?"
 
     for i, part in enumerate(parts):
         with open(args.output_directory / f"{args.output_prefix}{i}.ipal", "w") as f:
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+This script turns a live stream of Arff records into IDS-ready IPAL packets. It applies the
+same steps as the dataset preparation to every record as soon as it arrives:
+- Transcribing the record into IPAL
+- Normalizing and categoricalizing it with previously saved parameters
+  (see the "fit" mode of preprocess-dataset.py)
+- Adding the system state using the "keep-last" method and an "id" field
+
+Records are read from stdin, a FIFO or a Unix socket. The attribute list is either taken
+from the Arff header at the beginning of the stream or from a separate Arff file.
+
+Reading, processing and writing are decoupled by a bounded queue: if processing falls
+behind, reading is paused (backpressure). Records which are queued at the same time are
+processed as one chunk to keep up with high traffic rates. The latency of each record
+from reception until its IPAL packet is written is recorded in a histogram.
+"""
+
+import argparse
+import asyncio
+import os
+import pathlib
+import signal
+import stat
+import sys
+import time
+from utils import eprint, open_file
+from transcription import ArffParser, read_attribute_list
+from preprocessing import transform_chunk, serialize_with_state, load_parameters
+from latency import LatencyHistogram
+
+
+class Pipeline:
+    def __init__(self, args, f_out, histogram):
+        self.norm_parameters, self.cat_parameters = load_parameters(
+            args.parameters_file
+        )
+        self.attribute_list = (
+            read_attribute_list(args.header_file)
+            if args.header_file is not None
+            else None
+        )
+        self.unknown = args.unknown_categories
+        self.max_batch = args.max_batch
+        self.skip = args.skip_first
+        self.f_out = f_out
+        self.histogram = histogram
+
+        # bounded queue of (arrival time, parser, line) tuples, None marks the end of input
+        self.queue = asyncio.Queue(maxsize=args.queue_size)
+
+        # state carried over between records
+        self.cached_state = {}
+        self.next_id = 0
+
+    async def read(self, reader):
+        """
+        Put the lines read from reader into the queue. Awaiting put() on the full queue
+        stops reading, which propagates backpressure to the sender.
+        """
+        arff_parser = ArffParser(self.attribute_list)
+
+        while line := await reader.readline():
+            arrival = time.perf_counter()
+            if arff_parser.data_section:
+                await self.queue.put((arrival, arff_parser, line.decode()))
+            else:
+                arff_parser.feed(line.decode())
+
+    async def process(self):
+        """
+        Process queued records chunk by chunk until the end of input.
+        """
+        while True:
+            items = [await self.queue.get()]
+            while items[-1] is not None and len(items) < self.max_batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            done = items[-1] is None
+            if done:
+                items.pop()
+
+            arrivals = []
+            packets = []
+            for (arrival, arff_parser, line) in items:
+                packet = arff_parser.feed(line)
+                if packet is not None:
+                    arrivals.append(arrival)
+                    packets.append(packet)
+
+            if packets:
+                self.emit(arrivals, packets)
+
+            if done:
+                return
+
+    def emit(self, arrivals, packets):
+        transform_chunk(
+            packets, self.norm_parameters, self.cat_parameters, self.unknown
+        )
+
+        lines = list(serialize_with_state(packets, self.cached_state, self.next_id))
+        self.next_id += len(packets)
+
+        # the first packets are skipped due to incomplete state
+        skipped = min(self.skip, len(lines))
+        self.skip -= skipped
+        for line in lines[skipped:]:
+            self.f_out.write(line)
+            self.f_out.write("\n")
+        self.f_out.flush()
+
+        written = time.perf_counter()
+        for arrival in arrivals[skipped:]:
+            self.histogram.record(written - arrival)
+
+
+async def report(histogram, interval):
+    while True:
+        await asyncio.sleep(interval)
+        eprint(histogram.summary())
+
+
+class FileReader:
+    """
+    Stand-in for asyncio.StreamReader for regular files, which cannot be read through
+    the event loop. Lines are read in a worker thread instead.
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    async def readline(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self.f.readline)
+
+
+async def open_reader(f_in):
+    if stat.S_ISREG(os.fstat(f_in.fileno()).st_mode):
+        return FileReader(f_in)
+
+    reader = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), f_in
+    )
+    return reader
+
+
+async def run(args, f_out, histogram):
+    pipeline = Pipeline(args, f_out, histogram)
+
+    # stop gracefully on SIGTERM as on SIGINT such that statistics are printed
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
+
+    if args.report_interval is not None:
+        reporter = asyncio.ensure_future(report(histogram, args.report_interval))
+
+    if args.socket is not None:
+        # every connection is a part of the same stream, e.g., after a reconnect
+        async def handle(reader, writer):
+            try:
+                await pipeline.read(reader)
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(handle, path=str(args.socket))
+        eprint(f"Listening on {args.socket}")
+        async with server:
+            await pipeline.process()
+    else:
+        f_in = (
+            open(args.input_file, "rb")
+            if args.input_file is not None
+            else sys.stdin.buffer
+        )
+        reader = await open_reader(f_in)
+
+        async def read_all():
+            await pipeline.read(reader)
+            await pipeline.queue.put(None)
+
+        await asyncio.gather(read_all(), pipeline.process())
+
+    if args.report_interval is not None:
+        reporter.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transcribe and preprocess a live stream of MorrisDS4 Arff records"
+    )
+    source_group = parser.add_mutually_exclusive_group()
+    source_group.add_argument(
+        "-i",
+        "--input-file",
+        type=pathlib.Path,
+        help="Input pipe or FIFO (arff) or stdin if omitted",
+    )
+    source_group.add_argument(
+        "-s",
+        "--socket",
+        type=pathlib.Path,
+        help="Listen on this Unix socket for arff records instead",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-file",
+        type=pathlib.Path,
+        help="Output file (ipal, optionally gzipped) or stdout if omitted",
+    )
+    parser.add_argument(
+        "-p",
+        "--parameters-file",
+        required=True,
+        type=pathlib.Path,
+        help="Parameters file (json) created with preprocess-dataset.py",
+    )
+    parser.add_argument(
+        "--header-file",
+        type=pathlib.Path,
+        help="Arff file whose header defines the attributes, if the stream has none",
+    )
+    parser.add_argument(
+        "--unknown-categories",
+        default="ignore",
+        choices=["ignore", "error"],
+        help="How to handle categorical values not seen during fit",
+    )
+    parser.add_argument(
+        "--skip-first",
+        default=4,
+        type=int,
+        help="Number of packets to skip at the start due to incomplete state (default: 4)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        default=1024,
+        type=int,
+        help="Maximum number of records waiting for processing (default: 1024)",
+    )
+    parser.add_argument(
+        "--max-batch",
+        default=256,
+        type=int,
+        help="Maximum number of records processed at once (default: 256)",
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        help="Periodically print latency statistics to stderr (in seconds)",
+    )
+    args = parser.parse_args()
+
+    histogram = LatencyHistogram()
+
+    with (
+        open_file(args.output_file, "wt")
+        if args.output_file is not None
+        else sys.stdout
+    ) as f_out:
+        try:
+            asyncio.run(run(args, f_out, histogram))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+
+    eprint("\n----- Per-record latency -----")
+    eprint(histogram.summary())
+    eprint(histogram.table())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+This script draws a stratified subsample of a dataset in IPAL format for quick-look
+evaluations. Each attack type (including the benign type 0) is sampled separately with the
+given fraction, keeping at least --min-units units of every type that is present. Hence,
+even rare attacks remain in small subsamples.
+
+A unit is a single packet or a sequence of four packets (see filter-dataset.py), a sequence
+belongs to the highest attack type among its packets. The units are selected by a random key
+derived from the id of their first packet, so the subsample of a smaller fraction is
+contained in the subsample of a larger one and the selection does not depend on which other
+packets are part of the input.
+
+In the compact encoding (see encoding.py), sequences of four are kept as they are, whereas
+single packets are decoded into the full format.
+"""
+
+import argparse
+import math
+import pathlib
+import json
+import sys
+import numpy as np
+from utils import eprint, open_file, get_attack_details
+from encoding import full_lines
+
+
+def unit_keys(ids, seed):
+    """
+    Map the ids to pseudo-random keys in [0, 1) using the SplitMix64 finalizer.
+    """
+    with np.errstate(over="ignore"):
+        x = np.asarray(ids, dtype=np.uint64) + np.uint64(seed) * np.uint64(
+            0x9E3779B97F4A7C15
+        )
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) / 2.0**53
+
+
+def subsample_mask(strata, keys, fraction, min_units):
+    """
+    Return a mask of the units to keep: per stratum, the ceil(fraction * count) units
+    (but at least min_units) with the smallest keys.
+    """
+    keep = np.zeros(len(strata), dtype=bool)
+    for stratum in np.unique(strata):
+        units = np.flatnonzero(strata == stratum)
+        count = min(len(units), max(math.ceil(fraction * len(units)), min_units))
+        keep[units[np.argsort(keys[units], kind="stable")[:count]]] = True
+    return keep
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Draw a stratified subsample of a MorrisDS4 dataset in IPAL format"
+    )
+    parser.add_argument(
+        "-i",
+        "--input-file",
+        type=pathlib.Path,
+        help="Input file (ipal, optionally gzipped) or stdin if omitted",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-file",
+        type=pathlib.Path,
+        help="Output file (ipal, optionally gzipped) or stdout if omitted",
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        required=True,
+        choices=["packet-by-packet", "sequence-of-four"],
+        help="Should each packet be sampled individually or should each sequence of four packets be sampled as one unit",
+    )
+    parser.add_argument(
+        "-r",
+        "--fraction",
+        required=True,
+        type=float,
+        help="Fraction of the units of each attack type to keep",
+    )
+    parser.add_argument(
+        "--min-units",
+        default=10,
+        type=int,
+        help="Minimum number of units kept per attack type (default: 10)",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        default=0,
+        type=int,
+        help="Seed of the random selection (default: 0)",
+    )
+    args = parser.parse_args()
+
+    if not 0 < args.fraction <= 1:
+        parser.error("--fraction must be in (0, 1]")
+
+    sequence_len = 4 if args.mode == "sequence-of-four" else 1
+
+    with open_file(
+        args.input_file, "rt"
+    ) if args.input_file is not None else sys.stdin as f:
+        # skip empty lines
+        lines = [
+            line for line in (f if sequence_len > 1 else full_lines(f)) if line.strip()
+        ]
+
+    unit_count = (len(lines) + sequence_len - 1) // sequence_len
+    ids = np.empty(unit_count, dtype=np.int64)
+    strata = np.zeros(unit_count, dtype=np.int64)
+    for (index, line) in enumerate(lines):
+        data = json.loads(line)
+        unit = index // sequence_len
+        if index % sequence_len == 0:
+            ids[unit] = data["id"]
+        _, attack_type = get_attack_details(data)
+        strata[unit] = max(strata[unit], attack_type)
+
+    keep = subsample_mask(
+        strata, unit_keys(ids, args.seed), args.fraction, args.min_units
+    )
+
+    with (
+        open_file(args.output_file, "wt")
+        if args.output_file is not None
+        else sys.stdout
+    ) as f:
+        for unit in np.flatnonzero(keep).tolist():
+            f.writelines(lines[unit * sequence_len : (unit + 1) * sequence_len])
+
+    eprint(
+        f"Kept {(np.count_nonzero(keep)/max(unit_count, 1)*100):.2f}% "
+        f"({np.count_nonzero(keep)}/{unit_count}) of total units "
+        f"covering {len(np.unique(strata[keep]))} attack types"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,19 @@
 #!/usr/bin/env python3
 """
 This script transcribes the dataset from Arff into IPAL format.
+
+Alternatively, the typed columns of the dataset can be exported directly to a NumPy .npz
+archive with one array per IPAL field. The masks of missing data values are stored as
+"<field>;missing".
 """
 
 from argparse import ArgumentParser
 from pathlib import Path
 import sys
 import json
-import re
+import numpy as np
 from utils import open_file
-
-# how to handle data values
-ipal_data_config = {
-    "pressure measurement": {
-        "name": "Scaled Gas Pressure",
-        "function": (lambda x: max(0, float(x))),
-    },
-    "control scheme": {"name": "control schema", "function": int},
-    "system mode": {"name": "system mode", "function": int},
-    "pump": {"name": "pump", "function": int},
-    "solenoid": {"name": "solenoid", "function": int},
-    "setpoint": {"name": "PID Setpoint", "function": float},
-    "reset rate": {"name": "PID Reset", "function": float},
-    "gain": {"name": "PID Gain", "function": int},
-    "rate": {"name": "PID Rate", "function": float},
-    "deadband": {"name": "PID Deadband", "function": float},
-    "cycle time": {"name": "PID Cycle Time", "function": float},
-}
+from transcription import read_arff_columns
 
 
 def main():
@@ -40,59 +27,41 @@ def main():
         type=Path,
         help="specify a file where the output should be saved, defaults to stdout",
     )
+    parser.add_argument(
+        "-f",
+        "--format",
+        default="ipal",
+        choices=["ipal", "npz"],
+        help="output format, npz requires an output file (defaults to ipal)",
+    )
     args = parser.parse_args()
 
-    # loop variables
-    data_section = False
-    attribute_list = []
-    attribute_regex = re.compile("@attribute '([^']+)'")
-    running_id = 0
+    if args.format == "npz":
+        if args.output_file is None:
+            parser.error("the npz format requires an output file")
+
+        columns = {}
+        with open_file(args.input_file, "rt") as f_in:
+            for block in read_arff_columns(f_in):
+                block_columns, block_missing = block.ipal_columns()
+                for (key, values) in block_columns.items():
+                    columns.setdefault(key, []).append(values)
+                for (key, mask) in block_missing.items():
+                    columns.setdefault(f"{key};missing", []).append(mask)
+
+        np.savez_compressed(
+            args.output_file,
+            **{key: np.concatenate(blocks) for (key, blocks) in columns.items()},
+        )
+        return
 
     with open_file(args.input_file, "rt") as f_in, (
         open_file(args.output_file, "wt")
         if args.output_file is not None
         else sys.stdout
     ) as f_out:
-        for l in f_in:
-            l = l.strip()
-
-            if not data_section:
-                # header section
-                if match := attribute_regex.match(l):
-                    attribute_list.append(match.group(1))
-                elif l == "@data":
-                    data_section = True
-            else:
-                # data section
-                l = l.split(",")
-                # parses the data into dict with attribute name as key
-                parsed = {name: value for (name, value) in zip(attribute_list, l)}
-
-                data = {}
-                for (arff_name, ipal_config) in ipal_data_config.items():
-                    value = parsed[arff_name]
-                    if value != "?":
-                        data[ipal_config["name"]] = (
-                            ipal_config["function"](value)
-                            if "function" in ipal_config
-                            else value
-                        )
-
-                out = {
-                    "src": int(parsed["address"]),
-                    "dest": int(parsed["address"]),
-                    "timestamp": float(parsed["time"]),
-                    "activity": int(parsed["command response"]),
-                    "type": int(parsed["function"]),
-                    "malicious": int(parsed["specific result"]) != 0,
-                    "attack-details": f'{parsed["categorized result"]};{parsed["specific result"]}',
-                    "protocol": "modbus",
-                    "length": int(parsed["length"], 16),
-                    "crc": int(parsed["crc rate"]),
-                    "data": data,
-                }
-
-                running_id += 1
+        for block in read_arff_columns(f_in):
+            for out in block.to_packets():
                 f_out.write(json.dumps(out))
                 f_out.write("\n")
 
@@ -0,0 +1,282 @@
+"""
+Shared logic to transcribe the MorrisDS4 dataset from Arff into IPAL format.
+
+Records can either be transcribed one by one (ArffParser) or read block by block into typed
+NumPy columns (read_arff_columns), from which IPAL packets or other formats are created.
+"""
+
+import re
+import numpy as np
+from itertools import repeat
+from utils import open_file, chunked
+
+# how to handle data values
+ipal_data_config = {
+    "pressure measurement": {
+        "name": "Scaled Gas Pressure",
+        "function": (lambda x: max(0, float(x))),
+    },
+    "control scheme": {"name": "control schema", "function": int},
+    "system mode": {"name": "system mode", "function": int},
+    "pump": {"name": "pump", "function": int},
+    "solenoid": {"name": "solenoid", "function": int},
+    "setpoint": {"name": "PID Setpoint", "function": float},
+    "reset rate": {"name": "PID Reset", "function": float},
+    "gain": {"name": "PID Gain", "function": int},
+    "rate": {"name": "PID Rate", "function": float},
+    "deadband": {"name": "PID Deadband", "function": float},
+    "cycle time": {"name": "PID Cycle Time", "function": float},
+}
+
+# types of the attributes when read into columns
+arff_column_dtypes = {
+    "address": np.int64,
+    "function": np.int64,
+    "length": np.int64,
+    "crc rate": np.int64,
+    "command response": np.int64,
+    "time": np.float64,
+    "categorized result": np.int64,
+    "specific result": np.int64,
+    **{
+        arff_name: (np.int64 if ipal_config["function"] is int else np.float64)
+        for (arff_name, ipal_config) in ipal_data_config.items()
+    },
+}
+
+# number of records which are read into columns at once
+BLOCK_SIZE = 65536
+
+attribute_regex = re.compile("@attribute '([^']+)'")
+
+
+def transcribe(parsed):
+    """
+    Transcribe one Arff record, given as dict with the attribute names as keys, into
+    an IPAL packet.
+    """
+    data = {}
+    for (arff_name, ipal_config) in ipal_data_config.items():
+        value = parsed[arff_name]
+        if value != "?":
+            data[ipal_config["name"]] = (
+                ipal_config["function"](value) if "function" in ipal_config else value
+            )
+
+    return {
+        "src": int(parsed["address"]),
+        "dest": int(parsed["address"]),
+        "timestamp": float(parsed["time"]),
+        "activity": int(parsed["command response"]),
+        "type": int(parsed["function"]),
+        "malicious": int(parsed["specific result"]) != 0,
+        "attack-details": f'{parsed["categorized result"]};{parsed["specific result"]}',
+        "protocol": "modbus",
+        "length": int(parsed["length"], 16),
+        "crc": int(parsed["crc rate"]),
+        "data": data,
+    }
+
+
+class ArffParser:
+    """
+    Incrementally parses the lines of an Arff file. Lines of the header section are
+    used to build the attribute list, lines of the data section are transcribed.
+
+    If attribute_list is given, the header section is assumed to have been parsed
+    already and all lines are treated as data lines.
+    """
+
+    def __init__(self, attribute_list=None):
+        self.attribute_list = [] if attribute_list is None else list(attribute_list)
+        self.data_section = attribute_list is not None
+
+    def feed(self, line):
+        """
+        Process one line. Returns the transcribed IPAL packet for data lines and None
+        otherwise.
+        """
+        line = line.strip()
+
+        if not self.data_section:
+            # header section
+            if match := attribute_regex.match(line):
+                self.attribute_list.append(match.group(1))
+            elif line == "@data":
+                self.data_section = True
+            return None
+
+        if not line:
+            return None
+
+        # data section
+        # parses the data into dict with attribute name as key
+        parsed = {
+            name: value for (name, value) in zip(self.attribute_list, line.split(","))
+        }
+        return transcribe(parsed)
+
+
+def read_attribute_list(filepath):
+    """
+    Read the attribute list from the header section of an Arff file.
+    """
+    parser = ArffParser()
+    with open_file(filepath, "rt") as f:
+        for line in f:
+            parser.feed(line)
+            if parser.data_section:
+                break
+    return parser.attribute_list
+
+
+class ArffBlock:
+    """
+    A block of Arff records as typed NumPy columns, keyed by attribute name. Missing
+    values ("?") are marked in the masks in missing, which exist for the attributes
+    in ipal_data_config. The values at missing positions are undefined.
+    """
+
+    def __init__(self, columns, missing):
+        self.columns = columns
+        self.missing = missing
+        self.size = len(columns["time"])
+
+    def ipal_columns(self):
+        """
+        Return the columns and masks of missing values keyed by IPAL field (using the
+        "data;" prefix for data fields, as in the IDS configs).
+        """
+        columns = {
+            "src": self.columns["address"],
+            "dest": self.columns["address"],
+            "timestamp": self.columns["time"],
+            "activity": self.columns["command response"],
+            "type": self.columns["function"],
+            "malicious": self.columns["specific result"] != 0,
+            "attack category": self.columns["categorized result"],
+            "attack type": self.columns["specific result"],
+            "length": self.columns["length"],
+            "crc": self.columns["crc rate"],
+        }
+        missing = {}
+        for (arff_name, ipal_config) in ipal_data_config.items():
+            columns[f"data;{ipal_config['name']}"] = self.columns[arff_name]
+            missing[f"data;{ipal_config['name']}"] = self.missing[arff_name]
+        return columns, missing
+
+    def to_packets(self):
+        """
+        Transcribe the records into IPAL packets. The result is identical to
+        transcribing them one by one.
+        """
+        # fill the data fields column by column, skipping missing values
+        data = [{} for _ in range(self.size)]
+        for (arff_name, ipal_config) in ipal_data_config.items():
+            name = ipal_config["name"]
+            present = np.flatnonzero(~self.missing[arff_name]).tolist()
+            values = self.columns[arff_name][present].tolist()
+            if arff_name == "pressure measurement":
+                # max(0, x) yields the integer 0 for clamped values
+                values = [v if v > 0 else 0 for v in values]
+            for index, value in zip(present, values):
+                data[index][name] = value
+
+        return [
+            {
+                "src": src,
+                "dest": src,
+                "timestamp": timestamp,
+                "activity": activity,
+                "type": packet_type,
+                "malicious": attack_type != 0,
+                "attack-details": f"{category};{attack_type}",
+                "protocol": "modbus",
+                "length": length,
+                "crc": crc,
+                "data": packet_data,
+            }
+            for (
+                src,
+                timestamp,
+                activity,
+                packet_type,
+                category,
+                attack_type,
+                length,
+                crc,
+                packet_data,
+            ) in zip(
+                self.columns["address"].tolist(),
+                self.columns["time"].tolist(),
+                self.columns["command response"].tolist(),
+                self.columns["function"].tolist(),
+                self.columns["categorized result"].tolist(),
+                self.columns["specific result"].tolist(),
+                self.columns["length"].tolist(),
+                self.columns["crc rate"].tolist(),
+                data,
+            )
+        ]
+
+
+def _parse_column(arff_name, values):
+    """
+    Convert the strings of one attribute into a typed column and a mask of missing
+    values.
+    """
+    dtype = arff_column_dtypes[arff_name]
+    count = len(values)
+
+    if arff_name == "length":
+        # hexadecimal values
+        return np.fromiter(map(int, values, repeat(16)), dtype, count), None
+
+    convert = int if dtype is np.int64 else float
+    if arff_name not in ipal_data_config:
+        return np.fromiter(map(convert, values), dtype, count), None
+
+    missing = np.fromiter(map("?".__eq__, values), bool, count)
+    # replace missing values by "0" before converting
+    values = np.fromiter(
+        map(convert, map({"?": "0"}.get, values, values)), dtype, count
+    )
+    if arff_name == "pressure measurement":
+        values = np.maximum(0, values)
+    return values, missing
+
+
+def read_arff_columns(f, block_size=BLOCK_SIZE):
+    """
+    Read the records of the Arff file f into typed columns. Yields an ArffBlock for
+    each block of (at most) block_size records. Raises a ValueError for records without
+    a value for each attribute.
+    """
+    numbered = enumerate(f, start=1)
+    # header section
+    arff_parser = ArffParser()
+    for (_, line) in numbered:
+        arff_parser.feed(line)
+        if arff_parser.data_section:
+            break
+    attribute_list = arff_parser.attribute_list
+    indices = {name: attribute_list.index(name) for name in arff_column_dtypes}
+
+    # data section
+    lines = ((number, line) for (number, line) in numbered if line.strip())
+    for block in chunked(lines, block_size):
+        rows = [line.strip().split(",") for (_, line) in block]
+        for ((number, _), row) in zip(block, rows):
+            if len(row) != len(attribute_list):
+                raise ValueError(
+                    f"Line {number}: expected {len(attribute_list)} values, "
+                    f"got {len(row)}"
+                )
+        fields = list(zip(*rows))
+        columns = {}
+        missing = {}
+        for name, index in indices.items():
+            columns[name], mask = _parse_column(name, fields[index])
+            if mask is not None:
+                missing[name] = mask
+        yield ArffBlock(columns, missing)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+This script tunes the hyperparameters of an IDS config using successive halving.
+
+The hyperparameters in the config are given as lists. All lists with more than one value
+(and the values given with --grid) are expanded into a grid of candidates. In each round,
+all remaining candidates are trained on a random subsample of the training parts with
+ipal-iids and evaluated on a validation split of the training parts of each fold. The test
+part of a fold is never read, so that the experiments are evaluated on data the tuning has
+not seen. Only the best 1/eta of the candidates advance to the next round, in which the
+subsample grows by a factor of eta. The last round uses the full training parts (except
+the validation split). Candidates are evaluated in parallel in a process pool.
+
+The values of the winning candidate are written back into the config. All other content
+and the formatting of the config are kept.
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import pathlib
+import re
+import subprocess
+import tempfile
+import numpy as np
+from math import ceil
+from tabulate import tabulate
+from utils import chunks, eprint, open_file, read_packets
+
+# config entries which are lists, but no hyperparameters
+NON_HYPERPARAMETERS = ["features", "preprocessors"]
+
+
+def expand_grid(ids_config, grid):
+    """
+    Return the names of the tuned hyperparameters and all candidates as tuples of values.
+    """
+    space = {
+        key: value
+        for (key, value) in ids_config.items()
+        if isinstance(value, list) and len(value) > 1 and key not in NON_HYPERPARAMETERS
+    }
+    space.update(grid)
+    names = list(space.keys())
+    return names, list(itertools.product(*space.values()))
+
+
+def candidate_config(ids_config, names, values):
+    """
+    Return a copy of ids_config with the hyperparameters set to the given values. Values
+    are wrapped into a list if the config uses a list for them.
+    """
+    config = dict(ids_config)
+    for name, value in zip(names, values):
+        config[name] = [value] if isinstance(ids_config.get(name), list) else value
+    return config
+
+
+def read_sequences(dataset_file, sequence_len):
+    with open_file(dataset_file, "rt") as f:
+        lines = [line for line in f if line.strip()]
+    return list(chunks(lines, sequence_len))
+
+
+def write_subsample(filepath, sequences, permutation, fraction):
+    with open_file(filepath, "wt") as f:
+        for index in permutation[: ceil(fraction * len(permutation))]:
+            f.writelines(sequences[index])
+
+
+def split_validation(sequences, fraction):
+    """
+    Split a random fraction of the sequences off for validation. Returns the validation
+    sequences and the remaining sequences with a random permutation of them.
+    """
+    permutation = np.random.permutation(len(sequences))
+    validation_count = ceil(fraction * len(sequences))
+    validation = [sequences[index] for index in permutation[:validation_count]]
+    training = [sequences[index] for index in permutation[validation_count:]]
+    return validation, training, np.random.permutation(len(training))
+
+
+def score_output(output_file, metric):
+    """
+    Calculate the metric (f1, accuracy, precision or recall) of an IDS IPAL output.
+    """
+    counts = np.zeros((2, 2), dtype=np.int64)
+    with open_file(output_file, "rt") as f:
+        for packet in read_packets(f):
+            counts[int(packet["malicious"]), int(bool(packet["ids"]))] += 1
+
+    (true_negative, false_positive), (false_negative, true_positive) = counts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.float64(true_positive) / (true_positive + false_positive)
+        recall = np.float64(true_positive) / (true_positive + false_negative)
+        scores = {
+            "accuracy": np.float64(true_positive + true_negative) / counts.sum(),
+            "precision": precision,
+            "recall": recall,
+            "f1": 2 * precision * recall / (precision + recall),
+        }
+    # undefined metrics count as worst possible score
+    return float(np.nan_to_num(scores[metric], nan=0.0))
+
+
+def evaluate(job):
+    """
+    Train and evaluate one candidate on one fold. Runs in a worker process.
+    """
+    ids_name, config, train_file, live_file, prefix, args = job
+    config_file = prefix.with_suffix(".config")
+    output_file = prefix.with_suffix(".output.ipal.gz")
+    config = {ids_name: {**config, "model-file": str(prefix.with_suffix(".model"))}}
+    with open(config_file, "w") as f:
+        json.dump(config, f, indent=2)
+
+    try:
+        subprocess.run(
+            [
+                args.metaids_command,
+                "--config",
+                str(config_file),
+                "--train.ipal",
+                str(train_file),
+                "--live.ipal",
+                str(live_file),
+                "--output",
+                str(output_file),
+                "--log",
+                "warning",
+                "--retrain",
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        if args.extend_alarms:
+            subprocess.run(
+                [args.extend_alarms_command, str(output_file)],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+        return score_output(output_file, args.metric)
+    except subprocess.CalledProcessError as e:
+        # failing candidates are eliminated
+        eprint(f"Candidate {prefix.name} failed with exit code {e.returncode}")
+        return float("-inf")
+    finally:
+        for path in prefix.parent.glob(f"{prefix.name}.*"):
+            path.unlink()
+
+
+def write_back(config_text, ids_config, names, values):
+    """
+    Replace the values of the tuned hyperparameters in the config text, keeping
+    everything else as it is. Every hyperparameter is expected on a single line.
+    """
+    for name, value in zip(names, values):
+        value = [value] if isinstance(ids_config.get(name), list) else value
+        pattern = re.compile(
+            rf"^(\s*){re.escape(json.dumps(name))}: .*?(,?)$", re.MULTILINE
+        )
+        config_text, count = pattern.subn(
+            lambda match: f"{match.group(1)}{json.dumps(name)}: {json.dumps(value)}"
+            f"{match.group(2)}",
+            config_text,
+            count=1,
+        )
+        if count == 0:
+            raise ValueError(
+                f"Hyperparameter '{name}' not found in config, add it to write it back"
+            )
+    return config_text
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tune the hyperparameters of an IDS config using successive halving"
+    )
+    parser.add_argument(
+        "config_file",
+        type=pathlib.Path,
+        help="IDS config with the hyperparameter values to try as lists",
+    )
+    parser.add_argument(
+        "-d",
+        "--dataset",
+        nargs="+",
+        required=True,
+        type=pathlib.Path,
+        help="Dataset parts (ipal, optionally gzipped). Each fold leaves one of them out "
+        "as test part, which is never read, and tunes on the others",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-file",
+        type=pathlib.Path,
+        help="Write the tuned config to that location (defaults to the input config)",
+    )
+    parser.add_argument(
+        "-g",
+        "--grid",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("NAME", "VALUES"),
+        help='Values to try for a hyperparameter as JSON list, e.g. "C" "[1, 10, 100]" '
+        "(can be repeated, overrides the values in the config)",
+    )
+    parser.add_argument(
+        "-f",
+        "--folds",
+        type=int,
+        default=1,
+        help="Number of folds to evaluate each candidate on (defaults to 1)",
+    )
+    parser.add_argument(
+        "--validation-fraction",
+        type=float,
+        default=0.2,
+        help="Fraction of the training parts of each fold held out for validation "
+        "(defaults to 0.2)",
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        default="packet-by-packet",
+        choices=["packet-by-packet", "sequence-of-four"],
+        help="Subsample packets individually or in sequences of four (defaults to "
+        "packet-by-packet)",
+    )
+    parser.add_argument(
+        "--metric",
+        default="f1",
+        choices=["f1", "accuracy", "precision", "recall"],
+        help="Metric to select candidates by (defaults to f1)",
+    )
+    parser.add_argument(
+        "--eta",
+        type=int,
+        default=3,
+        help="Only the best 1/eta candidates advance to the next round (defaults to 3)",
+    )
+    parser.add_argument(
+        "--max-fraction",
+        type=float,
+        default=1.0,
+        help="Fraction of the training parts used in the last round (defaults to 1)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of candidates to evaluate in parallel (defaults to 1)",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        help="Seed for subsampling to make the search reproducible (optional)",
+    )
+    parser.add_argument(
+        "-w",
+        "--work-directory",
+        type=pathlib.Path,
+        help="Directory for temporary files (defaults to the system's temporary directory)",
+    )
+    parser.add_argument(
+        "--extend-alarms",
+        action="store_true",
+        help="Run ipal-extend-alarms on the IDS output before evaluating it (for BLSTM)",
+    )
+    parser.add_argument(
+        "--metaids-command", default="ipal-iids", help="Defaults to ipal-iids"
+    )
+    parser.add_argument(
+        "--extend-alarms-command",
+        default="ipal-extend-alarms",
+        help="Defaults to ipal-extend-alarms",
+    )
+    args = parser.parse_args()
+
+    if not 1 <= args.folds <= len(args.dataset) or len(args.dataset) < 2:
+        parser.error("folds must be between 1 and the number of dataset parts (>= 2)")
+    if not 0 < args.validation_fraction < 1:
+        parser.error("the validation fraction must be between 0 and 1")
+    if args.seed is not None:
+        np.random.seed(args.seed)
+
+    config_text = args.config_file.read_text()
+    config = json.loads(config_text)
+    assert len(config) == 1, "Expected a config with a single IDS"
+    ids_name, ids_config = next(iter(config.items()))
+
+    grid = {name: json.loads(values) for (name, values) in args.grid}
+    names, candidates = expand_grid(ids_config, grid)
+    eprint(f"Tuning {', '.join(names) or 'nothing'}: {len(candidates)} candidates")
+
+    # number of rounds such that a single candidate remains at the end, i.e. the
+    # smallest round_count with eta ** round_count >= len(candidates)
+    round_count = 0
+    while args.eta**round_count < len(candidates):
+        round_count += 1
+    sequence_len = 4 if args.mode == "sequence-of-four" else 1
+    scores = [0.0] * len(candidates)
+    remaining = list(range(len(candidates)))
+
+    with tempfile.TemporaryDirectory(
+        dir=args.work_directory
+    ) as work_directory, concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        work_directory = pathlib.Path(work_directory)
+
+        # the training parts of each fold without the validation split in random
+        # order; subsamples are prefixes of it and hence grow from round to round
+        folds = []
+        validation_files = []
+        for fold in range(args.folds):
+            sequences = []
+            for dataset_file in args.dataset[:fold] + args.dataset[fold + 1 :]:
+                sequences.extend(read_sequences(dataset_file, sequence_len))
+            validation, training, permutation = split_validation(
+                sequences, args.validation_fraction
+            )
+            validation_file = work_directory / f"validation_fold-{fold}.ipal.gz"
+            write_subsample(
+                validation_file, validation, np.arange(len(validation)), 1.0
+            )
+            validation_files.append(validation_file)
+            folds.append((training, permutation))
+
+        for round_index in range(round_count):
+            fraction = args.max_fraction / args.eta ** (round_count - 1 - round_index)
+            train_files = []
+            for fold, (sequences, permutation) in enumerate(folds):
+                train_file = work_directory / f"round-{round_index}_fold-{fold}.ipal.gz"
+                write_subsample(train_file, sequences, permutation, fraction)
+                train_files.append(train_file)
+
+            jobs = [
+                (
+                    ids_name,
+                    candidate_config(ids_config, names, candidates[candidate]),
+                    train_file,
+                    validation_files[fold],
+                    work_directory
+                    / f"round-{round_index}_candidate-{candidate}_fold-{fold}",
+                    args,
+                )
+                for candidate in remaining
+                for (fold, train_file) in enumerate(train_files)
+            ]
+            results = list(pool.map(evaluate, jobs))
+            for i, candidate in enumerate(remaining):
+                fold_scores = results[i * args.folds : (i + 1) * args.folds]
+                scores[candidate] = sum(fold_scores) / args.folds
+
+            for train_file in train_files:
+                train_file.unlink()
+
+            remaining.sort(key=lambda candidate: scores[candidate], reverse=True)
+            eprint(
+                f"\n----- Round {round_index + 1}/{round_count}: {fraction:.2%} -----"
+            )
+            eprint(
+                tabulate(
+                    [
+                        [*candidates[candidate], scores[candidate]]
+                        for candidate in remaining
+                    ],
+                    headers=[*names, args.metric],
+                )
+            )
+            remaining = remaining[: ceil(len(remaining) / args.eta)]
+
+    winner = candidates[remaining[0]]
+    eprint(f"\nWinner: {dict(zip(names, winner))}")
+    output_file = args.output_file if args.output_file is not None else args.config_file
+    output_file.write_text(write_back(config_text, ids_config, names, winner))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,18 @@
+import argparse
+import io
+import shlex
 import sys
 import gzip
+import json
+import numpy as np
+from itertools import islice
+from math import floor
+from pathlib import Path
+from encoding import decode_packets
+
+# decompressed contents of files kept in memory by the daemon (see ml-and-ids.py),
+# keyed by resolved path
+_preloaded_files = {}
 
 
 def eprint(*args):
@@ -7,9 +20,26 @@ def eprint(*args):
 
 
 def open_file(filepath, mode):
+    if _preloaded_files and mode == "rt":
+        path = Path(filepath).resolve()
+        if path in _preloaded_files:
+            mtime, content = _preloaded_files[path]
+            if mtime == path.stat().st_mtime:
+                return io.StringIO(content)
     return (gzip.open if filepath.suffix == ".gz" else open)(filepath, mode)
 
 
+def preload_files(filepaths):
+    """
+    Keep the decompressed contents of the files in memory. Subsequent calls of
+    open_file() in text mode read them from memory as long as the files are unchanged.
+    """
+    for filepath in map(Path, filepaths):
+        with open_file(filepath, "rt") as f:
+            content = f.read()
+        _preloaded_files[filepath.resolve()] = (filepath.stat().st_mtime, content)
+
+
 def get_attack_details(ipal_entry):
     """
     Parse the attack-details IPAL field.
@@ -33,3 +63,109 @@ def chunks(list, n):
     """
     for i in range(0, len(list), n):
         yield list[i : i + n]
+
+
+def random_partition(count, part_count):
+    """
+    Randomly partition the indices 0, ..., count - 1 into part_count parts of equal size.
+    """
+    # random permutation of indices
+    permutation = np.random.permutation(count)
+
+    # partition the permutation into the parts
+    part_length = count / part_count
+    parts = [
+        permutation[floor(i * part_length) : floor((i + 1) * part_length)]
+        for i in range(part_count)
+    ]
+
+    assert (
+        sum([len(part) for part in parts]) == count
+    ), "Not all sequences are assigned to parts. Numerical problem?"
+    return parts
+
+
+def chunked(iterable, n):
+    """
+    Partition an iterable into successive lists of (at most) n elements without
+    materializing the whole iterable first.
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, n)):
+        yield chunk
+
+
+def read_packets(file):
+    """
+    Lazily parse the IPAL packets in file, skipping empty lines. Packets in the compact
+    format (see encoding.py) are decoded.
+    """
+    return decode_packets(json.loads(line) for line in file if line.strip())
+
+
+def add_filter_arguments(parser):
+    """
+    Add the arguments specifying a filter on attack types and categories to parser.
+    """
+    parser.add_argument(
+        "-m",
+        "--mode",
+        required=True,
+        choices=["packet-by-packet", "sequence-of-four"],
+        help="Should each packet be considered individually or should each sequence of four packets be considered one unit",
+    )
+    types_group = parser.add_mutually_exclusive_group()
+    types_group.add_argument(
+        "--except-types",
+        nargs="*",
+        type=int,
+        help="Specify attack types to filter out (block list)",
+    )
+    types_group.add_argument(
+        "--only-types",
+        nargs="*",
+        type=int,
+        help="Specify the only attack types to keep (allow list)",
+    )
+    categories_group = parser.add_mutually_exclusive_group()
+    categories_group.add_argument(
+        "--except-categories",
+        nargs="*",
+        type=int,
+        help="Specify attack categories to filter out (block list)",
+    )
+    categories_group.add_argument(
+        "--only-categories",
+        nargs="*",
+        type=int,
+        help="Specify the only attack categories to keep (allow list)",
+    )
+
+
+def parse_filter(filter_string, prog=None):
+    """
+    Parse a filter given as filter-dataset.py arguments in one string.
+    """
+    filter_parser = argparse.ArgumentParser(prog=prog, add_help=False)
+    add_filter_arguments(filter_parser)
+    return filter_parser.parse_args(shlex.split(filter_string))
+
+
+def filter_mask(categories, types, filter_args):
+    """
+    Return a mask of the packets which are kept by the filter given as parsed arguments
+    (see add_filter_arguments). A sequence is removed if any of its packets is blocked.
+    """
+    blocked = np.zeros(len(types), dtype=bool)
+    if filter_args.except_categories is not None:
+        blocked |= np.isin(categories, filter_args.except_categories)
+    if filter_args.only_categories is not None:
+        blocked |= ~np.isin(categories, filter_args.only_categories)
+    if filter_args.except_types is not None:
+        blocked |= np.isin(types, filter_args.except_types)
+    if filter_args.only_types is not None:
+        blocked |= ~np.isin(types, filter_args.only_types)
+
+    sequence_len = 4 if filter_args.mode == "sequence-of-four" else 1
+    sequence_index = np.arange(len(types)) // sequence_len
+    return ~np.isin(sequence_index, sequence_index[blocked])